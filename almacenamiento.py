@@ -0,0 +1,794 @@
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+import httpx
+from supabase import create_client
+from supabase.lib.client_options import ClientOptions
+
+import metricas
+
+logger = logging.getLogger(__name__)
+
+# --- ALMACENAMIENTO ---
+# Toda la lectura y escritura de usuarios, movimientos, presupuestos y agregados
+# pasa por un objeto `Almacenamiento`. Hay dos implementaciones: Supabase (la
+# de producción) y SQLite embebido, para instalaciones propias sin red y para
+# pruebas de carga y benchmarks. Las filas se intercambian como dicts con las
+# mismas columnas que las tablas de Supabase; `fecha` siempre en ISO (YYYY-MM-DD).
+
+COLUMNAS_MOVIMIENTOS = ["id", "fecha", "tipo", "categoria", "valor", "descripcion", "forma_pago"]
+COLUMNAS_RESUMEN = ["anio", "mes", "tipo", "categoria", "forma_pago", "total", "cantidad"]
+
+
+class Almacenamiento:
+    """Interfaz común de los motores de almacenamiento."""
+
+    def disponible(self, elemento):
+        """True si el esquema tiene `elemento` (ver _SONDAS); False si falta su migración de sql/."""
+        return True
+
+    # Usuarios
+    def crear_usuario(self, nombre, usuario, password):
+        raise NotImplementedError
+
+    def buscar_usuario(self, usuario):
+        """Fila de `usuarios` (id, password) o None."""
+        raise NotImplementedError
+
+    def actualizar_password(self, usuario_id, password):
+        raise NotImplementedError
+
+    # Movimientos
+    def insertar_movimientos(self, filas):
+        """Inserta las filas y las devuelve tal como quedaron guardadas (con `id`).
+
+        Las filas con `clave_idempotencia` que ya se guardaron antes no se
+        duplican: se devuelven con el `id` que recibieron la primera vez.
+        """
+        raise NotImplementedError
+
+    def eliminar_movimientos(self, usuario_id, ids):
+        raise NotImplementedError
+
+    def lote_movimientos(self, usuario_id, desde_id, tamano):
+        """Hasta `tamano` movimientos con `id > desde_id`, en orden de id."""
+        raise NotImplementedError
+
+    def lote_ids(self, usuario_id, desde_id, tamano):
+        raise NotImplementedError
+
+    def resumen_movimientos(self, usuario_id):
+        """(cantidad, suma de ids) de los movimientos; la suma puede ser None."""
+        raise NotImplementedError
+
+    def pagina_movimientos(self, usuario_id, tamano, cursor=None):
+        """Hasta `tamano` movimientos en orden (fecha desc, id desc) después de `cursor`."""
+        raise NotImplementedError
+
+    def buscar_movimientos(self, usuario_id, filtros, limite, desplazamiento=0):
+        """Búsqueda con facetas; `filtros` son los campos de busqueda.Filtros más `terminos`.
+
+        Devuelve {"grupos": [(categoria, forma_pago, tipo, cantidad)] contando solo
+        los filtros de texto, valor y fecha, "filas": hasta `limite` movimientos con
+        todos los filtros en orden (fecha desc, id desc) desde `desplazamiento`}.
+        """
+        raise NotImplementedError
+
+    # Presupuestos
+    def presupuesto(self, usuario_id, anio):
+        """Fila de `presupuestos` del año o un dict vacío."""
+        raise NotImplementedError
+
+    def presupuestos(self, usuario_id):
+        raise NotImplementedError
+
+    def guardar_presupuesto(self, fila):
+        raise NotImplementedError
+
+    def limites_categoria(self, usuario_id):
+        """Todas las filas de `limites_categoria` del usuario (anio, mes, categoria, limite)."""
+        raise NotImplementedError
+
+    def guardar_limites_categoria(self, filas):
+        """Inserta o reemplaza los límites dados; un límite 0 significa sin límite."""
+        raise NotImplementedError
+
+    # Sesiones revocadas
+    def revocar_sesion(self, nonce, expira):
+        """Guarda el nonce de un token revocado hasta `expira` (epoch) y olvida los ya vencidos."""
+        raise NotImplementedError
+
+    def sesion_revocada(self, nonce):
+        raise NotImplementedError
+
+    # Movimientos recurrentes
+    def reglas_recurrentes(self, usuario_id=None):
+        """Reglas del usuario (activas o no); sin `usuario_id`, las activas de todos."""
+        raise NotImplementedError
+
+    def guardar_regla_recurrente(self, fila):
+        """Crea la regla, o la actualiza si trae `id`, y la devuelve guardada."""
+        raise NotImplementedError
+
+    def eliminar_regla_recurrente(self, usuario_id, regla_id):
+        raise NotImplementedError
+
+    def marcar_regla_recurrente(self, regla_id, ultima_fecha):
+        """Avanza `ultima_fecha` (última ocurrencia ya generada); nunca la retrocede."""
+        raise NotImplementedError
+
+    # Agregados
+    def estadisticas(self, usuario_id, desde=None, hasta=None, mes=None):
+        """Filas (periodo, semana, tipo, categoria, total, cantidad); `hasta` exclusivo."""
+        raise NotImplementedError
+
+    def resumen_mensual(self, usuario_id):
+        """Filas (anio, mes, tipo, categoria, forma_pago, total, cantidad) del resumen mensual."""
+        raise NotImplementedError
+
+    def reconstruir_resumen_mensual(self, usuario_id=None):
+        """Recalcula el resumen mensual desde los movimientos (de un usuario o de todos)."""
+        raise NotImplementedError
+
+
+# --- SUPABASE ---
+TIMEOUT_SEGUNDOS = httpx.Timeout(15.0, connect=5.0)
+REINTENTOS = 3
+# Tope de filas que PostgREST devuelve por petición (max-rows de Supabase)
+FILAS_POR_PETICION = 1000
+ESPERA_BASE_SEGUNDOS = 0.2
+
+# Errores en los que la petición no llegó al servidor: se pueden reintentar siempre
+_ERRORES_CONEXION = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# Errores transitorios después de enviar la petición: solo se reintentan lecturas
+_ERRORES_TRANSITORIOS = (httpx.TransportError,)
+# Códigos (PostgREST y Postgres) de una función, tabla o columna que no existe:
+# la migración de sql/ correspondiente no está instalada
+_CODIGOS_FALTA_ESQUEMA = {"PGRST202", "42883", "PGRST205", "42P01", "PGRST204", "42703"}
+
+
+def _medir_respuesta(respuesta):
+    # Hook de httpx: el cuerpo aún no se leyó, así que se lee aquí para medirlo
+    respuesta.read()
+    ruta = respuesta.request.url.path.split("/rest/v1", 1)[-1]
+    metricas.observar("supabase_bytes", len(respuesta.content), operacion=f"{respuesta.request.method} {ruta}")
+
+
+def crear_cliente(url, key):
+    cliente = create_client(url, key, options=ClientOptions(postgrest_client_timeout=TIMEOUT_SEGUNDOS))
+    sesion = cliente.postgrest.session
+    sesion.event_hooks = {**sesion.event_hooks, "response": sesion.event_hooks["response"] + [_medir_respuesta]}
+    return cliente
+
+
+def ejecutar(consulta, idempotente=True):
+    """Ejecuta una consulta de postgrest con reintentos y espera exponencial con jitter.
+
+    Las escrituras no idempotentes (`idempotente=False`) solo se reintentan si la
+    conexión no llegó a establecerse, para no duplicar un insert que sí se aplicó.
+    Reintentos y fallos quedan registrados en `metricas`.
+    """
+    operacion = f"{getattr(consulta, 'http_method', '')} {getattr(consulta, 'path', '')}".strip()
+    reintentables = _ERRORES_TRANSITORIOS if idempotente else _ERRORES_CONEXION
+    for intento in range(REINTENTOS + 1):
+        try:
+            return consulta.execute()
+        except reintentables as e:
+            if intento == REINTENTOS:
+                metricas.incrementar("supabase_errores", operacion=operacion, error=type(e).__name__)
+                raise
+            metricas.incrementar("supabase_reintentos", operacion=operacion, error=type(e).__name__)
+            logger.warning("Reintentando %s tras %s (intento %d)", operacion, type(e).__name__, intento + 1)
+            time.sleep(random.uniform(0, ESPERA_BASE_SEGUNDOS * 2 ** intento))
+        except Exception as e:
+            metricas.incrementar("supabase_errores", operacion=operacion, error=type(e).__name__)
+            raise
+
+
+def _falta_en_esquema(error):
+    """True si el error dice que la función, tabla o columna no existe."""
+    return getattr(error, "code", None) in _CODIGOS_FALTA_ESQUEMA
+
+
+def _filtro_or(consulta, expresion):
+    # postgrest-py 0.10 no expone `or_`; se añade el parámetro directamente
+    consulta.params = consulta.params.add("or", f"({expresion})")
+    return consulta
+
+
+def _todas(construir, orden):
+    """Todas las filas de una consulta, en páginas de FILAS_POR_PETICION.
+
+    PostgREST corta cada respuesta en FILAS_POR_PETICION filas sin avisar, así
+    que se pide página a página con `order`, `limit` y `offset` hasta recibir
+    una incompleta. `construir()` devuelve la consulta sin ejecutar; sirve tanto
+    para tablas como para funciones (rpc) que devuelven filas. `orden` son las
+    columnas que fijan el orden ("anio,mes"), necesario para paginar sin saltos.
+    """
+    filas = []
+    while True:
+        consulta = construir()
+        consulta.params = consulta.params.add("order", orden).add("limit", FILAS_POR_PETICION).add("offset", len(filas))
+        lote = ejecutar(consulta).data
+        filas += lote
+        if len(lote) < FILAS_POR_PETICION:
+            return filas
+
+
+# Consulta mínima que falla si no se instaló la migración de cada elemento opcional
+_SONDAS = {
+    "recurrentes": ("recurrentes.sql", lambda cliente: cliente.table("recurrentes").select("id").limit(1)),
+    "limites_categoria": ("limites_categoria.sql", lambda cliente: cliente.table("limites_categoria").select("anio").limit(1)),
+    "clave_idempotencia": ("idempotencia.sql", lambda cliente: cliente.table("movimientos").select("clave_idempotencia").limit(1)),
+    "sesiones_revocadas": ("sesiones.sql", lambda cliente: cliente.table("sesiones_revocadas").select("nonce").limit(1)),
+}
+
+
+class AlmacenamientoSupabase(Almacenamiento):
+    """Tablas de Supabase vía PostgREST. Los agregados usan las funciones de sql/."""
+
+    def __init__(self, cliente):
+        self.cliente = cliente
+        self._rpc_resumen_disponible = True
+        self._disponibles = {}
+
+    def disponible(self, elemento):
+        # Se comprueba una vez por proceso; un error que no es de esquema no se recuerda
+        if elemento not in self._disponibles:
+            archivo, sonda = _SONDAS[elemento]
+            try:
+                ejecutar(sonda(self.cliente))
+                self._disponibles[elemento] = True
+            except Exception as e:
+                if not _falta_en_esquema(e):
+                    raise
+                logger.warning("Falta %s en Supabase: ejecuta sql/%s para activarlo", elemento, archivo)
+                self._disponibles[elemento] = False
+        return self._disponibles[elemento]
+
+    def _movimientos(self, columnas=COLUMNAS_MOVIMIENTOS):
+        return self.cliente.table("movimientos").select(", ".join(columnas))
+
+    def crear_usuario(self, nombre, usuario, password):
+        resp = ejecutar(self.cliente.table("usuarios").insert({
+            "nombre": nombre,
+            "usuario": usuario,
+            "password": password
+        }), idempotente=False)
+        return resp.data[0] if resp.data else {"nombre": nombre, "usuario": usuario}
+
+    def buscar_usuario(self, usuario):
+        resp = ejecutar(self.cliente.table("usuarios").select("id, password").eq("usuario", usuario))
+        return resp.data[0] if resp.data else None
+
+    def actualizar_password(self, usuario_id, password):
+        ejecutar(self.cliente.table("usuarios").update({"password": password}).eq("id", usuario_id))
+
+    def insertar_movimientos(self, filas):
+        filas = list(filas)
+        if any(fila.get("clave_idempotencia") for fila in filas) and not self.disponible("clave_idempotencia"):
+            # Sin sql/idempotencia.sql la clave no se puede guardar: insert simple,
+            # y un reenvío tras un timeout puede duplicar el movimiento
+            filas = [{k: v for k, v in fila.items() if k != "clave_idempotencia"} for fila in filas]
+        elif filas and all(fila.get("clave_idempotencia") for fila in filas):
+            # Con la clave, reintentar es seguro
+            consulta = self.cliente.table("movimientos").upsert(filas, on_conflict="clave_idempotencia")
+            return ejecutar(consulta).data
+        resp = ejecutar(self.cliente.table("movimientos").insert(filas), idempotente=False)
+        return resp.data
+
+    def eliminar_movimientos(self, usuario_id, ids):
+        ejecutar(self.cliente.table("movimientos").delete().eq("usuario_id", usuario_id).in_("id", list(ids)))
+
+    def lote_movimientos(self, usuario_id, desde_id, tamano):
+        resp = ejecutar(self._movimientos().eq("usuario_id", usuario_id).gt("id", desde_id).order("id").limit(tamano))
+        return resp.data
+
+    def lote_ids(self, usuario_id, desde_id, tamano):
+        resp = ejecutar(self._movimientos(["id"]).eq("usuario_id", usuario_id).gt("id", desde_id).order("id").limit(tamano))
+        return [fila["id"] for fila in resp.data]
+
+    def resumen_movimientos(self, usuario_id):
+        # Usa la función `resumen_movimientos` (ver sql/sincronizacion.sql). Si no
+        # está instalada se cae a un conteo exacto y la suma se devuelve como None.
+        if self._rpc_resumen_disponible:
+            try:
+                resp = ejecutar(self.cliente.rpc("resumen_movimientos", {"p_usuario_id": usuario_id}))
+                fila = resp.data[0] if isinstance(resp.data, list) else resp.data
+                return int(fila["total"]), int(fila["suma_ids"] or 0)
+            except Exception as e:
+                # Solo la falta de la función desactiva el RPC; un fallo pasajero no
+                if not _falta_en_esquema(e):
+                    raise
+                logger.warning("Función resumen_movimientos no instalada; se usa un conteo exacto")
+                self._rpc_resumen_disponible = False
+        resp = ejecutar(self.cliente.table("movimientos").select("id", count="exact").eq("usuario_id", usuario_id).limit(1))
+        return resp.count, None
+
+    def pagina_movimientos(self, usuario_id, tamano, cursor=None):
+        consulta = self._movimientos().eq("usuario_id", usuario_id)
+        if cursor is not None:
+            fecha, id_mov = cursor
+            _filtro_or(consulta, f"fecha.lt.{fecha},and(fecha.eq.{fecha},id.lt.{id_mov})")
+        resp = ejecutar(consulta.order("fecha", desc=True).order("id", desc=True).limit(tamano))
+        return resp.data
+
+    def buscar_movimientos(self, usuario_id, filtros, limite, desplazamiento=0):
+        # Usa la función `buscar_movimientos` de sql/busqueda.sql: una sola petición
+        # con los conteos y la página, y el texto resuelto con el índice tsvector
+        resp = ejecutar(self.cliente.rpc("buscar_movimientos", {
+            "p_usuario_id": usuario_id,
+            "p_consulta": " & ".join(f"{t}:*" for t in filtros["terminos"]) or None,
+            "p_categorias": list(filtros["categorias"]) or None,
+            "p_formas_pago": list(filtros["formas_pago"]) or None,
+            "p_tipo": filtros["tipo"],
+            "p_valor_min": filtros["valor_min"],
+            "p_valor_max": filtros["valor_max"],
+            "p_desde": filtros["desde"].isoformat() if filtros["desde"] else None,
+            "p_hasta": filtros["hasta"].isoformat() if filtros["hasta"] else None,
+            "p_limite": limite,
+            "p_desplazamiento": desplazamiento,
+        }))
+        return resp.data
+
+    def presupuesto(self, usuario_id, anio):
+        resp = ejecutar(self.cliente.table("presupuestos").select("*").eq("usuario_id", usuario_id).eq("anio", anio))
+        return resp.data[0] if resp.data else {}
+
+    def presupuestos(self, usuario_id):
+        resp = ejecutar(self.cliente.table("presupuestos").select("*").eq("usuario_id", usuario_id).order("anio"))
+        return resp.data
+
+    def guardar_presupuesto(self, fila):
+        resp = ejecutar(self.cliente.table("presupuestos").upsert(fila))
+        return resp.data[0] if resp.data else {}
+
+    def limites_categoria(self, usuario_id):
+        # Sin sql/limites_categoria.sql el usuario simplemente no tiene límites;
+        # muchos años de límites pasan del tope de filas de PostgREST
+        if not self.disponible("limites_categoria"):
+            return []
+        return _todas(lambda: self.cliente.table("limites_categoria").select("anio, mes, categoria, limite").eq("usuario_id", usuario_id),
+                      "anio,mes,categoria")
+
+    def guardar_limites_categoria(self, filas):
+        for inicio in range(0, len(filas), FILAS_POR_PETICION):
+            ejecutar(self.cliente.table("limites_categoria").upsert(
+                filas[inicio:inicio + FILAS_POR_PETICION], on_conflict="usuario_id,anio,mes,categoria"))
+
+    def revocar_sesion(self, nonce, expira):
+        if not self.disponible("sesiones_revocadas"):
+            return
+        ejecutar(self.cliente.table("sesiones_revocadas").upsert({"nonce": nonce, "expira": expira}))
+        ejecutar(self.cliente.table("sesiones_revocadas").delete().lt("expira", int(time.time())))
+
+    def sesion_revocada(self, nonce):
+        if not self.disponible("sesiones_revocadas"):
+            return False
+        return bool(ejecutar(self.cliente.table("sesiones_revocadas").select("nonce").eq("nonce", nonce).limit(1)).data)
+
+    def reglas_recurrentes(self, usuario_id=None):
+        # Sin sql/recurrentes.sql no hay reglas
+        if not self.disponible("recurrentes"):
+            return []
+
+        def consulta():
+            consulta = self.cliente.table("recurrentes").select("*")
+            return consulta.eq("usuario_id", usuario_id) if usuario_id is not None else consulta.eq("activa", True)
+
+        return _todas(consulta, "id")
+
+    def guardar_regla_recurrente(self, fila):
+        if fila.get("id") is not None:
+            cambios = {k: v for k, v in fila.items() if k not in ("id", "usuario_id")}
+            resp = ejecutar(self.cliente.table("recurrentes").update(cambios)
+                            .eq("id", fila["id"]).eq("usuario_id", fila["usuario_id"]))
+        else:
+            resp = ejecutar(self.cliente.table("recurrentes").insert(fila), idempotente=False)
+        return resp.data[0] if resp.data else {}
+
+    def eliminar_regla_recurrente(self, usuario_id, regla_id):
+        ejecutar(self.cliente.table("recurrentes").delete().eq("usuario_id", usuario_id).eq("id", regla_id))
+
+    def marcar_regla_recurrente(self, regla_id, ultima_fecha):
+        consulta = self.cliente.table("recurrentes").update({"ultima_fecha": ultima_fecha}).eq("id", regla_id)
+        ejecutar(_filtro_or(consulta, f"ultima_fecha.is.null,ultima_fecha.lt.{ultima_fecha}"))
+
+    def estadisticas(self, usuario_id, desde=None, hasta=None, mes=None):
+        # Una fila por (mes, semana, tipo, categoría): con varios años pasa del tope de filas
+        parametros = {
+            "p_usuario_id": usuario_id,
+            "p_desde": desde.isoformat() if desde else None,
+            "p_hasta": hasta.isoformat() if hasta else None,
+            "p_mes": mes
+        }
+        return _todas(lambda: self.cliente.rpc("estadisticas_movimientos", parametros), "periodo,semana,tipo,categoria")
+
+    def resumen_mensual(self, usuario_id):
+        # Tabla mantenida por el trigger de sql/resumen_mensual.sql
+        return _todas(lambda: self.cliente.table("resumen_mensual").select(", ".join(COLUMNAS_RESUMEN)).eq("usuario_id", usuario_id),
+                      "anio,mes,tipo,categoria,forma_pago")
+
+    def reconstruir_resumen_mensual(self, usuario_id=None):
+        ejecutar(self.cliente.rpc("reconstruir_resumen_mensual", {"p_usuario_id": usuario_id}))
+
+
+# --- SQLITE ---
+ESQUEMA_SQLITE = """
+create table if not exists usuarios (
+    id integer primary key autoincrement,
+    nombre text,
+    usuario text not null unique,
+    password text not null
+);
+create table if not exists movimientos (
+    id integer primary key autoincrement,
+    usuario_id integer not null references usuarios(id),
+    fecha text not null,
+    tipo text not null,
+    categoria text not null,
+    valor real not null,
+    descripcion text,
+    forma_pago text,
+    created_at text not null default current_timestamp,
+    clave_idempotencia text
+);
+create index if not exists movimientos_usuario_fecha_idx on movimientos (usuario_id, fecha, id);
+create table if not exists presupuestos (
+    usuario_id integer not null references usuarios(id),
+    anio integer not null,
+    ahorro_meta real not null default 0,
+    inversion_meta real not null default 0,
+    primary key (usuario_id, anio)
+);
+create table if not exists limites_categoria (
+    usuario_id integer not null references usuarios(id),
+    anio integer not null,
+    mes integer not null,
+    categoria text not null,
+    limite real not null default 0,
+    primary key (usuario_id, anio, mes, categoria)
+);
+create table if not exists recurrentes (
+    id integer primary key autoincrement,
+    usuario_id integer not null references usuarios(id),
+    tipo text not null,
+    categoria text not null,
+    valor real not null,
+    descripcion text,
+    forma_pago text,
+    frecuencia text not null,
+    intervalo integer not null default 1,
+    inicio text not null,
+    fin text,
+    ultima_fecha text,
+    activa integer not null default 1
+);
+create index if not exists recurrentes_usuario_idx on recurrentes (usuario_id);
+create table if not exists sesiones_revocadas (
+    nonce text primary key,
+    expira integer not null
+);
+create table if not exists resumen_mensual (
+    usuario_id integer not null,
+    anio integer not null,
+    mes integer not null,
+    tipo text not null,
+    categoria text not null,
+    forma_pago text not null default '',
+    total real not null default 0,
+    cantidad integer not null default 0,
+    primary key (usuario_id, anio, mes, tipo, categoria, forma_pago)
+);
+create trigger if not exists movimientos_resumen_insert after insert on movimientos begin
+    insert into resumen_mensual (usuario_id, anio, mes, tipo, categoria, forma_pago, total, cantidad)
+    values (new.usuario_id, cast(strftime('%Y', new.fecha) as integer), cast(strftime('%m', new.fecha) as integer),
+            new.tipo, new.categoria, coalesce(new.forma_pago, ''), new.valor, 1)
+    on conflict (usuario_id, anio, mes, tipo, categoria, forma_pago)
+    do update set total = round(total + excluded.total, 2), cantidad = cantidad + 1;
+end;
+create trigger if not exists movimientos_resumen_delete after delete on movimientos begin
+    update resumen_mensual set total = round(total - old.valor, 2), cantidad = cantidad - 1
+    where usuario_id = old.usuario_id
+      and anio = cast(strftime('%Y', old.fecha) as integer)
+      and mes = cast(strftime('%m', old.fecha) as integer)
+      and tipo = old.tipo and categoria = old.categoria and forma_pago = coalesce(old.forma_pago, '');
+    delete from resumen_mensual where usuario_id = old.usuario_id and cantidad <= 0;
+end;
+"""
+
+RECONSTRUIR_RESUMEN_SQLITE = """
+insert into resumen_mensual (usuario_id, anio, mes, tipo, categoria, forma_pago, total, cantidad)
+select usuario_id, cast(strftime('%Y', fecha) as integer), cast(strftime('%m', fecha) as integer),
+       tipo, categoria, coalesce(forma_pago, ''), round(sum(valor), 2), count(*)
+from movimientos
+where ? is null or usuario_id = ?
+group by 1, 2, 3, 4, 5, 6
+"""
+
+
+class AlmacenamientoSQLite(Almacenamiento):
+    """Base de datos SQLite embebida con el mismo esquema que Supabase.
+
+    Los ids son AUTOINCREMENT (nunca se reutilizan), igual que en Postgres, lo
+    que mantiene válida la marca de agua de la sincronización incremental.
+    Cada hilo usa su propia conexión; con `ruta=":memory:"` todas comparten una
+    base en memoria del proceso.
+    """
+
+    def __init__(self, ruta="finanzas.db"):
+        self._uri = ruta == ":memory:"
+        self.ruta = f"file:memoria_{id(self)}?mode=memory&cache=shared" if self._uri else ruta
+        self._local = threading.local()
+        # En memoria, la base existe mientras quede una conexión abierta
+        self._ancla = self._conexion()
+        self._ancla.executescript(ESQUEMA_SQLITE)
+        # Bases creadas antes de existir la clave de idempotencia
+        columnas = {fila[1] for fila in self._ancla.execute("pragma table_info(movimientos)")}
+        if "clave_idempotencia" not in columnas:
+            self._ancla.execute("alter table movimientos add column clave_idempotencia text")
+        self._ancla.execute("create unique index if not exists movimientos_clave_idempotencia_idx on movimientos (clave_idempotencia)")
+        # Bases creadas antes de existir el resumen: se rellena una vez
+        vacio = self._ancla.execute("select not exists (select 1 from resumen_mensual)").fetchone()[0]
+        con_datos = self._ancla.execute("select exists (select 1 from movimientos)").fetchone()[0]
+        if vacio and con_datos:
+            self.reconstruir_resumen_mensual()
+
+    def _conexion(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.ruta, timeout=30, uri=self._uri, check_same_thread=False)
+            con.row_factory = sqlite3.Row
+            # lower() de SQLite solo cambia letras ASCII; la búsqueda usa el de Python,
+            # igual que el índice en memoria y Postgres ("Ñame" -> "ñame")
+            con.create_function("minusculas", 1, lambda texto: texto.lower() if texto is not None else None, deterministic=True)
+            if not self._uri:
+                con.execute("pragma journal_mode = wal")
+                con.execute("pragma synchronous = normal")
+            self._local.con = con
+        return con
+
+    def _filas(self, sql, parametros=()):
+        return [dict(fila) for fila in self._conexion().execute(sql, parametros)]
+
+    def _escribir(self, sql, parametros=()):
+        con = self._conexion()
+        with con:
+            return con.execute(sql, parametros)
+
+    def crear_usuario(self, nombre, usuario, password):
+        cur = self._escribir("insert into usuarios (nombre, usuario, password) values (?, ?, ?)", (nombre, usuario, password))
+        return {"id": cur.lastrowid, "nombre": nombre, "usuario": usuario}
+
+    def buscar_usuario(self, usuario):
+        filas = self._filas("select id, password from usuarios where usuario = ?", (usuario,))
+        return filas[0] if filas else None
+
+    def actualizar_password(self, usuario_id, password):
+        self._escribir("update usuarios set password = ? where id = ?", (password, usuario_id))
+
+    def insertar_movimientos(self, filas):
+        con = self._conexion()
+        insertadas = []
+        with con:
+            for fila in filas:
+                clave = fila.get("clave_idempotencia")
+                cur = con.execute(
+                    "insert into movimientos (usuario_id, fecha, tipo, categoria, valor, descripcion, forma_pago, clave_idempotencia)"
+                    " values (?, ?, ?, ?, ?, ?, ?, ?) on conflict (clave_idempotencia) do nothing",
+                    (fila["usuario_id"], fila["fecha"], fila["tipo"], fila["categoria"], fila["valor"], fila.get("descripcion"), fila.get("forma_pago"), clave),
+                )
+                if cur.rowcount:
+                    insertadas.append(dict(fila, id=cur.lastrowid))
+                else:
+                    # Ya se había guardado en un envío anterior
+                    guardada = con.execute(
+                        f"select {', '.join(COLUMNAS_MOVIMIENTOS)}, usuario_id from movimientos where clave_idempotencia = ?", (clave,)
+                    ).fetchone()
+                    insertadas.append(dict(guardada, clave_idempotencia=clave))
+        return insertadas
+
+    def eliminar_movimientos(self, usuario_id, ids):
+        ids = list(ids)
+        if ids:
+            marcas = ", ".join("?" * len(ids))
+            self._escribir(f"delete from movimientos where usuario_id = ? and id in ({marcas})", [usuario_id] + ids)
+
+    def lote_movimientos(self, usuario_id, desde_id, tamano):
+        return self._filas(
+            f"select {', '.join(COLUMNAS_MOVIMIENTOS)} from movimientos where usuario_id = ? and id > ? order by id limit ?",
+            (usuario_id, desde_id, tamano),
+        )
+
+    def lote_ids(self, usuario_id, desde_id, tamano):
+        filas = self._conexion().execute(
+            "select id from movimientos where usuario_id = ? and id > ? order by id limit ?", (usuario_id, desde_id, tamano)
+        )
+        return [fila[0] for fila in filas]
+
+    def resumen_movimientos(self, usuario_id):
+        total, suma = self._conexion().execute(
+            "select count(*), coalesce(sum(id), 0) from movimientos where usuario_id = ?", (usuario_id,)
+        ).fetchone()
+        return total, suma
+
+    def pagina_movimientos(self, usuario_id, tamano, cursor=None):
+        sql = f"select {', '.join(COLUMNAS_MOVIMIENTOS)} from movimientos where usuario_id = ?"
+        parametros = [usuario_id]
+        if cursor is not None:
+            fecha, id_mov = cursor
+            sql += " and (fecha < ? or (fecha = ? and id < ?))"
+            parametros += [fecha, fecha, id_mov]
+        return self._filas(sql + " order by fecha desc, id desc limit ?", parametros + [tamano])
+
+    def buscar_movimientos(self, usuario_id, filtros, limite, desplazamiento=0):
+        # Sin índice de texto: SQLite es para instalaciones de un solo usuario,
+        # donde el modo local busca en el índice en memoria (busqueda.py)
+        sql = " from movimientos where usuario_id = ?"
+        parametros = [usuario_id]
+        for termino in filtros["terminos"]:
+            # Comienzo de palabra: al principio de la descripción o tras un espacio
+            sql += " and (' ' || minusculas(descripcion)) like ? escape '\\'"
+            parametros.append("% " + termino.replace("_", "\\_") + "%")
+        for columna, operador in (("valor_min", ">="), ("valor_max", "<="), ("desde", ">="), ("hasta", "<=")):
+            if filtros[columna] is not None:
+                sql += f" and {'valor' if columna.startswith('valor') else 'fecha'} {operador} ?"
+                parametros.append(filtros[columna].isoformat() if hasattr(filtros[columna], "isoformat") else filtros[columna])
+        grupos = self._filas(f"select categoria, forma_pago, tipo, count(*) as cantidad{sql} group by 1, 2, 3", parametros)
+
+        for columna, valores in (("categoria", filtros["categorias"]), ("forma_pago", filtros["formas_pago"]),
+                                 ("tipo", [filtros["tipo"]] if filtros["tipo"] else [])):
+            if valores:
+                sql += f" and {columna} in ({', '.join('?' * len(valores))})"
+                parametros += list(valores)
+        filas = self._filas(
+            f"select {', '.join(COLUMNAS_MOVIMIENTOS)}{sql} order by fecha desc, id desc limit ? offset ?",
+            parametros + [limite, desplazamiento],
+        )
+        return {"grupos": grupos, "filas": filas}
+
+    def presupuesto(self, usuario_id, anio):
+        filas = self._filas("select * from presupuestos where usuario_id = ? and anio = ?", (usuario_id, anio))
+        return filas[0] if filas else {}
+
+    def presupuestos(self, usuario_id):
+        return self._filas("select * from presupuestos where usuario_id = ? order by anio", (usuario_id,))
+
+    def guardar_presupuesto(self, fila):
+        self._escribir(
+            "insert into presupuestos (usuario_id, anio, ahorro_meta, inversion_meta) values (?, ?, ?, ?) "
+            "on conflict (usuario_id, anio) do update set ahorro_meta = excluded.ahorro_meta, inversion_meta = excluded.inversion_meta",
+            (fila["usuario_id"], fila["anio"], fila["ahorro_meta"], fila["inversion_meta"]),
+        )
+        return self.presupuesto(fila["usuario_id"], fila["anio"])
+
+    def limites_categoria(self, usuario_id):
+        return self._filas(
+            "select anio, mes, categoria, limite from limites_categoria where usuario_id = ? order by anio, mes, categoria",
+            (usuario_id,),
+        )
+
+    def guardar_limites_categoria(self, filas):
+        con = self._conexion()
+        with con:
+            con.executemany(
+                "insert into limites_categoria (usuario_id, anio, mes, categoria, limite) values (?, ?, ?, ?, ?) "
+                "on conflict (usuario_id, anio, mes, categoria) do update set limite = excluded.limite",
+                [(f["usuario_id"], f["anio"], f["mes"], f["categoria"], f["limite"]) for f in filas],
+            )
+
+    def revocar_sesion(self, nonce, expira):
+        con = self._conexion()
+        with con:
+            con.execute("insert or replace into sesiones_revocadas (nonce, expira) values (?, ?)", (nonce, expira))
+            con.execute("delete from sesiones_revocadas where expira < ?", (int(time.time()),))
+
+    def sesion_revocada(self, nonce):
+        return self._conexion().execute("select 1 from sesiones_revocadas where nonce = ?", (nonce,)).fetchone() is not None
+
+    def reglas_recurrentes(self, usuario_id=None):
+        if usuario_id is None:
+            filas = self._filas("select * from recurrentes where activa order by id")
+        else:
+            filas = self._filas("select * from recurrentes where usuario_id = ? order by id", (usuario_id,))
+        for fila in filas:
+            fila["activa"] = bool(fila["activa"])
+        return filas
+
+    def guardar_regla_recurrente(self, fila):
+        columnas = [c for c in fila if c != "id"]
+        valores = [fila[c] for c in columnas]
+        if fila.get("id") is not None:
+            asignaciones = ", ".join(f"{c} = ?" for c in columnas if c != "usuario_id")
+            self._escribir(f"update recurrentes set {asignaciones} where id = ? and usuario_id = ?",
+                           [fila[c] for c in columnas if c != "usuario_id"] + [fila["id"], fila["usuario_id"]])
+            regla_id = fila["id"]
+        else:
+            cur = self._escribir(f"insert into recurrentes ({', '.join(columnas)}) values ({', '.join('?' * len(columnas))})", valores)
+            regla_id = cur.lastrowid
+        filas = self._filas("select * from recurrentes where id = ?", (regla_id,))
+        return dict(filas[0], activa=bool(filas[0]["activa"])) if filas else {}
+
+    def eliminar_regla_recurrente(self, usuario_id, regla_id):
+        self._escribir("delete from recurrentes where usuario_id = ? and id = ?", (usuario_id, regla_id))
+
+    def marcar_regla_recurrente(self, regla_id, ultima_fecha):
+        self._escribir(
+            "update recurrentes set ultima_fecha = ? where id = ? and (ultima_fecha is null or ultima_fecha < ?)",
+            (ultima_fecha, regla_id, ultima_fecha),
+        )
+
+    def estadisticas(self, usuario_id, desde=None, hasta=None, mes=None):
+        # Mismo resultado que estadisticas_movimientos en sql/estadisticas.sql;
+        # la semana empieza en lunes, como date_trunc('week', ...) de Postgres.
+        sql = (
+            "select strftime('%Y-%m', fecha) as periodo, date(fecha, '-6 days', 'weekday 1') as semana, "
+            "tipo, categoria, sum(valor) as total, count(*) as cantidad "
+            "from movimientos where usuario_id = ?"
+        )
+        parametros = [usuario_id]
+        if desde:
+            sql += " and fecha >= ?"
+            parametros.append(desde.isoformat())
+        if hasta:
+            sql += " and fecha < ?"
+            parametros.append(hasta.isoformat())
+        if mes:
+            sql += " and cast(strftime('%m', fecha) as integer) = ?"
+            parametros.append(mes)
+        return self._filas(sql + " group by 1, 2, 3, 4", parametros)
+
+    def resumen_mensual(self, usuario_id):
+        return self._filas(f"select {', '.join(COLUMNAS_RESUMEN)} from resumen_mensual where usuario_id = ?", (usuario_id,))
+
+    def reconstruir_resumen_mensual(self, usuario_id=None):
+        con = self._conexion()
+        with con:
+            con.execute("delete from resumen_mensual where ? is null or usuario_id = ?", (usuario_id, usuario_id))
+            con.execute(RECONSTRUIR_RESUMEN_SQLITE, (usuario_id, usuario_id))
+
+
+# --- INSTRUMENTACIÓN ---
+class AlmacenamientoMedido:
+    """Envuelve un motor y mide cada llamada a sus métodos públicos.
+
+    Registra `almacen_segundos` y, si devuelve filas, `almacen_filas`, ambas
+    con la etiqueta `operacion` (nombre del método). El resto de atributos se
+    delegan tal cual.
+    """
+
+    def __init__(self, motor):
+        self.motor = motor
+
+    def __getattr__(self, nombre):
+        atributo = getattr(self.motor, nombre)
+        if nombre.startswith("_") or not callable(atributo):
+            return atributo
+
+        def medido(*args, **kwargs):
+            with metricas.medir("almacen", operacion=nombre):
+                resultado = atributo(*args, **kwargs)
+            if isinstance(resultado, list) or hasattr(resultado, "columns"):
+                metricas.observar("almacen_filas", len(resultado), operacion=nombre)
+            return resultado
+
+        return medido
+
+
+def crear_almacenamiento(config):
+    """Crea el motor indicado en la configuración (normalmente `st.secrets`).
+
+    BACKEND = "supabase" (por defecto) usa SUPABASE_URL y SUPABASE_KEY;
+    BACKEND = "sqlite" usa SQLITE_RUTA (por defecto finanzas.db).
+    """
+    backend = config.get("BACKEND", "supabase")
+    if backend == "sqlite":
+        motor = AlmacenamientoSQLite(config.get("SQLITE_RUTA", "finanzas.db"))
+    elif backend == "supabase":
+        motor = AlmacenamientoSupabase(crear_cliente(config["SUPABASE_URL"], config["SUPABASE_KEY"]))
+    else:
+        raise ValueError(f"BACKEND desconocido: {backend}")
+    return AlmacenamientoMedido(motor)
@@ -0,0 +1,286 @@
+import base64
+import hashlib
+import hmac
+import ipaddress
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+# pyrefly: ignore [missing-import]
+from passlib.hash import bcrypt
+
+import metricas
+
+logger = logging.getLogger(__name__)
+
+# --- AUTENTICACIÓN ---
+# bcrypt es caro a propósito. Para que una ráfaga de logins no ocupe todos los
+# núcleos y frene al resto de sesiones, el hash y la verificación se hacen en
+# un pool de pocos hilos con una cola acotada; si la cola está llena se rechaza
+# el intento en vez de encolarlo. Además se limitan los fallos por (IP, usuario) y
+# por IP. El límite por usuario desde cualquier IP es mucho más alto: con uno bajo,
+# cualquiera podría bloquear la cuenta de otro escribiendo mal su contraseña.
+
+RONDAS_DEFECTO = 12
+MAX_HILOS = 2
+MAX_PENDIENTES = 16
+ESPERA_MAXIMA_SEGUNDOS = 30
+
+DURACION_SESION_SEGUNDOS = 7 * 24 * 3600
+
+# (fallos permitidos, ventana en segundos)
+LIMITE_POR_IP_USUARIO = (5, 15 * 60)
+LIMITE_POR_IP = (20, 15 * 60)
+# Fallos contra un usuario desde todas las IPs: solo frena ataques distribuidos
+LIMITE_POR_USUARIO = (100, 15 * 60)
+# Claves (usuarios o IPs) con fallos recientes que se recuerdan como máximo
+MAX_CLAVES = 100_000
+
+
+class ServidorOcupado(Exception):
+    """Hay demasiadas operaciones de bcrypt en curso; el cliente debe reintentar."""
+
+
+class DemasiadosIntentos(Exception):
+    def __init__(self, segundos):
+        super().__init__(f"Demasiados intentos fallidos; espera {segundos:.0f} s")
+        self.segundos = segundos
+
+
+class LimitadorIntentos:
+    """Cuenta fallos por clave (usuario o IP) en una ventana deslizante.
+
+    Las claves se guardan en orden de su último fallo: en cada fallo se
+    descartan desde el principio las que ya salieron de la ventana y, si aun
+    así hay más de `max_claves`, las más antiguas. Una ráfaga de usuarios o IPs
+    distintas no hace crecer la memoria sin límite.
+    """
+
+    def __init__(self, max_fallos, ventana, max_claves=MAX_CLAVES):
+        self.max_fallos = max_fallos
+        self.ventana = ventana
+        self.max_claves = max_claves
+        self._fallos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _purgar(self, clave, ahora):
+        # Debe llamarse con el lock tomado
+        fallos = self._fallos.get(clave, deque())
+        while fallos and fallos[0] + self.ventana < ahora:
+            fallos.popleft()
+        if not fallos:
+            self._fallos.pop(clave, None)
+        return fallos
+
+    def espera(self, clave):
+        """Segundos que faltan para poder intentar de nuevo (0 si no está bloqueada)."""
+        with self._lock:
+            ahora = time.monotonic()
+            fallos = self._purgar(clave, ahora)
+            if len(fallos) < self.max_fallos:
+                return 0
+            return fallos[0] + self.ventana - ahora
+
+    def fallo(self, clave):
+        with self._lock:
+            ahora = time.monotonic()
+            self._fallos.setdefault(clave, deque()).append(ahora)
+            self._fallos.move_to_end(clave)
+            while self._fallos:
+                antigua, fallos = next(iter(self._fallos.items()))
+                if fallos[-1] + self.ventana >= ahora and len(self._fallos) <= self.max_claves:
+                    break
+                del self._fallos[antigua]
+
+    def limpiar(self, clave):
+        with self._lock:
+            self._fallos.pop(clave, None)
+
+
+def redes_confiables(proxies):
+    """Redes (ipaddress) de una lista de IPs o rangos CIDR de proxies confiables."""
+    return [ipaddress.ip_network(proxy.strip(), strict=False) for proxy in proxies or []]
+
+
+def ip_cliente(remota, reenviada, redes):
+    """IP del cliente para limitar intentos: `remota` es la del socket y `reenviada` el X-Forwarded-For.
+
+    X-Forwarded-For solo se tiene en cuenta si la conexión viene de un proxy de
+    `redes`; en ese caso se recorre de derecha a izquierda saltando los proxies
+    confiables y se toma el primer salto que no lo es. Los saltos de más a la
+    izquierda los escribe el propio cliente y no se pueden creer.
+    """
+    saltos = [remota] + [salto.strip() for salto in reversed((reenviada or "").split(","))]
+    for salto in saltos:
+        try:
+            direccion = ipaddress.ip_address(salto)
+        except ValueError:
+            break
+        if not any(direccion in red for red in redes):
+            return salto
+    return remota
+
+
+class Autenticador:
+    """Registro y login con bcrypt fuera del hilo del script y con límite de intentos.
+
+    Si `rondas` cambia, las contraseñas con otro coste se vuelven a hashear de
+    forma transparente la próxima vez que su dueño inicia sesión.
+    """
+
+    def __init__(self, almacen, rondas=RONDAS_DEFECTO, max_hilos=MAX_HILOS, max_pendientes=MAX_PENDIENTES,
+                 limite_usuario=LIMITE_POR_USUARIO, limite_ip=LIMITE_POR_IP, limite_ip_usuario=LIMITE_POR_IP_USUARIO):
+        self.almacen = almacen
+        self.hasher = bcrypt.using(rounds=rondas)
+        self._pool = ThreadPoolExecutor(max_workers=max_hilos, thread_name_prefix="bcrypt")
+        self._cupos = threading.BoundedSemaphore(max_hilos + max_pendientes)
+        self._por_usuario = LimitadorIntentos(*limite_usuario)
+        self._por_ip = LimitadorIntentos(*limite_ip)
+        self._por_ip_usuario = LimitadorIntentos(*limite_ip_usuario)
+        self._hash_ficticio = None
+
+    def _en_pool(self, operacion, funcion, *args):
+        if not self._cupos.acquire(blocking=False):
+            metricas.incrementar("auth_rechazos", motivo="ocupado")
+            raise ServidorOcupado()
+        with metricas.medir("auth", operacion=operacion):
+            try:
+                futuro = self._pool.submit(funcion, *args)
+            except BaseException:
+                self._cupos.release()
+                raise
+            futuro.add_done_callback(lambda _: self._cupos.release())
+            return futuro.result(timeout=ESPERA_MAXIMA_SEGUNDOS)
+
+    def hash(self, password):
+        return self._en_pool("hash", self.hasher.hash, password)
+
+    def registrar(self, nombre, usuario, password):
+        return self.almacen.crear_usuario(nombre, usuario, self.hash(password))
+
+    def autenticar(self, usuario, password, ip=None):
+        """Id del usuario si las credenciales son correctas, o None.
+
+        Lanza DemasiadosIntentos si la IP con ese usuario, la IP o el usuario
+        superaron su límite de fallos y ServidorOcupado si el pool de bcrypt
+        está saturado.
+        """
+        claves = [(self._por_ip_usuario, (ip, usuario)), (self._por_usuario, usuario)]
+        if ip:
+            claves.append((self._por_ip, ip))
+        espera = max(limitador.espera(clave) for limitador, clave in claves)
+        if espera > 0:
+            metricas.incrementar("auth_rechazos", motivo="limite")
+            raise DemasiadosIntentos(espera)
+
+        fila = self.almacen.buscar_usuario(usuario)
+        if fila is None:
+            # Se verifica igual contra un hash ficticio para que un usuario
+            # inexistente no responda más rápido que una contraseña incorrecta
+            if self._hash_ficticio is None:
+                self._hash_ficticio = self.hash("")
+            self._en_pool("verificar", self.hasher.verify, password, self._hash_ficticio)
+            correcta = False
+        else:
+            correcta = self._en_pool("verificar", self.hasher.verify, password, fila["password"])
+
+        if not correcta:
+            for limitador, clave in claves:
+                limitador.fallo(clave)
+            metricas.incrementar("login_fallido")
+            return None
+
+        self._por_ip_usuario.limpiar((ip, usuario))
+        if self.hasher.needs_update(fila["password"]):
+            self._pool.submit(self._rehash, fila["id"], password)
+        return fila["id"]
+
+    def _rehash(self, usuario_id, password):
+        try:
+            self.almacen.actualizar_password(usuario_id, self.hasher.hash(password))
+            metricas.incrementar("auth_rehash")
+        except Exception as e:
+            logger.warning("No se pudo actualizar el hash del usuario %s: %s", usuario_id, e)
+
+
+# --- TOKENS DE SESIÓN ---
+# Token firmado "usuario_id.expira.nonce.firma" (HMAC-SHA256). Se valida en O(1)
+# sin bcrypt, así que recargar la página o reconectar no vuelve a pedir la
+# contraseña. Al cerrar sesión el nonce se revoca hasta su expiración: en memoria
+# y, si se da `almacen`, en la tabla sesiones_revocadas, para que la revocación
+# sobreviva a un reinicio y valga en todas las réplicas.
+class Sesiones:
+    def __init__(self, secreto=None, duracion=DURACION_SESION_SEGUNDOS, almacen=None):
+        if not secreto:
+            # Sin secreto configurado los tokens solo valen mientras viva el proceso
+            logger.warning("SESION_SECRETO no configurado: las sesiones no sobrevivirán a un reinicio")
+            secreto = secrets.token_bytes(32)
+        self._clave = secreto.encode() if isinstance(secreto, str) else secreto
+        self.duracion = duracion
+        self.almacen = almacen
+        self._revocados = {}
+        self._lock = threading.Lock()
+
+    def _firma(self, contenido):
+        digest = hmac.new(self._clave, contenido.encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+    def emitir(self, usuario_id):
+        contenido = f"{usuario_id}.{int(time.time() + self.duracion)}.{secrets.token_urlsafe(12)}"
+        return f"{contenido}.{self._firma(contenido)}"
+
+    def _partes(self, token):
+        try:
+            contenido, firma = token.rsplit(".", 1)
+            usuario_id, expira, nonce = contenido.split(".")
+            if not hmac.compare_digest(firma, self._firma(contenido)):
+                return None
+            return int(usuario_id), int(expira), nonce
+        except (AttributeError, ValueError):
+            return None
+
+    def validar(self, token):
+        """Id del usuario si el token es auténtico, no expiró y no fue revocado; si no, None."""
+        partes = self._partes(token)
+        if partes is None:
+            metricas.incrementar("sesion_invalida", motivo="firma")
+            return None
+        usuario_id, expira, nonce = partes
+        if expira < time.time():
+            metricas.incrementar("sesion_invalida", motivo="expirada")
+            return None
+        with self._lock:
+            revocado = nonce in self._revocados
+        if not revocado and self.almacen is not None:
+            try:
+                revocado = self.almacen.sesion_revocada(nonce)
+            except Exception as e:
+                # Sin poder comprobarlo, el token no se acepta: se pide login de nuevo
+                logger.warning("No se pudo comprobar la revocación de la sesión: %s", e)
+                metricas.incrementar("sesion_invalida", motivo="error")
+                return None
+        if revocado:
+            metricas.incrementar("sesion_invalida", motivo="revocada")
+            return None
+        metricas.incrementar("sesion_reanudada")
+        return usuario_id
+
+    def revocar(self, token):
+        partes = self._partes(token)
+        if partes is None:
+            return
+        _, expira, nonce = partes
+        ahora = time.time()
+        with self._lock:
+            self._revocados[nonce] = expira
+            # Los revocados que ya expiraron no hace falta recordarlos
+            for viejo in [n for n, exp in self._revocados.items() if exp < ahora]:
+                del self._revocados[viejo]
+        if self.almacen is not None:
+            try:
+                self.almacen.revocar_sesion(nonce, expira)
+            except Exception as e:
+                logger.warning("No se pudo guardar la revocación de la sesión; solo vale en este proceso: %s", e)
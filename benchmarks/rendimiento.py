@@ -0,0 +1,337 @@
+"""Benchmarks de la app contra un backend SQLite local.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.rendimiento medir [--filas 1000 10000 100000] [--sesiones 8] [--modo local]
+    python -m benchmarks.rendimiento comparar ANTERIOR.json NUEVO.json [--umbral 0.2]
+
+`medir` ejecuta finance.py con AppTest sobre bases sintéticas de cada tamaño:
+latencia de cada vista en frío (cachés vacías) y en caliente, memoria máxima
+(tracemalloc), filas y bytes que devuelve el almacenamiento (serializados como
+JSON, lo que enviaría PostgREST) y N sesiones simultáneas. El resultado se
+guarda en benchmarks/resultados/ con el hash del commit, y `comparar` señala
+las mediciones que empeoraron más que `umbral` entre dos ejecuciones.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+import streamlit as st
+import streamlit.logger
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.runtime import Runtime
+from streamlit.runtime.secrets import Secrets
+from streamlit.testing.v1 import AppTest
+
+import almacenamiento
+from benchmarks import sinteticos
+
+# Sin los avisos de "No runtime found" de cada ejecución de AppTest
+streamlit.logger.set_log_level("error")
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(RAIZ, "finance.py")
+DIRECTORIO_DATOS = os.path.join(RAIZ, "benchmarks", "datos")
+DIRECTORIO_RESULTADOS = os.path.join(RAIZ, "benchmarks", "resultados")
+FILAS_DEFECTO = [1_000, 10_000, 100_000]
+REPETICIONES = 3
+TIMEOUT_SEGUNDOS = 600
+
+
+# --- CARGA DEVUELTA POR EL ALMACENAMIENTO ---
+class CargaMedida:
+    """Envuelve el almacenamiento de la app y acumula filas y bytes JSON por operación."""
+
+    def __init__(self, motor):
+        self.motor = motor
+        self.carga = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, nombre):
+        atributo = getattr(self.motor, nombre)
+        if nombre.startswith("_") or not callable(atributo):
+            return atributo
+
+        def medido(*args, **kwargs):
+            resultado = atributo(*args, **kwargs)
+            if isinstance(resultado, (list, dict)):
+                filas = len(resultado) if isinstance(resultado, list) else 1
+                tamano = len(json.dumps(resultado, default=str))
+                with self._lock:
+                    llamadas, filas_total, bytes_total = self.carga.get(nombre, (0, 0, 0))
+                    self.carga[nombre] = (llamadas + 1, filas_total + filas, bytes_total + tamano)
+            return resultado
+
+        return medido
+
+    def tomar(self):
+        """Devuelve lo acumulado desde la última llamada y lo reinicia."""
+        with self._lock:
+            carga, self.carga = self.carga, {}
+        return carga
+
+
+_almacenes = []
+_crear_original = almacenamiento.crear_almacenamiento
+
+
+def _crear_medido(config):
+    almacen = CargaMedida(_crear_original(config))
+    _almacenes.append(almacen)
+    return almacen
+
+
+def _carga_actual():
+    return _almacenes[-1].tomar() if _almacenes else {}
+
+
+# --- EJECUCIÓN DE LA APP ---
+def _configurar(ruta_base, modo, directorio):
+    # Los secrets se fijan de forma global y no en cada AppTest: AppTest los
+    # reemplaza y restaura en cada ejecución, lo que no es seguro con varias
+    # sesiones en paralelo.
+    secretos = Secrets([])
+    secretos._secrets = {
+        "BACKEND": "sqlite",
+        "SQLITE_RUTA": ruta_base,
+        "MODO_AGREGACION": modo,
+        "COLA_RUTA": os.path.join(directorio, "cola.db"),
+        "SESION_SECRETO": "benchmark",
+    }
+    st.secrets = secretos
+    almacenamiento.crear_almacenamiento = _crear_medido
+
+
+def _reiniciar_caches():
+    st.cache_resource.clear()
+    st.cache_data.clear()
+
+
+def _sesion(vista=None, usuario_id=1):
+    at = AppTest.from_file(SCRIPT, default_timeout=TIMEOUT_SEGUNDOS)
+    at.session_state["usuario_id"] = usuario_id
+    if vista is not None:
+        at.session_state["vista"] = vista
+    return at
+
+
+def _ejecutar(at):
+    inicio = time.perf_counter()
+    at.run()
+    segundos = time.perf_counter() - inicio
+    if at.exception:
+        raise RuntimeError(f"La app falló: {at.exception[0].value}")
+    return segundos
+
+
+def _vistas():
+    _reiniciar_caches()
+    at = _sesion()
+    _ejecutar(at)
+    return list(at.radio(key="vista").options)
+
+
+def medir_vista(vista, repeticiones=REPETICIONES):
+    """Latencia en frío y en caliente de una vista, con la carga del almacenamiento en frío."""
+    frio, caliente, carga = [], [], {}
+    for _ in range(repeticiones):
+        _reiniciar_caches()
+        at = _sesion(vista)
+        frio.append(_ejecutar(at))
+        carga = _carga_actual()
+        caliente.append(_ejecutar(at))
+        _carga_actual()
+    return {
+        "frio_ms": statistics.median(frio) * 1000,
+        "caliente_ms": statistics.median(caliente) * 1000,
+        "consultas": sum(llamadas for llamadas, _, _ in carga.values()),
+        "filas_leidas": sum(filas for _, filas, _ in carga.values()),
+        "bytes": sum(tamano for _, _, tamano in carga.values()),
+        "operaciones": {nombre: {"llamadas": ll, "filas": f, "bytes": b} for nombre, (ll, f, b) in sorted(carga.items())},
+    }
+
+
+def memoria_vista(vista):
+    """Pico de memoria de Python (MB) al abrir la vista con las cachés vacías."""
+    _reiniciar_caches()
+    at = _sesion(vista)
+    tracemalloc.start()
+    try:
+        _ejecutar(at)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return pico / 2 ** 20
+
+
+@contextmanager
+def _runtime_compartido():
+    # AppTest instala un Runtime simulado al empezar cada ejecución y lo borra al
+    # terminar; con sesiones en paralelo, una lo borraría mientras otra lo usa.
+    fijo = MagicMock(spec=Runtime)
+    fijo.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    fijo.cache_storage_manager = MemoryCacheStorageManager()
+    with patch.object(Runtime, "instance", classmethod(lambda cls: cls._instance or fijo)), \
+            patch.object(Runtime, "exists", classmethod(lambda cls: True)):
+        yield
+
+
+def sesiones_concurrentes(vistas, sesiones):
+    """`sesiones` hilos que recorren todas las vistas a la vez, con la caché ya caliente."""
+    _reiniciar_caches()
+    for vista in vistas:
+        _ejecutar(_sesion(vista))
+    tiempos, errores = [], []
+    lock = threading.Lock()
+
+    def recorrer():
+        try:
+            for vista in vistas:
+                segundos = _ejecutar(_sesion(vista))
+                with lock:
+                    tiempos.append(segundos)
+        except Exception as e:
+            with lock:
+                errores.append(str(e))
+
+    with _runtime_compartido():
+        inicio = time.perf_counter()
+        hilos = [threading.Thread(target=recorrer) for _ in range(sesiones)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        total = time.perf_counter() - inicio
+    tiempos.sort()
+    return {
+        "sesiones": sesiones,
+        "ejecuciones": len(tiempos),
+        "errores": errores,
+        "p50_ms": statistics.median(tiempos) * 1000 if tiempos else None,
+        "p95_ms": tiempos[int(0.95 * (len(tiempos) - 1))] * 1000 if tiempos else None,
+        "max_ms": tiempos[-1] * 1000 if tiempos else None,
+        "ejecuciones_por_segundo": len(tiempos) / total,
+    }
+
+
+# --- RESULTADOS ---
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], cwd=RAIZ, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def entorno():
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "cambios_sin_commit": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "streamlit": st.__version__,
+        "plataforma": platform.platform(),
+    }
+
+
+def medir(args):
+    resultado = {"entorno": entorno(), "parametros": vars(args).copy(), "mediciones": []}
+    resultado["parametros"].pop("funcion", None)
+    with tempfile.TemporaryDirectory() as directorio:
+        for filas in args.filas:
+            print(f"== {filas:,} movimientos", file=sys.stderr)
+            ruta_base = sinteticos.base_sintetica(DIRECTORIO_DATOS, filas, semilla=args.semilla)
+            _configurar(ruta_base, args.modo, directorio)
+            vistas = _vistas()
+            for vista in vistas:
+                medicion = medir_vista(vista, args.repeticiones)
+                medicion["memoria_mb"] = memoria_vista(vista) if args.memoria else None
+                medicion.update(prueba="vista", filas=filas, vista=vista, modo=args.modo)
+                resultado["mediciones"].append(medicion)
+                print(f"   {vista}: frío {medicion['frio_ms']:,.0f} ms, caliente {medicion['caliente_ms']:,.0f} ms, "
+                      f"{medicion['filas_leidas']:,} filas, {medicion['bytes'] / 1024:,.0f} KiB", file=sys.stderr)
+            if args.sesiones:
+                medicion = sesiones_concurrentes(vistas, args.sesiones)
+                medicion.update(prueba="concurrencia", filas=filas, vista="todas", modo=args.modo)
+                resultado["mediciones"].append(medicion)
+                print(f"   {args.sesiones} sesiones: p50 {medicion['p50_ms']:,.0f} ms, p95 {medicion['p95_ms']:,.0f} ms",
+                      file=sys.stderr)
+
+    os.makedirs(DIRECTORIO_RESULTADOS, exist_ok=True)
+    commit = (resultado["entorno"]["commit"] or "sin-git")[:10]
+    ruta = args.salida or os.path.join(DIRECTORIO_RESULTADOS, f"{datetime.datetime.now():%Y%m%d-%H%M%S}_{commit}.json")
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(ruta)
+
+
+# Métricas que se comparan entre ejecuciones (más alto = peor)
+METRICAS_COMPARADAS = ["frio_ms", "caliente_ms", "memoria_mb", "filas_leidas", "bytes", "consultas", "p95_ms"]
+
+
+def comparar(args):
+    with open(args.anterior, encoding="utf-8") as f:
+        anterior = json.load(f)
+    with open(args.nuevo, encoding="utf-8") as f:
+        nuevo = json.load(f)
+    clave = lambda m: (m["prueba"], m["filas"], m["vista"], m["modo"])
+    base = {clave(m): m for m in anterior["mediciones"]}
+    regresiones = 0
+    print(f"{anterior['entorno']['commit'] or '?'} -> {nuevo['entorno']['commit'] or '?'}")
+    for medicion in nuevo["mediciones"]:
+        previa = base.get(clave(medicion))
+        if previa is None:
+            continue
+        for metrica in METRICAS_COMPARADAS:
+            antes, ahora = previa.get(metrica), medicion.get(metrica)
+            if not antes or ahora is None:
+                continue
+            cambio = ahora / antes - 1
+            marca = ""
+            if cambio > args.umbral:
+                marca = "  <-- REGRESIÓN"
+                regresiones += 1
+            print(f"{medicion['prueba']:<13}{medicion['filas']:>9,} {medicion['vista']:<18}{metrica:<13}"
+                  f"{antes:>12,.1f} {ahora:>12,.1f} {cambio:>+8.0%}{marca}")
+    return 1 if regresiones else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de Finanzas Personales")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    p_medir = comandos.add_parser("medir", help="medir latencia, memoria y carga por vista")
+    p_medir.add_argument("--filas", type=int, nargs="+", default=FILAS_DEFECTO, help="tamaños del historial (p. ej. 1000 1000000)")
+    p_medir.add_argument("--modo", choices=["local", "servidor"], default="local", help="MODO_AGREGACION de la app")
+    p_medir.add_argument("--repeticiones", type=int, default=REPETICIONES)
+    p_medir.add_argument("--sesiones", type=int, default=8, help="sesiones simultáneas (0 para omitir)")
+    p_medir.add_argument("--sin-memoria", dest="memoria", action="store_false", help="omitir la medición con tracemalloc")
+    p_medir.add_argument("--semilla", type=int, default=0)
+    p_medir.add_argument("--salida", help="archivo JSON de resultados")
+    p_medir.set_defaults(funcion=medir)
+
+    p_comparar = comandos.add_parser("comparar", help="comparar dos resultados")
+    p_comparar.add_argument("anterior")
+    p_comparar.add_argument("nuevo")
+    p_comparar.add_argument("--umbral", type=float, default=0.2, help="empeoramiento tolerado (0.2 = 20 %%)")
+    p_comparar.set_defaults(funcion=comparar)
+
+    args = parser.parse_args(argv)
+    return args.funcion(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""Datos sintéticos para los benchmarks: usuarios con historiales de N movimientos.
+
+La generación es determinista (misma semilla, mismas filas), así que dos
+ejecuciones en commits distintos miden exactamente los mismos datos.
+"""
+import os
+
+import numpy as np
+
+import almacenamiento
+import datos
+
+ANIOS_HISTORIA = 8
+FECHA_INICIO = np.datetime64("2018-01-01")
+PALABRAS = ["pago", "compra", "mercado", "factura", "cuota", "tienda", "transferencia", "servicio",
+            "arriendo", "gasolina", "restaurante", "farmacia", "nomina", "dividendo", "suscripcion"]
+LOTE_INSERCION = 20_000
+
+
+def generar_movimientos(usuario_id, filas, semilla=0):
+    """Lista de `filas` movimientos aleatorios del usuario, repartidos en ANIOS_HISTORIA años."""
+    rng = np.random.default_rng(semilla + usuario_id)
+    fechas = (FECHA_INICIO + rng.integers(0, ANIOS_HISTORIA * 365, filas)).astype(str)
+    es_ingreso = rng.random(filas) < 0.25
+    ingresos = np.array(datos.TIPO_CATEGORIAS["ingreso"])
+    gastos = np.array(datos.TIPO_CATEGORIAS["gasto"])
+    categorias = np.where(es_ingreso, ingresos[rng.integers(0, len(ingresos), filas)], gastos[rng.integers(0, len(gastos), filas)])
+    valores = np.round(rng.lognormal(4, 1.2, filas), 2)
+    palabras = np.array(PALABRAS)
+    descripciones = np.char.add(np.char.add(palabras[rng.integers(0, len(palabras), filas)], " "),
+                                palabras[rng.integers(0, len(palabras), filas)])
+    formas = np.array(datos.FORMAS_PAGO)[rng.integers(0, len(datos.FORMAS_PAGO), filas)]
+    return [
+        {"usuario_id": usuario_id, "fecha": f, "tipo": "ingreso" if i else "gasto", "categoria": c,
+         "valor": float(v), "descripcion": d, "forma_pago": p}
+        for f, i, c, v, d, p in zip(fechas, es_ingreso, categorias, valores, descripciones, formas)
+    ]
+
+
+def base_sintetica(directorio, filas, usuarios=1, semilla=0):
+    """Ruta de una base SQLite con `usuarios` usuarios de `filas` movimientos cada uno.
+
+    Las bases se guardan en `directorio` y se reutilizan: generar un millón de
+    filas tarda, y el contenido solo depende de (filas, usuarios, semilla).
+    """
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, f"sintetica_{filas}x{usuarios}_s{semilla}.db")
+    if os.path.exists(ruta):
+        return ruta
+    temporal = ruta + ".tmp"
+    for sufijo in ("", "-wal", "-shm"):
+        if os.path.exists(temporal + sufijo):
+            os.remove(temporal + sufijo)
+    almacen = almacenamiento.AlmacenamientoSQLite(temporal)
+    for n in range(1, usuarios + 1):
+        usuario = almacen.crear_usuario(f"Usuario {n}", f"usuario{n}", "sin-login")
+        movimientos = generar_movimientos(usuario["id"], filas, semilla)
+        for inicio in range(0, filas, LOTE_INSERCION):
+            almacen.insertar_movimientos(movimientos[inicio:inicio + LOTE_INSERCION])
+    # Deja la base en un solo archivo antes de renombrarla
+    almacen._ancla.execute("pragma wal_checkpoint(truncate)")
+    almacen._ancla.close()
+    os.replace(temporal, ruta)
+    return ruta
@@ -0,0 +1,169 @@
+import re
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+import datos
+
+# --- BÚSQUEDA DE MOVIMIENTOS ---
+# Texto libre sobre la descripción (cada palabra escrita debe ser el comienzo de
+# alguna palabra de la descripción, sin distinguir mayúsculas) más filtros por
+# categoría, forma de pago, tipo, rango de valor y de fechas. Además de la página
+# de resultados se devuelven las facetas: cuántos resultados hay por categoría,
+# forma de pago y tipo. Cada faceta se cuenta con todos los filtros salvo el
+# suyo, para que el usuario vea qué obtendría al marcar otra opción.
+#
+# En modo local se busca en un índice invertido construido sobre la copia en
+# caché; en modo servidor, con la función `buscar_movimientos` de sql/busqueda.sql
+# (índice GIN sobre un tsvector de la descripción).
+
+TAMANO_PAGINA = 25
+FACETAS = ["categoria", "forma_pago", "tipo"]
+
+Filtros = namedtuple(
+    "Filtros",
+    ["texto", "categorias", "formas_pago", "tipo", "valor_min", "valor_max", "desde", "hasta"],
+    defaults=("", (), (), None, None, None, None, None),
+)
+
+
+def terminos(texto):
+    """Palabras de la consulta en minúsculas, en el orden en que se escribieron."""
+    return re.findall(r"\w+", (texto or "").lower())
+
+
+def hay_filtros(filtros):
+    return bool(terminos(filtros.texto) or filtros.categorias or filtros.formas_pago or filtros.tipo
+                or any(v is not None for v in (filtros.valor_min, filtros.valor_max, filtros.desde, filtros.hasta)))
+
+
+def _resultado(total, filas, facetas):
+    return {"total": int(total), "filas": filas, "facetas": facetas}
+
+
+# --- ÍNDICE EN MEMORIA ---
+class IndiceMovimientos:
+    """Índice de búsqueda sobre un DataFrame de movimientos ordenado por (fecha, id) desc.
+
+    Las palabras de las descripciones se guardan en un vocabulario ordenado con
+    las posiciones de sus filas a continuación, de modo que todas las palabras
+    que empiezan por un prefijo ocupan un tramo contiguo: cada término de la
+    consulta es una búsqueda binaria y un corte del array. Categoría, forma de
+    pago y tipo se filtran y se cuentan sobre los códigos de sus categóricas.
+    Como las posiciones siguen el orden del DataFrame, los resultados ya salen
+    ordenados y paginar es cortar el array de posiciones.
+    """
+
+    def __init__(self, df):
+        # Se trabaja por posición (iloc), así que no hace falta copiar el DataFrame
+        self.df = df
+        self.valor = self.df["valor"].to_numpy()
+        self.fecha = self.df["fecha"].to_numpy()
+        self.codigos = {}
+        self.nombres = {}
+        for columna in FACETAS:
+            categorica = self.df[columna].astype("category")
+            self.codigos[columna] = categorica.cat.codes.to_numpy()
+            self.nombres[columna] = list(categorica.cat.categories)
+
+        # Las descripciones se repiten mucho (suscripciones, nóminas...): se separan
+        # en palabras solo las distintas y se expanden a sus filas con NumPy
+        codigos, distintas = pd.factorize(self.df["descripcion"].fillna("").astype(str).str.lower())
+        palabras = pd.Series(distintas, dtype=object).str.findall(r"\w+").explode().dropna()
+        self.vocabulario, rango = np.unique(palabras.to_numpy(dtype=str), return_inverse=True)
+        descripcion = palabras.index.to_numpy(dtype="int64")
+
+        filas_por_codigo = np.argsort(codigos, kind="stable")
+        cuantas = np.bincount(codigos, minlength=len(distintas))
+        primera = np.cumsum(cuantas) - cuantas
+        repetir = cuantas[descripcion]
+        desplazamiento = np.arange(repetir.sum()) - np.repeat(np.cumsum(repetir) - repetir, repetir)
+        posiciones = filas_por_codigo[np.repeat(primera[descripcion], repetir) + desplazamiento]
+        rangos = np.repeat(rango, repetir)
+
+        orden = np.lexsort((posiciones, rangos))
+        self.posiciones = posiciones[orden]
+        self.limites = np.searchsorted(rangos[orden], np.arange(len(self.vocabulario) + 1))
+
+    def __len__(self):
+        return len(self.df)
+
+    def _coinciden(self, termino):
+        # Tramo del vocabulario con las palabras que empiezan por `termino`
+        desde = np.searchsorted(self.vocabulario, termino, side="left")
+        hasta = np.searchsorted(self.vocabulario, termino + "\U0010ffff", side="left")
+        mascara = np.zeros(len(self.df), dtype=bool)
+        mascara[self.posiciones[self.limites[desde]:self.limites[hasta]]] = True
+        return mascara
+
+    def _faceta(self, columna, seleccion):
+        if not seleccion:
+            return None
+        codigos = [self.nombres[columna].index(v) for v in seleccion if v in self.nombres[columna]]
+        return np.isin(self.codigos[columna], codigos)
+
+    def buscar(self, filtros, pagina=0, tamano=TAMANO_PAGINA):
+        base = np.ones(len(self.df), dtype=bool)
+        for termino in terminos(filtros.texto):
+            base &= self._coinciden(termino)
+        if filtros.valor_min is not None:
+            base &= self.valor >= filtros.valor_min
+        if filtros.valor_max is not None:
+            base &= self.valor <= filtros.valor_max
+        if filtros.desde is not None:
+            base &= self.fecha >= np.datetime64(filtros.desde)
+        if filtros.hasta is not None:
+            base &= self.fecha < np.datetime64(filtros.hasta) + np.timedelta64(1, "D")
+
+        seleccion = {"categoria": filtros.categorias, "forma_pago": filtros.formas_pago,
+                     "tipo": [filtros.tipo] if filtros.tipo else ()}
+        mascaras = {columna: self._faceta(columna, seleccion[columna]) for columna in FACETAS}
+
+        facetas = {}
+        for columna in FACETAS:
+            # Todos los filtros menos el de la propia faceta
+            mascara = base.copy()
+            for otra, m in mascaras.items():
+                if otra != columna and m is not None:
+                    mascara &= m
+            conteo = np.bincount(self.codigos[columna][mascara & (self.codigos[columna] >= 0)],
+                                 minlength=len(self.nombres[columna]))
+            facetas[columna] = {self.nombres[columna][i]: int(conteo[i]) for i in np.argsort(-conteo, kind="stable") if conteo[i]}
+
+        for m in mascaras.values():
+            if m is not None:
+                base &= m
+        aciertos = np.flatnonzero(base)
+        filas = self.df.iloc[aciertos[pagina * tamano:(pagina + 1) * tamano]].reset_index(drop=True)
+        return _resultado(len(aciertos), filas, facetas)
+
+
+# --- BÚSQUEDA EN EL SERVIDOR ---
+def facetas_desde_grupos(grupos, filtros):
+    """Total y facetas a partir de los conteos por (categoria, forma_pago, tipo) del servidor.
+
+    El servidor agrupa con los filtros de texto, valor y fecha; los de las
+    facetas se aplican aquí sobre esos pocos grupos.
+    """
+    grupos = pd.DataFrame(grupos, columns=FACETAS + ["cantidad"]).fillna({"forma_pago": ""})
+    seleccion = {"categoria": filtros.categorias, "forma_pago": filtros.formas_pago,
+                 "tipo": [filtros.tipo] if filtros.tipo else ()}
+    mascaras = {c: grupos[c].isin(seleccion[c]) if seleccion[c] else pd.Series(True, index=grupos.index) for c in FACETAS}
+    facetas = {}
+    for columna in FACETAS:
+        mascara = pd.Series(True, index=grupos.index)
+        for otra in FACETAS:
+            if otra != columna:
+                mascara &= mascaras[otra]
+        conteo = grupos[mascara].groupby(columna)["cantidad"].sum().sort_values(ascending=False, kind="stable")
+        facetas[columna] = {k: int(v) for k, v in conteo.items() if k != "" and v}
+    total = grupos[mascaras["categoria"] & mascaras["forma_pago"] & mascaras["tipo"]]["cantidad"].sum()
+    return total, facetas
+
+
+def buscar_en_servidor(almacen, usuario_id, filtros, pagina=0, tamano=TAMANO_PAGINA):
+    parametros = dict(filtros._asdict(), terminos=terminos(filtros.texto))
+    grupos, filas = datos.buscar_movimientos(almacen, usuario_id, parametros, tamano, pagina * tamano)
+    total, facetas = facetas_desde_grupos(grupos, filtros)
+    return _resultado(total, filas, facetas)
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+
+import datos
+
+# --- CATEGORIZACIÓN AUTOMÁTICA ---
+# Modelo de frecuencias de palabras (Bayes ingenuo) entrenado con los movimientos
+# del propio usuario: cada movimiento aporta las palabras de su descripción, su
+# forma de pago y el orden de magnitud de su valor a la cuenta de su categoría.
+# Unas palabras clave fijas hacen de reglas iniciales, para que un usuario sin
+# historial también reciba sugerencias; en cuanto registra movimientos, su
+# propio uso pesa más que ellas.
+#
+# Entrenar y clasificar son operaciones de NumPy sobre toda la tabla: las
+# descripciones se separan en palabras una sola vez por texto distinto y las
+# cuentas se suman con bincount, así que un extracto de miles de filas se
+# clasifica en milisegundos.
+
+# Reglas iniciales: palabras (sin tildes, en minúsculas) que delatan la categoría
+PALABRAS_CLAVE = {
+    "Sueldo": "nomina sueldo salario quincena prima honorarios",
+    "Inversiones": "dividendo dividendos acciones fondo cdt",
+    "Ganancias": "venta ganancia premio bono",
+    "Prestamos": "prestamo credito desembolso",
+    "Retornos": "reembolso devolucion reintegro cashback",
+    "Hogar": "arriendo alquiler administracion hipoteca muebles ferreteria",
+    "Vehículo": "gasolina combustible peaje parqueadero taller soat lavadero",
+    "Alimentación": "mercado supermercado restaurante panaderia almuerzo cafe domicilio",
+    "Entretenimiento": "cine netflix spotify concierto teatro juegos bar",
+    "Bancos": "comision cuota manejo intereses banco gmf",
+    "Salud": "farmacia drogueria medico eps clinica odontologo",
+    "Educacion": "colegio universidad curso matricula libros",
+    "Ropa": "ropa zapatos calzado tienda",
+    "Gym": "gimnasio gym",
+    "Transporte": "uber taxi bus metro didi transmilenio",
+    "Servicios": "luz agua gas internet telefono celular energia acueducto",
+    "Regalos": "regalo cumpleanos flores",
+    "Ahorro": "ahorro ahorros",
+    "Inversion": "inversion broker",
+}
+PESO_PALABRA_CLAVE = 3
+SUAVIZADO = 0.1
+CONFIANZA_MINIMA = 0.4
+
+
+def _palabras(descripciones):
+    """(códigos, pares) para una serie de descripciones.
+
+    `códigos` asigna cada fila a su texto distinto y `pares` es un DataFrame
+    (texto, rasgo) con las palabras de cada texto distinto, sin repetir. Se
+    pasan a minúsculas y sin tildes: "Nómina" y "NOMINA" son la misma palabra.
+    """
+    codigos, distintas = pd.factorize(descripciones.fillna("").astype(str))
+    distintas = (pd.Series(distintas, dtype=object).str.lower()
+                 .str.normalize("NFKD").str.encode("ascii", "ignore").str.decode("ascii"))
+    palabras = distintas.str.findall(r"[^\W\d_]{2,}").explode().dropna()
+    pares = pd.DataFrame({"texto": palabras.index.to_numpy(dtype="int64"), "rasgo": palabras.to_numpy(dtype=object)})
+    return codigos, pares.drop_duplicates()
+
+
+def _tramo(valor):
+    # Orden de magnitud en base 2: un café y el arriendo no caen en el mismo tramo
+    valor = pd.to_numeric(pd.Series(valor, dtype=object), errors="coerce").fillna(1).to_numpy(dtype=float)
+    return np.floor(np.log2(np.clip(valor, 1, None))).astype(int)
+
+
+def _contar(rasgo, codigo, prefijo):
+    # Cantidad por (rasgo, categoría); el texto del rasgo se arma solo para los grupos
+    conteo = pd.DataFrame({"rasgo": rasgo, "categoria": codigo}).value_counts().rename("cantidad").reset_index()
+    return conteo.assign(rasgo=prefijo + conteo["rasgo"].astype(str))
+
+
+class ModeloCategorias:
+    """Clasificador de categorías entrenado con un DataFrame de movimientos.
+
+    Guarda un vocabulario de rasgos (palabras, `pago:<forma>` y `valor:<tramo>`)
+    y la matriz de log-probabilidades rasgo × categoría; clasificar es indexar
+    esa matriz y sumar por fila.
+    """
+
+    def __init__(self, df):
+        self.categorias = list(datos.CATEGORIAS)
+        self.mascaras = {tipo: np.isin(self.categorias, validas) for tipo, validas in datos.TIPO_CATEGORIAS.items()}
+        n_categorias = len(self.categorias)
+
+        if df is None or df.empty:
+            df = pd.DataFrame(columns=["tipo", "categoria", "valor", "descripcion", "forma_pago"])
+        codigo = pd.Categorical(df["categoria"].astype(object), categories=self.categorias).codes
+        df = df[codigo >= 0]
+        codigo = codigo[codigo >= 0].astype("int64")
+        self.entrenado_con = len(df)
+
+        # Las filas se agrupan por (texto, categoría) y cada palabra del texto suma su cantidad
+        textos, pares = _palabras(df["descripcion"])
+        grupos = pd.DataFrame({"texto": textos, "categoria": codigo}).value_counts().rename("cantidad").reset_index()
+        conteos = [
+            pares.merge(grupos, on="texto")[["rasgo", "categoria", "cantidad"]],
+            _contar(df["forma_pago"].astype(object).fillna("").to_numpy(), codigo, "pago:"),
+            _contar(_tramo(df["valor"]), codigo, "valor:"),
+        ]
+        semillas = [(palabra, self.categorias.index(c)) for c, texto in PALABRAS_CLAVE.items() for palabra in texto.split()]
+        conteos.append(pd.DataFrame(semillas, columns=["rasgo", "categoria"]).assign(cantidad=PESO_PALABRA_CLAVE))
+        conteos = pd.concat(conteos, ignore_index=True)
+
+        rasgos, self.vocabulario = pd.factorize(conteos["rasgo"])
+        matriz = np.bincount(rasgos * n_categorias + conteos["categoria"].to_numpy(dtype="int64"),
+                             weights=conteos["cantidad"].to_numpy(dtype=float),
+                             minlength=len(self.vocabulario) * n_categorias).reshape(-1, n_categorias)
+        self.log_prob = np.log((matriz + SUAVIZADO) / (matriz.sum(axis=0) + SUAVIZADO * len(self.vocabulario)))
+        # Fila de ceros al final: los rasgos desconocidos (índice -1) no suman nada
+        self.log_prob = np.vstack([self.log_prob, np.zeros(n_categorias)])
+        self.log_prior = np.log((np.bincount(codigo, minlength=n_categorias) + SUAVIZADO) / (len(codigo) + SUAVIZADO * n_categorias))
+
+    def probabilidades(self, tipo, descripcion, forma_pago, valor):
+        """(matriz filas × categorías con la probabilidad de cada una, palabras conocidas por fila).
+
+        Los cuatro argumentos son secuencias de la misma longitud.
+        """
+        tipo = pd.Series(tipo).astype(str).to_numpy()
+        n_filas = len(tipo)
+        n_categorias = len(self.categorias)
+
+        # Puntaje de las palabras por texto distinto, luego expandido a las filas
+        textos, pares = _palabras(pd.Series(descripcion, dtype=object).reset_index(drop=True))
+        rasgo = self.vocabulario.get_indexer(pares["rasgo"])
+        conocidas = rasgo >= 0
+        texto = pares["texto"].to_numpy()[conocidas]
+        rasgo = rasgo[conocidas]
+        n_textos = textos.max() + 1 if n_filas else 0
+        por_texto = np.column_stack([
+            np.bincount(texto, weights=self.log_prob[rasgo, c], minlength=n_textos) for c in range(n_categorias)
+        ]) if n_textos else np.zeros((0, n_categorias))
+        palabras_texto = np.bincount(texto, minlength=n_textos)
+
+        pago = self.vocabulario.get_indexer("pago:" + pd.Series(forma_pago, dtype=object).fillna("").astype(str))
+        tramo = self.vocabulario.get_indexer("valor:" + pd.Series(_tramo(valor)).astype(str))
+        puntaje = self.log_prior + por_texto[textos] + self.log_prob[pago] + self.log_prob[tramo]
+
+        validas = np.zeros((n_filas, n_categorias), dtype=bool)
+        for nombre, mascara in self.mascaras.items():
+            validas[tipo == nombre] = mascara
+        puntaje = np.where(validas, puntaje, -np.inf)
+        puntaje -= np.max(puntaje, axis=1, keepdims=True)
+        probabilidad = np.exp(puntaje)
+        probabilidad /= probabilidad.sum(axis=1, keepdims=True)
+        return probabilidad, palabras_texto[textos]
+
+    def clasificar(self, tipo, descripcion, forma_pago, valor):
+        """DataFrame (categoria, confianza) con la categoría más probable de cada fila.
+
+        Las filas sin ninguna palabra conocida en la descripción, o cuya mejor
+        categoría no llega a CONFIANZA_MINIMA, quedan con categoría None.
+        """
+        probabilidad, palabras = self.probabilidades(tipo, descripcion, forma_pago, valor)
+        mejor = probabilidad.argmax(axis=1)
+        confianza = probabilidad[np.arange(len(mejor)), mejor]
+        categoria = np.array(self.categorias, dtype=object)[mejor]
+        categoria[(palabras == 0) | (confianza < CONFIANZA_MINIMA)] = None
+        return pd.DataFrame({"categoria": categoria, "confianza": confianza})
@@ -0,0 +1,231 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+import metricas
+
+logger = logging.getLogger(__name__)
+
+# --- COLA DE ESCRITURA ---
+# Los movimientos del formulario se guardan primero en una cola SQLite local y
+# el formulario responde al instante; un hilo los envía al almacenamiento por
+# lotes. Cada fila lleva una `clave_idempotencia` única, así que reenviar un lote
+# cuyo resultado se perdió (timeout, caída de red) no duplica movimientos. Si el
+# envío falla se reintenta con espera exponencial; lo pendiente sobrevive a un
+# reinicio del proceso porque está en disco.
+
+RUTA_DEFECTO = "cola_escritura.db"
+TAMANO_LOTE = 100
+INTERVALO_SEGUNDOS = 5
+ESPERA_MAXIMA_SEGUNDOS = 300
+# A partir de aquí la fila deja de reintentarse sola y se muestra como error
+MAX_INTENTOS = 8
+
+ESQUEMA_COLA = """
+create table if not exists pendientes (
+    seq integer primary key autoincrement,
+    clave text not null unique,
+    usuario_id integer not null,
+    fila text not null,
+    intentos integer not null default 0,
+    proximo_intento real not null default 0,
+    error text
+);
+create index if not exists pendientes_usuario_idx on pendientes (usuario_id, seq);
+"""
+
+
+class ColaEscritura:
+    """Cola durable de movimientos pendientes de guardar en `almacen`.
+
+    `al_confirmar(usuario_id, filas)` se llama desde el hilo de envío con las
+    filas ya guardadas (con su `id` definitivo), p. ej. para añadirlas a la caché.
+    Mientras tanto `pendientes` las devuelve con un id provisional negativo
+    para que la interfaz las muestre (actualización optimista).
+
+    `al_confirmar` se llama con el lock de la cola tomado, así que el orden de
+    locks es siempre cola -> quien recibe las filas (p. ej. la caché): ese
+    callback no debe llamar a la cola.
+    """
+
+    def __init__(self, almacen, ruta=RUTA_DEFECTO, al_confirmar=None, tamano_lote=TAMANO_LOTE,
+                 intervalo=INTERVALO_SEGUNDOS, iniciar=True):
+        self.almacen = almacen
+        self.al_confirmar = al_confirmar
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        # Tras un fallo se envía de una en una hasta el siguiente éxito, para que
+        # una fila que el servidor rechaza no bloquee a las demás
+        self._lote = tamano_lote
+        self._con = sqlite3.connect(ruta, timeout=30, check_same_thread=False)
+        self._con.executescript(ESQUEMA_COLA)
+        if ruta != ":memory:":
+            self._con.execute("pragma journal_mode = wal")
+        self._lock = threading.Lock()
+        # seqs del lote que se está enviando y los que se cancelaron durante el envío
+        self._enviando = set()
+        self._canceladas = set()
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._hilo = None
+        if iniciar:
+            self.iniciar()
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="cola-escritura", daemon=True)
+            self._hilo.start()
+
+    def detener(self, vaciar=True):
+        """Para el hilo de envío; con `vaciar`, intenta antes un último envío."""
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+        if vaciar:
+            while self.enviar():
+                pass
+
+    # --- Encolar y consultar ---
+    def encolar(self, filas):
+        """Guarda las filas en la cola y devuelve las claves de idempotencia asignadas."""
+        claves = []
+        with self._lock, self._con:
+            for fila in filas:
+                fila = dict(fila)
+                fila.setdefault("clave_idempotencia", uuid.uuid4().hex)
+                self._con.execute(
+                    "insert or ignore into pendientes (clave, usuario_id, fila) values (?, ?, ?)",
+                    (fila["clave_idempotencia"], fila["usuario_id"], json.dumps(fila)),
+                )
+                claves.append(fila["clave_idempotencia"])
+        metricas.incrementar("cola_encoladas", len(claves))
+        self._despertar.set()
+        return claves
+
+    def pendientes(self, usuario_id):
+        """Filas del usuario aún sin guardar, con `id` provisional negativo (-seq)."""
+        with self._lock:
+            filas = self._con.execute(
+                "select seq, fila from pendientes where usuario_id = ? order by seq", (usuario_id,)
+            ).fetchall()
+        return [dict(json.loads(fila), id=-seq) for seq, fila in filas]
+
+    def errores(self, usuario_id):
+        """Número de filas del usuario que agotaron los reintentos automáticos."""
+        with self._lock:
+            return self._con.execute(
+                "select count(*) from pendientes where usuario_id = ? and intentos >= ?", (usuario_id, MAX_INTENTOS)
+            ).fetchone()[0]
+
+    def cancelar(self, usuario_id, ids):
+        """Quita de la cola las filas con los ids provisionales dados (si no se enviaron ya).
+
+        Si alguna se está enviando en ese momento, se borra del almacenamiento en
+        cuanto se confirma, sin llegar a `al_confirmar`.
+        """
+        seqs = [-int(i) for i in ids]
+        if not seqs:
+            return
+        marcas = ", ".join("?" * len(seqs))
+        with self._lock, self._con:
+            borradas = self._con.execute(
+                f"delete from pendientes where usuario_id = ? and seq in ({marcas}) returning seq", [usuario_id] + seqs
+            ).fetchall()
+            self._canceladas.update(seq for seq, in borradas if seq in self._enviando)
+
+    def reintentar(self, usuario_id):
+        """Vuelve a poner en marcha las filas del usuario que agotaron los reintentos."""
+        with self._lock, self._con:
+            self._con.execute("update pendientes set intentos = 0, proximo_intento = 0 where usuario_id = ?", (usuario_id,))
+        self._despertar.set()
+
+    # --- Envío ---
+    def enviar(self):
+        """Envía un lote de filas listas. Devuelve True si envió algo."""
+        with self._lock:
+            lote = self._con.execute(
+                "select seq, fila, intentos from pendientes where intentos < ? and proximo_intento <= ? order by seq limit ?",
+                (MAX_INTENTOS, time.time(), self._lote),
+            ).fetchall()
+            self._enviando = {seq for seq, _, _ in lote}
+        if not lote:
+            return False
+        filas = [json.loads(fila) for _, fila, _ in lote]
+        try:
+            with metricas.medir("cola_envio"):
+                guardadas = self.almacen.insertar_movimientos(filas)
+        except Exception as e:
+            self._fallo(lote, e)
+            return False
+        metricas.incrementar("cola_confirmadas", len(guardadas))
+        self._lote = self.tamano_lote
+        with self._lock:
+            with self._con:
+                self._con.executemany("delete from pendientes where seq = ?", [(seq,) for seq, _, _ in lote])
+            # Las guardadas vienen en el orden del lote
+            canceladas = [fila for (seq, _, _), fila in zip(lote, guardadas) if seq in self._canceladas]
+            confirmadas = [fila for (seq, _, _), fila in zip(lote, guardadas) if seq not in self._canceladas]
+            self._enviando, self._canceladas = set(), set()
+            # Dentro del lock: quien lea la cola después ya encuentra las filas en la caché
+            self._confirmar(confirmadas)
+        if canceladas:
+            # Fuera del lock: es una llamada de red
+            try:
+                for usuario_id, filas_usuario in _por_usuario(canceladas).items():
+                    self.almacen.eliminar_movimientos(usuario_id, [fila["id"] for fila in filas_usuario])
+            except Exception as e:
+                # Siguen guardadas: se muestran para que el usuario pueda borrarlas de nuevo
+                logger.warning("No se pudieron borrar %d movimiento(s) cancelados durante su envío: %s", len(canceladas), e)
+                with self._lock:
+                    self._confirmar(canceladas)
+        return True
+
+    def _confirmar(self, filas):
+        if self.al_confirmar is not None:
+            for usuario_id, filas_usuario in _por_usuario(filas).items():
+                self.al_confirmar(usuario_id, filas_usuario)
+
+    def _fallo(self, lote, error):
+        ahora = time.time()
+        self._lote = 1
+        with self._lock, self._con:
+            self._enviando, self._canceladas = set(), set()
+            self._con.executemany(
+                "update pendientes set intentos = ?, proximo_intento = ?, error = ? where seq = ?",
+                [(intentos + 1, ahora + min(2 ** intentos, ESPERA_MAXIMA_SEGUNDOS), str(error), seq)
+                 for seq, _, intentos in lote],
+            )
+        metricas.incrementar("cola_fallos")
+        logger.warning("No se pudo enviar un lote de %d movimiento(s); se reintentará: %s", len(lote), error)
+
+    def _espera(self):
+        # Segundos hasta la próxima fila lista, con `intervalo` como máximo
+        with self._lock:
+            proximo = self._con.execute(
+                "select min(proximo_intento) from pendientes where intentos < ?", (MAX_INTENTOS,)
+            ).fetchone()[0]
+        if proximo is None:
+            return self.intervalo
+        return min(max(proximo - time.time(), 0), self.intervalo)
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            self._despertar.clear()
+            try:
+                if self.enviar():
+                    continue
+            except Exception:
+                logger.exception("Error inesperado en la cola de escritura")
+            self._despertar.wait(self._espera())
+
+
+def _por_usuario(filas):
+    por_usuario = {}
+    for fila in filas:
+        por_usuario.setdefault(fila["usuario_id"], []).append(fila)
+    return por_usuario
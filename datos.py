@@ -0,0 +1,576 @@
+import datetime
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import metricas
+from almacenamiento import COLUMNAS_MOVIMIENTOS, COLUMNAS_RESUMEN
+
+# --- CATEGORÍAS MAESTRAS (GLOBAL) ---
+TIPO_CATEGORIAS = {
+    "ingreso": ["Sueldo", "Inversiones", "Ganancias", "Prestamos", "Retornos", "Otros Ingresos"],
+    "gasto": ["Hogar", "Vehículo", "Alimentación", "Entretenimiento", "Bancos", "Salud", "Educacion", "Imprevistos", "Ropa", "Gym", "Transporte", "Servicios", "Regalos", "Ahorro", "Inversion"]
+}
+FORMAS_PAGO = ["Efectivo", "Tarjeta Crédito", "Tarjeta Débito", "Transferencia"]
+
+# --- ACCESO A DATOS DE MOVIMIENTOS ---
+# Todas las pestañas leen el mismo DataFrame: se consulta el almacenamiento una
+# sola vez por ejecución del script y se entrega una vista de solo lectura.
+# `almacen` es cualquier implementación de `almacenamiento.Almacenamiento`.
+
+# Límites de la caché compartida entre sesiones: una entrada sin usarse durante
+# CACHE_TTL_SEGUNDOS se descarta, y cada CACHE_SYNC_SEGUNDOS se sincroniza
+# de forma incremental con la base de datos.
+CACHE_TTL_SEGUNDOS = 1800
+CACHE_SYNC_SEGUNDOS = 60
+CACHE_MAX_USUARIOS = 1000
+# Resultados memorizados por usuario (páginas, búsquedas, figuras, simulaciones)
+CACHE_MAX_MEMO = 32
+
+# PostgREST devuelve como máximo 1000 filas por petición en Supabase
+TAMANO_LOTE = 1000
+
+
+def iterar_movimientos(almacen, usuario_id, desde_id=0, tamano=TAMANO_LOTE):
+    """Genera los movimientos con `id` mayor que `desde_id` en lotes (listas de dicts).
+
+    Paginación por clave sobre `id`: cada lote continúa después del último id
+    recibido, sin OFFSET, y nunca hay más de un lote en memoria.
+    """
+    ultimo = desde_id
+    while True:
+        lote = almacen.lote_movimientos(usuario_id, ultimo, tamano)
+        if lote:
+            yield lote
+        if len(lote) < tamano:
+            break
+        ultimo = lote[-1]["id"]
+
+
+def cargar_movimientos(almacen, usuario_id, desde_id=0):
+    """Devuelve los movimientos del usuario con `id` mayor que `desde_id`.
+
+    Sirve tanto para la carga completa (`desde_id=0`) como para traer solo lo nuevo.
+    El DataFrame ya viene tipado (ver `_a_dataframe`). Las pestañas no deben
+    modificarlo; si necesitan columnas extra usan `assign`.
+    """
+    filas = []
+    for lote in iterar_movimientos(almacen, usuario_id, desde_id):
+        filas.extend(lote)
+    return _a_dataframe(filas)
+
+
+# --- REPRESENTACIÓN EN MEMORIA ---
+# Los vocabularios fijos se guardan como categorías (un código de 1 byte por
+# fila en vez de un objeto str), `descripcion` como texto de Arrow si pyarrow
+# funciona y `valor` redondeado a centavos. Año, mes e inicio de semana
+# se calculan una sola vez al cargar y los usan filtros y agrupaciones.
+TIPOS = list(TIPO_CATEGORIAS)
+CATEGORIAS = [c for categorias in TIPO_CATEGORIAS.values() for c in categorias]
+
+
+def _pyarrow_disponible():
+    # Que esté instalado no basta: una versión compilada contra otro NumPy, o
+    # más antigua de la que pide pandas, falla al importarse o al usarse
+    try:
+        import pyarrow.parquet  # noqa: F401
+        pd.array([""], dtype="string[pyarrow]")
+    except Exception:
+        return False
+    return True
+
+
+PYARROW_DISPONIBLE = _pyarrow_disponible()
+TIPO_TEXTO = "string[pyarrow]" if PYARROW_DISPONIBLE else "string"
+
+
+def _categorica(serie, vocabulario):
+    # Valores fuera del vocabulario (datos antiguos o importados) se conservan
+    # como categorías adicionales en vez de convertirse en nulos
+    extra = sorted(set(serie.dropna().unique()) - set(vocabulario))
+    return serie.astype(pd.CategoricalDtype(vocabulario + extra))
+
+
+@metricas.medido("dataframe")
+def _tipar(df):
+    fecha = pd.to_datetime(df["fecha"])
+    return pd.DataFrame({
+        "id": df["id"].astype("int64"),
+        "fecha": fecha,
+        "tipo": _categorica(df["tipo"], TIPOS),
+        "categoria": _categorica(df["categoria"], CATEGORIAS),
+        "valor": pd.to_numeric(df["valor"]).astype("float64").round(2),
+        "descripcion": df["descripcion"].astype(TIPO_TEXTO),
+        "forma_pago": _categorica(df["forma_pago"], FORMAS_PAGO),
+        "anio": fecha.dt.year.astype("int16"),
+        "mes": fecha.dt.month.astype("int8"),
+        "semana": fecha - pd.to_timedelta(fecha.dt.dayofweek, unit="D"),
+    })
+
+
+def _a_dataframe(filas):
+    """Filas del almacenamiento (dicts) como DataFrame tipado de movimientos."""
+    return _tipar(pd.DataFrame(filas, columns=COLUMNAS_MOVIMIENTOS))
+
+
+def _ordenar(df):
+    return df.sort_values(["fecha", "id"], ascending=False, kind="stable", ignore_index=True)
+
+
+def _unir(*partes):
+    # Si las partes tienen categorías distintas, concat las deja como object
+    return _ordenar(_tipar(pd.concat(partes, ignore_index=True)))
+
+
+# --- PAGINACIÓN POR CLAVE (fecha, id) ---
+def pagina_movimientos(almacen, usuario_id, tamano, cursor=None):
+    """Una página de movimientos en orden (fecha desc, id desc).
+
+    `cursor` es el (fecha, id) del último movimiento de la página anterior; la
+    consulta continúa justo después de él, sin OFFSET, así que cuesta lo mismo
+    la primera página que la número mil. Devuelve (DataFrame, hay_mas).
+    """
+    filas = almacen.pagina_movimientos(usuario_id, tamano + 1, cursor)
+    return _a_dataframe(filas[:tamano]), len(filas) > tamano
+
+
+def cursor_siguiente(df_pagina):
+    """Cursor (fecha, id) para pedir la página que sigue a `df_pagina`."""
+    ultima = df_pagina.iloc[-1]
+    return ultima["fecha"].date().isoformat(), int(ultima["id"])
+
+
+def buscar_movimientos(almacen, usuario_id, filtros, limite, desplazamiento=0):
+    """Búsqueda en el servidor (ver busqueda.py): conteos por faceta y una página de movimientos."""
+    respuesta = almacen.buscar_movimientos(usuario_id, filtros, limite, desplazamiento)
+    return respuesta["grupos"], _a_dataframe(respuesta["filas"])
+
+
+def etiquetas_movimientos(df):
+    """Texto para identificar cada movimiento en un selector, construido por columnas."""
+    return (
+        df["fecha"].dt.strftime("%Y-%m-%d") + " - " + df["categoria"].astype(str) + ": "
+        + df["descripcion"].fillna("").astype(str) + " ($" + df["valor"].astype(str) + ") #" + df["id"].astype(str)
+    )
+
+
+def eliminar_movimientos(almacen, usuario_id, ids):
+    """Borra varios movimientos del usuario en una sola petición."""
+    almacen.eliminar_movimientos(usuario_id, ids)
+
+
+# --- SINCRONIZACIÓN INCREMENTAL ---
+def cargar_ids(almacen, usuario_id):
+    ids = []
+    ultimo = 0
+    while True:
+        lote = almacen.lote_ids(usuario_id, ultimo, TAMANO_LOTE)
+        ids.extend(lote)
+        if len(lote) < TAMANO_LOTE:
+            break
+        ultimo = lote[-1]
+    return ids
+
+
+def sincronizar(almacen, df, usuario_id, marca):
+    """Aplica a `df` los cambios del servidor desde la marca de agua `marca`.
+
+    Trae solo las filas con `id > marca` y después compara conteo y suma de ids
+    con el servidor; solo si no coinciden descarga la lista de ids para quitar
+    los movimientos borrados. Devuelve el DataFrame actualizado y la nueva marca.
+    """
+    nuevas = cargar_movimientos(almacen, usuario_id, desde_id=marca)
+    if not nuevas.empty:
+        df = _unir(nuevas, df[~df["id"].isin(nuevas["id"])])
+        marca = max(marca, int(nuevas["id"].max()))
+
+    total, suma_ids = almacen.resumen_movimientos(usuario_id)
+    if total != len(df) or (suma_ids is not None and suma_ids != int(df["id"].sum())):
+        ids = cargar_ids(almacen, usuario_id)
+        df = df[df["id"].isin(ids)].reset_index(drop=True)
+        if len(df) != len(ids):
+            # Hay filas que no conocemos por debajo de la marca: recarga completa
+            df = _ordenar(cargar_movimientos(almacen, usuario_id))
+            marca = int(df["id"].max()) if not df.empty else 0
+    return df, marca
+
+
+# --- CACHÉ POR USUARIO (WRITE-THROUGH) ---
+_versiones = itertools.count(1)
+
+
+class _Entrada:
+    __slots__ = ("df", "version", "marca", "sincronizada", "ultimo_acceso", "presupuestos", "limites", "memo", "resumen")
+
+    def __init__(self, df, marca=0):
+        self.df = df
+        self.version = next(_versiones)
+        self.marca = marca
+        self.sincronizada = self.ultimo_acceso = time.monotonic()
+        self.presupuestos = {}
+        # Filas de `limites_categoria` del usuario, o None si no se han leído
+        self.limites = None
+        self.memo = OrderedDict()
+        # Resumen mensual: se calcula al pedirlo y después se actualiza con cada escritura
+        self.resumen = None
+
+
+class CacheMovimientos:
+    """Caché de movimientos por usuario, compartida por todas las sesiones del proceso.
+
+    Cada entrada guarda la copia local del usuario, una versión que cambia con
+    cada escritura y la marca de agua (`id` más alto leído del servidor) para la
+    sincronización incremental. Las entradas sin uso durante `ttl` segundos se
+    descartan y hay un límite LRU de usuarios para que la memoria no crezca con
+    el número de sesiones. Las escrituras actualizan la entrada en sitio, así
+    que el `st.rerun()` posterior no necesita volver a consultar la base de datos.
+    """
+
+    def __init__(self, max_usuarios=CACHE_MAX_USUARIOS, ttl=CACHE_TTL_SEGUNDOS, intervalo_sync=CACHE_SYNC_SEGUNDOS):
+        self.max_usuarios = max_usuarios
+        self.ttl = ttl
+        self.intervalo_sync = intervalo_sync
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entrada(self, usuario_id):
+        # Debe llamarse con el lock tomado
+        entrada = self._entradas.get(usuario_id)
+        if entrada is None:
+            return None
+        ahora = time.monotonic()
+        if entrada.ultimo_acceso + self.ttl < ahora:
+            del self._entradas[usuario_id]
+            return None
+        entrada.ultimo_acceso = ahora
+        self._entradas.move_to_end(usuario_id)
+        return entrada
+
+    def _insertar(self, usuario_id, entrada):
+        self._entradas[usuario_id] = entrada
+        self._entradas.move_to_end(usuario_id)
+        while len(self._entradas) > self.max_usuarios:
+            self._entradas.popitem(last=False)
+
+    def obtener(self, usuario_id):
+        with self._lock:
+            entrada = self._entrada(usuario_id)
+            return entrada.df if entrada is not None else None
+
+    def version(self, usuario_id):
+        with self._lock:
+            entrada = self._entrada(usuario_id)
+            return entrada.version if entrada is not None else 0
+
+    def estado(self, usuario_id):
+        """(df, versión, marca, necesita_sync) de la entrada; df es None si no hay copia local."""
+        with self._lock:
+            entrada = self._entrada(usuario_id)
+            if entrada is None:
+                return None, 0, 0, True
+            vencida = entrada.sincronizada + self.intervalo_sync < time.monotonic()
+            return entrada.df, entrada.version, entrada.marca, entrada.df is None or vencida
+
+    def guardar(self, usuario_id, df, marca, version_base=0):
+        """Guarda una carga o sincronización, salvo que haya habido escrituras mientras se leía."""
+        with self._lock:
+            entrada = self._entrada(usuario_id)
+            actual = entrada.version if entrada is not None else 0
+            if actual != version_base:
+                return False
+            if entrada is not None and entrada.df is df:
+                # Sincronización sin cambios: se conserva la versión
+                entrada.marca = marca
+                entrada.sincronizada = time.monotonic()
+                entrada.presupuestos = {}
+                entrada.limites = None
+                return True
+            self._insertar(usuario_id, _Entrada(df, marca))
+            return True
+
+    def agregar(self, usuario_id, filas):
+        """Añade a la caché las filas recién insertadas en la base de datos.
+
+        La marca de agua no se mueve: otras sesiones pueden haber insertado filas
+        con ids menores que todavía no conocemos.
+        """
+        with self._lock:
+            entrada = self._entrada(usuario_id)
+            if entrada is None or entrada.df is None:
+                self._marcar_escritura(usuario_id, entrada)
+                return
+            nuevas = _a_dataframe(filas)
+            # Una sincronización pudo traerlas ya (p. ej. si las confirmó otro hilo)
+            nuevas = nuevas[~nuevas["id"].isin(entrada.df["id"])]
+            if nuevas.empty:
+                return
+            entrada.df = _unir(nuevas, entrada.df)
+            if entrada.resumen is not None:
+                entrada.resumen = combinar_resumen(entrada.resumen, resumir_movimientos(nuevas))
+            entrada.version = next(_versiones)
+            entrada.memo = OrderedDict()
+
+    def eliminar(self, usuario_id, ids):
+        """Quita de la caché los movimientos borrados en la base de datos."""
+        with self._lock:
+            entrada = self._entrada(usuario_id)
+            if entrada is None or entrada.df is None:
+                self._marcar_escritura(usuario_id, entrada)
+                return
+            borradas = entrada.df["id"].isin(list(ids))
+            if entrada.resumen is not None:
+                entrada.resumen = combinar_resumen(entrada.resumen, resumir_movimientos(entrada.df[borradas]), signo=-1)
+            entrada.df = entrada.df[~borradas].reset_index(drop=True)
+            entrada.version = next(_versiones)
+            entrada.memo = OrderedDict()
+
+    def _marcar_escritura(self, usuario_id, entrada):
+        # Sin datos cargados: dejamos una entrada vacía con versión nueva para que
+        # una carga que empezó antes de esta escritura no se guarde desactualizada.
+        if entrada is None:
+            self._insertar(usuario_id, _Entrada(None))
+        else:
+            entrada.version = next(_versiones)
+            entrada.memo = OrderedDict()
+
+    def obtener_presupuesto(self, usuario_id, anio):
+        with self._lock:
+            entrada = self._entrada(usuario_id)
+            if entrada is None:
+                return None
+            return entrada.presupuestos.get(anio)
+
+    def guardar_presupuesto(self, usuario_id, anio, fila):
+        with self._lock:
+            entrada = self._entrada(usuario_id)
+            if entrada is not None:
+                entrada.presupuestos[anio] = fila
+
+    def obtener_limites(self, usuario_id):
+        with self._lock:
+            entrada = self._entrada(usuario_id)
+            return entrada.limites if entrada is not None else None
+
+    def guardar_limites(self, usuario_id, limites):
+        with self._lock:
+            entrada = self._entrada(usuario_id)
+            if entrada is None:
+                entrada = _Entrada(None)
+                self._insertar(usuario_id, entrada)
+            entrada.limites = limites
+
+    def resumen(self, usuario_id):
+        """Resumen mensual de la copia local (ver `resumir_movimientos`), o None sin copia."""
+        with self._lock:
+            entrada = self._entrada(usuario_id)
+            if entrada is None or entrada.df is None:
+                return None
+            if entrada.resumen is None:
+                entrada.resumen = resumir_movimientos(entrada.df)
+            return entrada.resumen
+
+    def recordar(self, usuario_id, clave, calcular, vigencia=None):
+        """Resultado de `calcular()` memorizado para la versión actual de los datos del usuario.
+
+        La versión solo cambia con las escrituras de este proceso y con las
+        sincronizaciones de la copia local. Lo que se lee directamente del
+        servidor (páginas de Gestión, agregados en modo servidor) no se entera de
+        lo que escriben otros procesos, así que se memoriza con `vigencia`: pasados
+        esos segundos se vuelve a calcular aunque la versión sea la misma.
+        Cada usuario guarda como mucho CACHE_MAX_MEMO resultados (LRU).
+        """
+        with self._lock:
+            entrada = self._entrada(usuario_id)
+            if entrada is None:
+                # Sin copia local (p. ej. en modo servidor): entrada vacía solo para memorizar
+                entrada = _Entrada(None)
+                self._insertar(usuario_id, entrada)
+            version = entrada.version
+            # Las claves son tuplas ("figuras", ...) o cadenas; la métrica usa el tipo
+            tipo = clave[0] if isinstance(clave, tuple) else clave
+            guardado = entrada.memo.get(clave)
+            if guardado is not None:
+                if vigencia is None or guardado[1] + vigencia >= time.monotonic():
+                    entrada.memo.move_to_end(clave)
+                    metricas.acierto(f"memo:{tipo}", "acierto")
+                    return guardado[0]
+                del entrada.memo[clave]
+        metricas.acierto(f"memo:{tipo}", "fallo")
+        resultado = calcular()
+        with self._lock:
+            entrada = self._entrada(usuario_id)
+            if entrada is not None and entrada.version == version:
+                entrada.memo[clave] = (resultado, time.monotonic())
+                entrada.memo.move_to_end(clave)
+                while len(entrada.memo) > CACHE_MAX_MEMO:
+                    entrada.memo.popitem(last=False)
+        return resultado
+
+    def invalidar(self, usuario_id):
+        with self._lock:
+            self._entradas.pop(usuario_id, None)
+
+
+def obtener_movimientos(almacen, cache, usuario_id):
+    """Movimientos del usuario desde la caché.
+
+    Sin copia local hace la carga completa; con copia vencida solo pide al
+    servidor lo que cambió desde la última sincronización.
+    """
+    df, version, marca, necesita_sync = cache.estado(usuario_id)
+    if not necesita_sync:
+        metricas.acierto("movimientos", "acierto")
+        return df
+    if df is None:
+        metricas.acierto("movimientos", "carga")
+        df = _ordenar(cargar_movimientos(almacen, usuario_id))
+        marca = int(df["id"].max()) if not df.empty else 0
+    else:
+        metricas.acierto("movimientos", "sincronizacion")
+        df, marca = sincronizar(almacen, df, usuario_id, marca)
+    cache.guardar(usuario_id, df, marca, version)
+    return df
+
+
+def con_pendientes(df, pendientes):
+    """`df` más las filas aún en la cola de escritura (ids provisionales negativos)."""
+    if not pendientes:
+        return df
+    return _unir(_a_dataframe(pendientes), df)
+
+
+def obtener_presupuesto(almacen, cache, usuario_id, anio):
+    """Fila de `presupuestos` del año (o un dict vacío), pasando por la caché."""
+    fila = cache.obtener_presupuesto(usuario_id, anio)
+    metricas.acierto("presupuesto", "acierto" if fila is not None else "fallo")
+    if fila is None:
+        fila = almacen.presupuesto(usuario_id, anio)
+        cache.guardar_presupuesto(usuario_id, anio, fila)
+    return fila
+
+
+def obtener_limites(almacen, cache, usuario_id):
+    """Filas de `limites_categoria` del usuario (todas sus fechas), pasando por la caché."""
+    filas = cache.obtener_limites(usuario_id)
+    metricas.acierto("limites", "acierto" if filas is not None else "fallo")
+    if filas is None:
+        filas = almacen.limites_categoria(usuario_id)
+        cache.guardar_limites(usuario_id, filas)
+    return filas
+
+
+# --- AGREGADOS PARA ESTADÍSTICAS ---
+# Ambos modos devuelven el mismo formato: una fila por (periodo, semana, tipo, categoría)
+COLUMNAS_AGREGADOS = ["periodo", "semana", "tipo", "categoria", "total", "cantidad"]
+
+
+def rango_periodo(anio=None, mes=None):
+    """Rango [desde, hasta) de fechas para un año, o un mes de un año; None si no hay año."""
+    if anio is None:
+        return None, None
+    if mes is None:
+        return datetime.date(anio, 1, 1), datetime.date(anio + 1, 1, 1)
+    desde = datetime.date(anio, mes, 1)
+    hasta = datetime.date(anio + 1, 1, 1) if mes == 12 else datetime.date(anio, mes + 1, 1)
+    return desde, hasta
+
+
+def filtrar_periodo(df, anio=None, mes=None):
+    """Movimientos del periodo sin copiar el historial.
+
+    `df` viene ordenado por fecha descendente, así que el rango de un año o de un
+    mes concreto se localiza con búsqueda binaria y se devuelve como un corte.
+    Un mes sin año (ese mes de todos los años) no es un rango y usa una máscara.
+    """
+    desde, hasta = rango_periodo(anio, mes)
+    if desde is not None:
+        fechas = df["fecha"].to_numpy()[::-1]
+        n = len(fechas)
+        inicio = n - np.searchsorted(fechas, np.datetime64(hasta), side="left")
+        fin = n - np.searchsorted(fechas, np.datetime64(desde), side="left")
+        return df.iloc[inicio:fin]
+    if mes is not None:
+        return df[df["mes"] == mes]
+    return df
+
+
+@metricas.medido("agrupar", operacion="semanal")
+def agregar_movimientos(df):
+    """Agrupa movimientos ya cargados en memoria con el formato de `estadisticas_movimientos`."""
+    if df.empty:
+        return pd.DataFrame(columns=COLUMNAS_AGREGADOS)
+    agg = df.groupby(["anio", "mes", "semana", "tipo", "categoria"], observed=True)["valor"].agg(total="sum", cantidad="count").reset_index()
+    # El texto del periodo se arma sobre los grupos, no sobre cada movimiento
+    agg["periodo"] = agg["anio"].astype(str) + "-" + agg["mes"].map("{:02d}".format)
+    return agg[COLUMNAS_AGREGADOS]
+
+
+def agregados_servidor(almacen, usuario_id, anio=None, mes=None):
+    """Agregados del año/mes indicados (None = todos) calculados por el motor de almacenamiento.
+
+    Con año, el filtro viaja como rango de `fecha` y aprovecha el índice
+    (usuario_id, fecha); solo un mes de todos los años filtra por número de mes.
+    """
+    desde, hasta = rango_periodo(anio, mes)
+    filas = almacen.estadisticas(usuario_id, desde, hasta, mes if desde is None else None)
+    agg = pd.DataFrame(filas, columns=COLUMNAS_AGREGADOS)
+    agg["semana"] = pd.to_datetime(agg["semana"])
+    agg["total"] = pd.to_numeric(agg["total"])
+    return agg
+
+
+# --- RESUMEN MENSUAL ---
+# Una fila por (año, mes, tipo, categoría, forma de pago) con suma y conteo. Los
+# paneles y metas leen este resumen (unos cientos de filas) en vez del historial.
+# En la caché se mantiene sumando o restando el resumen de las filas escritas;
+# en el servidor lo mantiene el trigger de sql/resumen_mensual.sql.
+@metricas.medido("agrupar", operacion="resumen")
+def resumir_movimientos(df):
+    if df.empty:
+        return pd.DataFrame(columns=COLUMNAS_RESUMEN)
+    claves = ["anio", "mes", "tipo", "categoria", "forma_pago"]
+    return df.groupby(claves, observed=True, dropna=False)["valor"].agg(total="sum", cantidad="count").reset_index()
+
+
+def combinar_resumen(resumen, cambio, signo=1):
+    """Suma (o resta, con `signo=-1`) el resumen `cambio` a `resumen`; quita los grupos vacíos."""
+    if cambio.empty:
+        return resumen
+    cambio = cambio.assign(total=cambio["total"] * signo, cantidad=cambio["cantidad"] * signo)
+    if resumen.empty:
+        return cambio[cambio["cantidad"] > 0].reset_index(drop=True)
+    claves = ["anio", "mes", "tipo", "categoria", "forma_pago"]
+    combinado = pd.concat([resumen, cambio], ignore_index=True)
+    combinado = combinado.groupby(claves, observed=True, dropna=False)[["total", "cantidad"]].sum().reset_index()
+    combinado["total"] = combinado["total"].round(2)
+    return combinado[combinado["cantidad"] > 0].reset_index(drop=True)
+
+
+def resumen_servidor(almacen, usuario_id):
+    """Resumen mensual leído de la tabla `resumen_mensual` del almacenamiento."""
+    resumen = pd.DataFrame(almacen.resumen_mensual(usuario_id), columns=COLUMNAS_RESUMEN)
+    return resumen.astype({"anio": "int16", "mes": "int8", "total": "float64", "cantidad": "int64"})
+
+
+def filtrar_resumen(resumen, anio=None, mes=None):
+    if anio is not None:
+        resumen = resumen[resumen["anio"] == anio]
+    if mes is not None:
+        resumen = resumen[resumen["mes"] == mes]
+    return resumen
+
+
+def resumen_con_pendientes(resumen, pendientes):
+    """Resumen más las filas aún en la cola de escritura."""
+    if not pendientes:
+        return resumen
+    return combinar_resumen(resumen, resumir_movimientos(_a_dataframe(pendientes)))
+
+
+def periodos_resumen(resumen):
+    """Columna `periodo` (AAAA-MM) para agrupar el resumen por mes."""
+    return resumen["anio"].astype(str) + "-" + resumen["mes"].astype(int).map("{:02d}".format)
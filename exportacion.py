@@ -0,0 +1,78 @@
+import tempfile
+import zipfile
+
+import pandas as pd
+
+from datos import COLUMNAS_MOVIMIENTOS, PYARROW_DISPONIBLE, iterar_movimientos
+
+# --- EXPORTACIÓN DEL HISTORIAL (CSV / PARQUET / ZIP) ---
+# Los movimientos se leen lote a lote y cada lote se escribe en el archivo de
+# salida antes de pedir el siguiente: el historial completo nunca está en memoria.
+# La salida va a un archivo temporal que pasa a disco al superar LIMITE_MEMORIA_TEMPORAL.
+
+# Parquet solo se ofrece si pyarrow (dependencia opcional) se puede importar
+FORMATOS = ["CSV"] + (["Parquet"] if PYARROW_DISPONIBLE else []) + ["ZIP (movimientos + presupuestos)"]
+LIMITE_MEMORIA_TEMPORAL = 8 * 1024 * 1024
+
+
+def _lote_a_dataframe(lote):
+    df = pd.DataFrame(lote, columns=COLUMNAS_MOVIMIENTOS)
+    df["fecha"] = pd.to_datetime(df["fecha"])
+    return df
+
+
+def escribir_csv(almacen, usuario_id, destino):
+    """Escribe los movimientos como CSV (UTF-8) en el archivo binario `destino`."""
+    primero = True
+    for lote in iterar_movimientos(almacen, usuario_id):
+        df = _lote_a_dataframe(lote)
+        destino.write(df.to_csv(index=False, header=primero, date_format="%Y-%m-%d").encode("utf-8"))
+        primero = False
+    if primero:
+        destino.write((",".join(COLUMNAS_MOVIMIENTOS) + "\n").encode("utf-8"))
+
+
+def escribir_parquet(almacen, usuario_id, destino):
+    """Escribe los movimientos como Parquet en `destino`, un grupo de filas por lote."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    esquema = pa.schema([
+        ("id", pa.int64()),
+        ("fecha", pa.timestamp("ns")),
+        ("tipo", pa.string()),
+        ("categoria", pa.string()),
+        ("valor", pa.float64()),
+        ("descripcion", pa.string()),
+        ("forma_pago", pa.string()),
+    ])
+    with pq.ParquetWriter(destino, esquema) as escritor:
+        for lote in iterar_movimientos(almacen, usuario_id):
+            df = _lote_a_dataframe(lote).astype({"valor": "float64"})
+            escritor.write_table(pa.Table.from_pandas(df, schema=esquema, preserve_index=False))
+
+
+def escribir_zip(almacen, usuario_id, destino):
+    """ZIP con los movimientos (CSV) y los presupuestos del usuario."""
+    with zipfile.ZipFile(destino, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        with zf.open("movimientos.csv", "w") as salida:
+            escribir_csv(almacen, usuario_id, salida)
+        zf.writestr("presupuestos.csv", pd.DataFrame(almacen.presupuestos(usuario_id)).to_csv(index=False))
+
+
+def exportar(almacen, usuario_id, formato):
+    """Genera la exportación en un archivo temporal y lo devuelve (posicionado al inicio)
+    junto con el nombre de descarga y el tipo MIME."""
+    destino = tempfile.SpooledTemporaryFile(max_size=LIMITE_MEMORIA_TEMPORAL, mode="w+b")
+    fecha = pd.Timestamp.today().strftime("%Y%m%d")
+    if formato == "Parquet":
+        escribir_parquet(almacen, usuario_id, destino)
+        nombre, mime = f"movimientos_{fecha}.parquet", "application/octet-stream"
+    elif formato == "CSV":
+        escribir_csv(almacen, usuario_id, destino)
+        nombre, mime = f"movimientos_{fecha}.csv", "text/csv"
+    else:
+        escribir_zip(almacen, usuario_id, destino)
+        nombre, mime = f"finanzas_{fecha}.zip", "application/zip"
+    destino.seek(0)
+    return destino, nombre, mime
@@ -1,60 +1,162 @@
+import io
+import json
+import logging
 import os
 # Configuración para evitar errores en algunos entornos de despliegue
 os.environ["STREAMLIT_WATCHDOG"] = "false"  
 
 import streamlit as st
-import pandas as pd
-import plotly.express as px
+import numpy as np
 import datetime
-from supabase import create_client
-# pyrefly: ignore [missing-import]
-from passlib.hash import bcrypt
+import almacenamiento
+import autenticacion
+import busqueda
+import categorizacion
+import cola_escritura
+import datos
+import exportacion
+import graficos
+import importacion
+import metricas
+import presupuesto
+import proyeccion
+import recurrentes
+
+logger = logging.getLogger("finance")
+
+# Traza de tiempos de esta ejecución del script (ver el panel de rendimiento al final)
+metricas.iniciar_traza()
+
+# --- CONFIGURACIÓN DEL ALMACENAMIENTO ---
+# BACKEND = "supabase" (por defecto) o "sqlite" en los secrets. El motor se crea
+# una vez por proceso y se reutiliza en cada ejecución del script y en todas las
+# sesiones, conservando sus conexiones abiertas.
+@st.cache_resource(show_spinner=False)
+def obtener_almacenamiento():
+    almacen = almacenamiento.crear_almacenamiento(st.secrets)
+    if not almacen.disponible("clave_idempotencia"):
+        logger.error("Falta sql/idempotencia.sql: los reintentos de la cola de escritura pueden duplicar "
+                     "movimientos y los movimientos recurrentes quedan desactivados")
+    return almacen
 
-# --- CONFIGURACIÓN SUPABASE ---
 try:
-    SUPABASE_URL = st.secrets["SUPABASE_URL"]
-    SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
-    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    almacen = obtener_almacenamiento()
 except Exception as e:
-    st.error(f"Error configurando Supabase: {e}. Revisa tus secrets.")
+    st.error(f"Error configurando el almacenamiento: {e}. Revisa tus secrets.")
     st.stop()
 
 # --- CONFIGURACIÓN DE PÁGINA ---
 st.set_page_config(page_title="Finanzas Personales Pro", page_icon="💰", layout="wide")
 
+# --- AUTENTICACIÓN ---
+# BCRYPT_RONDAS en los secrets fija el coste; al cambiarlo, cada contraseña se
+# vuelve a hashear con el nuevo coste en el siguiente login de su dueño.
+@st.cache_resource(show_spinner=False)
+def obtener_autenticador():
+    return autenticacion.Autenticador(almacen, rondas=int(st.secrets.get("BCRYPT_RONDAS", autenticacion.RONDAS_DEFECTO)))
+
+autenticador = obtener_autenticador()
+
+# Tokens de sesión en la URL (?sesion=...): recargar o reconectar no repite el login.
+# SESION_SECRETO en los secrets mantiene válidos los tokens entre reinicios y
+# las revocaciones se guardan en el almacenamiento (sql/sesiones.sql en Supabase).
+@st.cache_resource(show_spinner=False)
+def obtener_sesiones():
+    return autenticacion.Sesiones(st.secrets.get("SESION_SECRETO"), almacen=almacen)
+
+sesiones = obtener_sesiones()
+
+# X-Forwarded-For solo se cree si la conexión viene de uno de PROXIES_CONFIABLES
+PROXIES_CONFIABLES = autenticacion.redes_confiables(st.secrets.get("PROXIES_CONFIABLES", []))
+
+def ip_cliente():
+    """IP del navegador de la sesión actual, o None."""
+    try:
+        from streamlit.runtime import get_instance
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        cliente = get_instance().get_client(get_script_run_ctx().session_id)
+        return autenticacion.ip_cliente(cliente.request.remote_ip, cliente.request.headers.get("X-Forwarded-For"),
+                                        PROXIES_CONFIABLES)
+    except Exception:
+        return None
+
+# --- CACHÉ COMPARTIDA ENTRE SESIONES ---
+@st.cache_resource
+def obtener_cache():
+    return datos.CacheMovimientos()
+
+cache_movimientos = obtener_cache()
+
+# --- COLA DE ESCRITURA ---
+# Los movimientos del formulario se encolan en un SQLite local (COLA_RUTA) y un
+# hilo los envía por lotes; al confirmarse pasan a la caché con su id definitivo.
+@st.cache_resource(show_spinner=False)
+def obtener_cola():
+    return cola_escritura.ColaEscritura(almacen, st.secrets.get("COLA_RUTA", cola_escritura.RUTA_DEFECTO),
+                                        al_confirmar=cache_movimientos.agregar)
+
+cola = obtener_cola()
+
+# --- MOVIMIENTOS RECURRENTES ---
+# Un hilo genera cada hora las ocurrencias vencidas de las reglas de todos los
+# usuarios. Con RECURRENTES_AUTOMATICOS = false no se arranca y se generan desde
+# cron con `python mantenimiento.py materializar-recurrentes`. Las reglas
+# necesitan sql/recurrentes.sql y, para no duplicar ocurrencias, sql/idempotencia.sql.
+def recurrentes_disponibles():
+    return almacen.disponible("recurrentes") and almacen.disponible("clave_idempotencia")
+
+@st.cache_resource(show_spinner=False)
+def obtener_programador():
+    if not st.secrets.get("RECURRENTES_AUTOMATICOS", True) or not recurrentes_disponibles():
+        return None
+    return recurrentes.Programador(almacen, al_confirmar=cache_movimientos.agregar)
+
+programador = obtener_programador()
+
+# --- MODO DE AGREGACIÓN ---
+# "local": las estadísticas se calculan con pandas sobre la copia en caché.
+# "servidor": se piden ya agrupadas al motor de almacenamiento (en Supabase
+# requiere sql/estadisticas.sql; en SQLite no necesita nada más).
+MODO_AGREGACION = st.secrets.get("MODO_AGREGACION", "local")
+
+# Cómo entran los movimientos recurrentes en la proyección
+OPCIONES_RECURRENTES = ["No incluir", "Ahorro e inversión programados", "Todo el excedente (ingresos - gastos)"]
+
+# Opciones de filas por página en la tabla de gestión
+TAMANOS_PAGINA = [25, 50, 100, 200]
+
+# Primera opción del selector de categoría: la elige el modelo al guardar
+CATEGORIA_AUTOMATICA = "🤖 Automática"
+
 # --- CATEGORÍAS MAESTRAS (GLOBAL) ---
-# Definimos esto al principio para que esté disponible en toda la app
-TIPO_CATEGORIAS = {
-    "ingreso": ["Sueldo", "Inversiones", "Ganancias", "Prestamos", "Retornos", "Otros Ingresos"],
-    "gasto": ["Hogar", "Vehículo", "Alimentación", "Entretenimiento", "Bancos", "Salud", "Educacion", "Imprevistos", "Ropa", "Gym", "Transporte", "Servicios", "Regalos", "Ahorro", "Inversion"]
-}
+# Definidas en datos.py para que también las usen la importación y demás módulos
+TIPO_CATEGORIAS = datos.TIPO_CATEGORIAS
+FORMAS_PAGO = datos.FORMAS_PAGO
 
 # --- FUNCIONES DE BASE DE DATOS ---
 def registrar_usuario(nombre, usuario, password):
-    hashed_password = bcrypt.hash(password)
     try:
-        response = supabase.table("usuarios").insert({
-            "nombre": nombre,
-            "usuario": usuario,
-            "password": hashed_password
-        }).execute()
-        return response
+        return autenticador.registrar(nombre, usuario, password)
+    except autenticacion.ServidorOcupado:
+        raise
     except Exception as e:
+        metricas.incrementar("registro_fallido", error=type(e).__name__)
+        logger.warning("No se pudo registrar el usuario %r: %s", usuario, e)
         return None
 
 def autenticar_usuario(usuario, password):
     try:
-        response = supabase.table("usuarios").select("id, password").eq("usuario", usuario).execute()
-        if response.data:
-            stored_password = response.data[0]["password"]
-            if bcrypt.verify(password, stored_password):
-                return response.data[0]["id"]
+        return autenticador.autenticar(usuario, password, ip_cliente())
+    except (autenticacion.DemasiadosIntentos, autenticacion.ServidorOcupado):
+        raise
     except Exception as e:
-        pass
+        metricas.incrementar("login_error", error=type(e).__name__)
+        logger.warning("Error autenticando al usuario %r: %s", usuario, e)
     return None
 
 def registrar_movimiento(usuario_id, fecha, tipo, categoria, valor, descripcion, forma_pago):
-    supabase.table("movimientos").insert({
+    # Vuelve enseguida: la fila queda en la cola y se ve como pendiente hasta que se guarda
+    cola.encolar([{
         "usuario_id": usuario_id,
         "fecha": fecha.isoformat(),
         "tipo": tipo,
@@ -62,12 +164,83 @@ def registrar_movimiento(usuario_id, fecha, tipo, categoria, valor, descripcion,
         "valor": valor,
         "descripcion": descripcion,
         "forma_pago": forma_pago
-    }).execute()
+    }])
+
+def eliminar_movimientos(usuario_id, ids):
+    # Los ids negativos son movimientos que siguen en la cola
+    cola.cancelar(usuario_id, [i for i in ids if i < 0])
+    ids = [i for i in ids if i > 0]
+    if ids:
+        datos.eliminar_movimientos(almacen, usuario_id, ids)
+        cache_movimientos.eliminar(usuario_id, ids)
+
+def guardar_metas(usuario_id, anio, ahorro_meta, inversion_meta):
+    fila = almacen.guardar_presupuesto({
+        "usuario_id": usuario_id,
+        "anio": anio,
+        "ahorro_meta": ahorro_meta,
+        "inversion_meta": inversion_meta
+    })
+    cache_movimientos.guardar_presupuesto(usuario_id, anio, fila)
+
+def guardar_regla(fila):
+    regla = almacen.guardar_regla_recurrente(fila)
+    if programador is not None:
+        programador.despertar()
+    return regla
+
+def guardar_limites(usuario_id, filas):
+    if filas:
+        almacen.guardar_limites_categoria(filas)
+        cache_movimientos.guardar_limites(usuario_id, None)
+
+def limites_usuario(usuario_id):
+    return presupuesto.limites_df(datos.obtener_limites(almacen, cache_movimientos, usuario_id))
+
+def aviso_limite(usuario_id, fecha, categoria):
+    """Fila de varianza de la categoría en el mes de `fecha` si está cerca o por encima de su límite."""
+    limites = limites_usuario(usuario_id)
+    limites = limites[(limites["anio"] == fecha.year) & (limites["mes"] == fecha.month) & (limites["categoria"] == categoria)]
+    if limites.empty or limites["limite"].iloc[0] <= 0:
+        return None
+    tabla = presupuesto.alertas(presupuesto.varianza(obtener_resumen(usuario_id), limites, fecha.year, fecha.month))
+    tabla = tabla[tabla["categoria"] == categoria]
+    return tabla.iloc[0] if not tabla.empty else None
+
+def modelo_categorias(usuario_id):
+    """Modelo de categorización del usuario; se reentrena solo cuando cambian sus datos."""
+    df = datos.obtener_movimientos(almacen, cache_movimientos, usuario_id)
+    def entrenar():
+        with metricas.medir("categorizacion", filas=len(df)):
+            return categorizacion.ModeloCategorias(df)
+    return cache_movimientos.recordar(usuario_id, "modelo_categorias", entrenar)
+
+def categoria_automatica(usuario_id, tipo, descripcion, forma_pago, valor):
+    """Categoría más probable según el historial del usuario, o la de por defecto si no hay pistas."""
+    sugerida = modelo_categorias(usuario_id).clasificar([tipo], [descripcion], [forma_pago], [valor])["categoria"].iloc[0]
+    return sugerida or importacion.CATEGORIA_POR_DEFECTO[tipo]
+
+def obtener_resumen(usuario_id):
+    """Resumen mensual (año, mes, tipo, categoría, forma de pago) que leen Estadísticas, Metas y Proyección."""
+    if MODO_AGREGACION == "servidor":
+        resumen = cache_movimientos.recordar(usuario_id, "resumen", lambda: datos.resumen_servidor(almacen, usuario_id),
+                                             vigencia=cache_movimientos.intervalo_sync)
+    else:
+        df_movimientos = datos.obtener_movimientos(almacen, cache_movimientos, usuario_id)
+        resumen = cache_movimientos.resumen(usuario_id)
+        if resumen is None:
+            resumen = datos.resumir_movimientos(df_movimientos)
+    return datos.resumen_con_pendientes(resumen, cola.pendientes(usuario_id))
 
 # --- GESTIÓN DE SESIÓN ---
 if "usuario_id" not in st.session_state:
     st.session_state.usuario_id = None
 
+if st.session_state.usuario_id is None and "sesion" in st.query_params:
+    st.session_state.usuario_id = sesiones.validar(st.query_params["sesion"])
+    if st.session_state.usuario_id is None:
+        del st.query_params["sesion"]
+
 # --- PANTALLA DE LOGIN / REGISTRO ---
 if st.session_state.usuario_id is None:
     col_l1, col_l2, col_l3 = st.columns([1,2,1])
@@ -82,7 +255,11 @@ if st.session_state.usuario_id is None:
                 usuario = st.text_input("Usuario")
                 password = st.text_input("Contraseña", type="password")
                 if st.form_submit_button("Crear Cuenta"):
-                    response = registrar_usuario(nombre, usuario, password)
+                    try:
+                        response = registrar_usuario(nombre, usuario, password)
+                    except autenticacion.ServidorOcupado:
+                        st.warning("El servidor está ocupado, inténtalo de nuevo en unos segundos.")
+                        st.stop()
                     if response:
                         st.success("¡Registro exitoso! Por favor inicia sesión.")
                     else:
@@ -93,9 +270,17 @@ if st.session_state.usuario_id is None:
                 usuario = st.text_input("Usuario")
                 password = st.text_input("Contraseña", type="password")
                 if st.form_submit_button("Ingresar"):
-                    user_id = autenticar_usuario(usuario, password)
+                    try:
+                        user_id = autenticar_usuario(usuario, password)
+                    except autenticacion.DemasiadosIntentos as e:
+                        st.error(f"Demasiados intentos fallidos. Espera {max(1, round(e.segundos / 60))} min antes de volver a intentarlo.")
+                        st.stop()
+                    except autenticacion.ServidorOcupado:
+                        st.warning("El servidor está ocupado, inténtalo de nuevo en unos segundos.")
+                        st.stop()
                     if user_id:
                         st.session_state.usuario_id = user_id
+                        st.query_params["sesion"] = sesiones.emitir(user_id)
                         st.success("Bienvenido")
                         st.rerun()
                     else:
@@ -110,16 +295,41 @@ with col_head1:
     st.title("📊 Dashboard Financiero")
 with col_head2:
     if st.button("Cerrar Sesión"):
+        if "sesion" in st.query_params:
+            sesiones.revocar(st.query_params["sesion"])
+            del st.query_params["sesion"]
         st.session_state.usuario_id = None
+        st.session_state.pop("paginas_gestion", None)
         st.rerun()
 
-# Pestañas
-tab1, tab2, tab3, tab4 = st.tabs(["📝 Gestión", "📈 Estadísticas", "🏦 Presupuesto", "🔮 Proyección"])
+# Vistas: a diferencia de st.tabs, solo se ejecuta la vista seleccionada, así que
+# un cambio en Proyección no vuelve a calcular gráficos, tablas ni consultas de las demás.
+# Lo que cada vista calcula queda memorizado en la caché hasta que cambian los datos.
+NOMBRES_VISTAS = ["📝 Gestión", "📈 Estadísticas", "🏦 Presupuesto", "🔮 Proyección"]
+vista_activa = st.radio("Vista", NOMBRES_VISTAS, horizontal=True, label_visibility="collapsed", key="vista")
+st.divider()
+
+def buscar_movimientos(usuario_id, filtros, pagina):
+    """Página de resultados y facetas: índice en memoria en modo local, sql/busqueda.sql en modo servidor."""
+    with metricas.medir("busqueda", modo=MODO_AGREGACION):
+        if MODO_AGREGACION == "servidor":
+            return cache_movimientos.recordar(usuario_id, ("busqueda", filtros, pagina),
+                                              lambda: busqueda.buscar_en_servidor(almacen, usuario_id, filtros, pagina),
+                                              vigencia=cache_movimientos.intervalo_sync)
+        df = datos.obtener_movimientos(almacen, cache_movimientos, usuario_id)
+        # El índice se reconstruye solo cuando cambia la versión de los datos del usuario
+        indice = cache_movimientos.recordar(usuario_id, "indice_busqueda", lambda: busqueda.IndiceMovimientos(df))
+        return indice.buscar(filtros, pagina)
+
+def movimientos_usuario():
+    """Movimientos del usuario desde la caché; solo lo llaman las vistas que los necesitan."""
+    df = datos.obtener_movimientos(almacen, cache_movimientos, st.session_state.usuario_id)
+    return datos.con_pendientes(df, cola.pendientes(st.session_state.usuario_id))
 
 # --------------------------------------------------------------------------------
 # TAB 1: GESTIÓN (REGISTRAR Y ELIMINAR) - ARREGLADO
 # --------------------------------------------------------------------------------
-with tab1:
+def vista_gestion():
     col_reg1, col_reg2 = st.columns([1, 2])
     
     # --- PARTE 1: EL FORMULARIO DE REGISTRO ---
@@ -127,39 +337,78 @@ with tab1:
         st.subheader("➕ Nuevo")
         
         # --- SOLUCIÓN DEL WIZ ---
-        # Sacamos Tipo y Categoría FUERA del st.form.
+        # Sacamos Tipo FUERA del st.form.
         # Esto permite que la página se actualice instantáneamente al cambiar el Tipo.
         
         tipo_seleccionado = st.radio("Tipo", ["ingreso", "gasto"], horizontal=True, key="tipo_input")
         
         # Obtenemos la lista correcta inmediatamente
         lista_categorias = TIPO_CATEGORIAS.get(tipo_seleccionado, ["General"])
-        
-        categoria_seleccionada = st.selectbox("Categoría", lista_categorias, key="cat_input")
 
-        # --- INICIO DEL FORMULARIO (Solo para los datos numéricos y botón) ---
+        # --- INICIO DEL FORMULARIO ---
+        # La categoría va dentro: elegirla ya no vuelve a ejecutar la página, y con
+        # "Automática" la decide el modelo a partir de la descripción, el pago y el valor.
         with st.form("frm_movimiento", clear_on_submit=True):
+            categoria_elegida = st.selectbox("Categoría", [CATEGORIA_AUTOMATICA] + lista_categorias, key="cat_input")
             fecha = st.date_input("Fecha", value=datetime.date.today())
             
             valor = st.number_input("Valor ($)", min_value=0.01, step=10.0)
             descripcion = st.text_input("Descripción")
-            forma_pago = st.selectbox("Pago", ["Efectivo", "Tarjeta Crédito", "Tarjeta Débito", "Transferencia"])
+            forma_pago = st.selectbox("Pago", FORMAS_PAGO)
             
             if st.form_submit_button("💾 Guardar Movimiento"):
-                # Usamos las variables de afuera (tipo y categoria) junto con las de adentro
+                if categoria_elegida == CATEGORIA_AUTOMATICA:
+                    categoria_seleccionada = categoria_automatica(st.session_state.usuario_id, tipo_seleccionado, descripcion, forma_pago, valor)
+                    mensaje = f"Movimiento guardado en {categoria_seleccionada} (categoría automática)."
+                else:
+                    categoria_seleccionada = categoria_elegida
+                    mensaje = "Movimiento guardado exitosamente!"
                 registrar_movimiento(st.session_state.usuario_id, fecha, tipo_seleccionado, categoria_seleccionada, valor, descripcion, forma_pago)
-                st.toast("Movimiento guardado exitosamente!", icon="✅")
+                st.toast(mensaje, icon="✅")
+                if tipo_seleccionado == "gasto":
+                    aviso = aviso_limite(st.session_state.usuario_id, fecha, categoria_seleccionada)
+                    if aviso is not None:
+                        texto = "superó" if aviso["estado"] == "excedido" else "está cerca de"
+                        st.toast(f"{categoria_seleccionada} {texto} su límite del mes: ${aviso['real']:,.2f} de ${aviso['limite']:,.2f}", icon="🚨")
                 st.rerun() 
 
     # --- PARTE 2: TABLA DE GESTIÓN (ELIMINAR) ---
     with col_reg2:
         st.subheader("📝 Últimos Movimientos (Gestión)")
+
+        # Paginación por clave: solo se pide y se dibuja la página visible.
+        # La pila guarda el cursor de inicio de cada página visitada.
+        if "paginas_gestion" not in st.session_state:
+            st.session_state.paginas_gestion = [None]
+        tamano_pagina = st.session_state.get("tamano_pagina", TAMANOS_PAGINA[0])
+        cursor_pagina = st.session_state.paginas_gestion[-1]
+
+        # La página se lee del servidor: caduca como la copia local para que se vean
+        # también los movimientos de otros procesos (cola de otro worker, cron...)
+        df_gest, hay_mas = cache_movimientos.recordar(
+            st.session_state.usuario_id, ("pagina", cursor_pagina, tamano_pagina),
+            lambda: datos.pagina_movimientos(almacen, st.session_state.usuario_id, tamano_pagina, cursor_pagina),
+            vigencia=cache_movimientos.intervalo_sync
+        )
         
-        resp = supabase.table("movimientos").select("*").eq("usuario_id", st.session_state.usuario_id).order("fecha", desc=True).execute()
-        df_gest = pd.DataFrame(resp.data)
-        
+        # Los movimientos aún en la cola se muestran en la primera página; el
+        # cursor de la siguiente se toma antes, solo de las filas del servidor
+        cursor_sig = datos.cursor_siguiente(df_gest) if not df_gest.empty else None
+        pendientes = cola.pendientes(st.session_state.usuario_id)
+        if pendientes:
+            st.caption(f"⏳ {len(pendientes)} movimiento(s) pendiente(s) de guardar; se envían en segundo plano.")
+            if cursor_pagina is None:
+                df_gest = datos.con_pendientes(df_gest, pendientes)
+        errores_cola = cola.errores(st.session_state.usuario_id)
+        if errores_cola:
+            st.warning(f"{errores_cola} movimiento(s) no se pudieron guardar tras varios intentos.")
+            if st.button("🔁 Reintentar envío"):
+                cola.reintentar(st.session_state.usuario_id)
+                st.rerun()
+
         if not df_gest.empty:
-            df_gest["fecha"] = pd.to_datetime(df_gest["fecha"]).dt.date
+            df_pagina = df_gest
+            df_gest = df_gest.assign(fecha=df_gest["fecha"].dt.date)
 
             st.dataframe(
                 df_gest[["fecha", "tipo", "categoria", "valor", "descripcion"]], 
@@ -167,63 +416,271 @@ with tab1:
                 height=350,
                 hide_index=True
             )
+
+            col_pag1, col_pag2, col_pag3 = st.columns([1, 1, 2])
+            with col_pag1:
+                if st.button("◀ Anterior", disabled=len(st.session_state.paginas_gestion) == 1, use_container_width=True):
+                    st.session_state.paginas_gestion.pop()
+                    st.rerun()
+            with col_pag2:
+                if st.button("Siguiente ▶", disabled=not hay_mas, use_container_width=True):
+                    st.session_state.paginas_gestion.append(cursor_sig)
+                    st.rerun()
+            with col_pag3:
+                st.selectbox("Filas por página", TAMANOS_PAGINA, key="tamano_pagina", label_visibility="collapsed",
+                             on_change=lambda: st.session_state.update(paginas_gestion=[None]))
+            st.caption(f"Página {len(st.session_state.paginas_gestion)}")
             
-            st.markdown("##### 🗑️ Eliminar un registro")
+            st.markdown("##### 🔎 Buscar")
+            col_bus1, col_bus2, col_bus3, col_bus4 = st.columns([2, 1, 1, 1])
+            texto_busqueda = col_bus1.text_input("Descripción", key="busq_texto", placeholder="Palabras o comienzos de palabra")
+            tipo_busqueda = col_bus2.selectbox("Tipo", ["Todos", "ingreso", "gasto"], key="busq_tipo")
+            desde_busqueda = col_bus3.date_input("Desde", value=None, key="busq_desde")
+            hasta_busqueda = col_bus4.date_input("Hasta", value=None, key="busq_hasta")
+            col_bus5, col_bus6, col_bus7, col_bus8 = st.columns([2, 2, 1, 1])
+            categorias_busqueda = col_bus5.multiselect("Categorías", TIPO_CATEGORIAS["ingreso"] + TIPO_CATEGORIAS["gasto"], key="busq_categorias")
+            formas_busqueda = col_bus6.multiselect("Formas de pago", FORMAS_PAGO, key="busq_formas")
+            valor_min_busqueda = col_bus7.number_input("Valor mínimo", min_value=0.0, value=None, step=10.0, key="busq_min")
+            valor_max_busqueda = col_bus8.number_input("Valor máximo", min_value=0.0, value=None, step=10.0, key="busq_max")
+            filtros = busqueda.Filtros(
+                texto_busqueda.strip(), tuple(categorias_busqueda), tuple(formas_busqueda),
+                None if tipo_busqueda == "Todos" else tipo_busqueda,
+                valor_min_busqueda, valor_max_busqueda, desde_busqueda, hasta_busqueda,
+            )
+
+            # Sin filtros se ofrecen para eliminar los movimientos de la página
+            # visible; con filtros, la página de resultados de la búsqueda.
+            df_opciones = df_pagina
+            if busqueda.hay_filtros(filtros):
+                if st.session_state.get("filtros_busqueda") != filtros:
+                    st.session_state.filtros_busqueda = filtros
+                    st.session_state.pagina_busqueda = 0
+                pagina_busqueda = st.session_state.pagina_busqueda
+                resultado = buscar_movimientos(st.session_state.usuario_id, filtros, pagina_busqueda)
+                total_paginas = max(1, -(-resultado["total"] // busqueda.TAMANO_PAGINA))
+
+                nombres_faceta = {"categoria": "Categoría", "forma_pago": "Pago", "tipo": "Tipo"}
+                st.caption(f"**{resultado['total']:,}** resultado(s) · " + " · ".join(
+                    f"**{nombres_faceta[faceta]}:** " + ", ".join(f"{valor} ({cantidad:,})" for valor, cantidad in list(conteos.items())[:6])
+                    for faceta, conteos in resultado["facetas"].items() if conteos
+                ))
+                df_opciones = resultado["filas"]
+                if not df_opciones.empty:
+                    st.dataframe(
+                        df_opciones.assign(fecha=df_opciones["fecha"].dt.date)[["fecha", "tipo", "categoria", "valor", "descripcion", "forma_pago"]],
+                        use_container_width=True, hide_index=True,
+                    )
+                    col_pb1, col_pb2, col_pb3 = st.columns([1, 1, 2])
+                    if col_pb1.button("◀", key="busq_anterior", disabled=pagina_busqueda == 0, use_container_width=True):
+                        st.session_state.pagina_busqueda -= 1
+                        st.rerun()
+                    if col_pb2.button("▶", key="busq_siguiente", disabled=pagina_busqueda + 1 >= total_paginas, use_container_width=True):
+                        st.session_state.pagina_busqueda += 1
+                        st.rerun()
+                    col_pb3.caption(f"Página {pagina_busqueda + 1} de {total_paginas}")
+
+            st.markdown("##### 🗑️ Eliminar registros")
+
             col_del1, col_del2 = st.columns([3, 1])
             
             with col_del1:
-                opciones_borrar = {f"{row['fecha']} - {row['categoria']}: {row['descripcion']} (${row['valor']})": row['id'] for index, row in df_gest.iterrows()}
-                seleccion_borrar = st.selectbox("Selecciona para eliminar", list(opciones_borrar.keys()), label_visibility="collapsed")
+                opciones_borrar = dict(zip(datos.etiquetas_movimientos(df_opciones), df_opciones["id"]))
+                seleccion_borrar = st.multiselect("Selecciona para eliminar", list(opciones_borrar.keys()), label_visibility="collapsed",
+                                                  placeholder="Selecciona uno o varios registros")
             
             with col_del2:
-                if st.button("Eliminar ❌", type="primary"):
-                    if seleccion_borrar:
-                        id_a_borrar = opciones_borrar[seleccion_borrar]
-                        try:
-                            supabase.table("movimientos").delete().eq("id", id_a_borrar).execute()
-                            st.toast("Registro eliminado.", icon="🗑️")
-                            st.rerun()
-                        except Exception as e:
-                            st.error(f"Error: {e}")
+                if st.button("Eliminar ❌", type="primary", disabled=not seleccion_borrar):
+                    ids_a_borrar = [int(opciones_borrar[etiqueta]) for etiqueta in seleccion_borrar]
+                    try:
+                        eliminar_movimientos(st.session_state.usuario_id, ids_a_borrar)
+                        st.toast(f"{len(ids_a_borrar)} registro(s) eliminado(s).", icon="🗑️")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Error: {e}")
+        elif len(st.session_state.paginas_gestion) > 1:
+            # La página quedó vacía (p. ej. tras borrar su último registro)
+            st.session_state.paginas_gestion.pop()
+            st.rerun()
         else:
             st.info("No hay movimientos recientes.")
 
+    # --- PARTE 3: IMPORTACIÓN MASIVA DE EXTRACTOS ---
+    with st.expander("📥 Importar extracto bancario (CSV / OFX)"):
+        st.caption("El CSV debe tener al menos fecha, descripción y valor. Si no trae tipo, los valores negativos se registran como gastos. "
+                   "Si no trae categoría, se asigna según tus movimientos anteriores.")
+        col_imp1, col_imp2 = st.columns([2, 1])
+        archivo_imp = col_imp1.file_uploader("Archivo", type=["csv", "ofx", "qfx"], label_visibility="collapsed")
+        forma_pago_imp = col_imp2.selectbox("Forma de pago por defecto", FORMAS_PAGO, index=FORMAS_PAGO.index("Transferencia"))
+
+        simulacion = None
+        if archivo_imp is not None:
+            contenido_imp = archivo_imp.getvalue()
+            modelo_imp = modelo_categorias(st.session_state.usuario_id)
+
+            def simular_importacion():
+                # Simulación: nada se escribe, solo se cuenta y se muestra una vista previa
+                return importacion.importar(
+                    almacen, st.session_state.usuario_id,
+                    importacion.leer_archivo(io.BytesIO(contenido_imp), archivo_imp.name),
+                    importacion.claves_existentes(movimientos_usuario()), forma_pago_imp, simular=True, modelo=modelo_imp
+                )
+
+            # Memorizada por archivo subido y versión de datos: los reruns de la
+            # vista no vuelven a leer el extracto
+            pendientes_imp = tuple(fila["id"] for fila in cola.pendientes(st.session_state.usuario_id))
+            try:
+                simulacion = cache_movimientos.recordar(
+                    st.session_state.usuario_id, ("importacion", archivo_imp.file_id, forma_pago_imp, pendientes_imp),
+                    simular_importacion
+                )
+            except Exception as e:
+                st.error(f"No se pudo leer el archivo: {e}")
+
+        if simulacion is not None:
+            col_s1, col_s2, col_s3, col_s4, col_s5 = st.columns(5)
+            col_s1.metric("Filas leídas", simulacion["leidas"])
+            col_s2.metric("Nuevas", simulacion["insertadas"])
+            col_s3.metric("Duplicadas", simulacion["duplicadas"])
+            col_s4.metric("Inválidas", simulacion["invalidas"])
+            col_s5.metric("Categorizadas", simulacion["categorizadas"], help="Filas sin categoría válida a las que el modelo asignó una")
+            if simulacion["vista_previa"] is not None:
+                st.dataframe(simulacion["vista_previa"].assign(fecha=simulacion["vista_previa"]["fecha"].dt.date), use_container_width=True, hide_index=True)
+
+            if simulacion["insertadas"] and st.button(f"📥 Importar {simulacion['insertadas']} movimientos", type="primary"):
+                buffer_imp = io.BytesIO(contenido_imp)
+                barra = st.progress(0.0, text="Importando...")
+                def avance(leidas, insertadas):
+                    barra.progress(min(buffer_imp.tell() / max(len(contenido_imp), 1), 1.0), text=f"{leidas} filas leídas, {insertadas} insertadas")
+                try:
+                    resultado = importacion.importar(
+                        almacen, st.session_state.usuario_id,
+                        importacion.leer_archivo(buffer_imp, archivo_imp.name),
+                        importacion.claves_existentes(movimientos_usuario()), forma_pago_imp, progreso=avance, modelo=modelo_imp
+                    )
+                except Exception as e:
+                    # Parte del archivo pudo guardarse: se recarga la copia local para
+                    # que un nuevo intento vea esas filas como duplicadas
+                    cache_movimientos.invalidar(st.session_state.usuario_id)
+                    st.error(f"La importación se interrumpió: {e}. Vuelve a intentarlo; las filas ya guardadas no se duplicarán.")
+                else:
+                    cache_movimientos.agregar(st.session_state.usuario_id, resultado["filas"])
+                    st.toast(f"{resultado['insertadas']} movimientos importados.", icon="✅")
+                    st.rerun()
+
+    # --- PARTE 4: MOVIMIENTOS RECURRENTES ---
+    with st.expander("🔁 Movimientos recurrentes"):
+        if not recurrentes_disponibles():
+            st.info("Para usar movimientos recurrentes, instala sql/recurrentes.sql y sql/idempotencia.sql en Supabase.")
+        else:
+            st.caption("Sueldo, suscripciones, cuotas... se registran solos en cada fecha. "
+                       "Si el inicio es una fecha pasada, también se registran las ocurrencias ya vencidas.")
+            reglas = almacen.reglas_recurrentes(st.session_state.usuario_id)
+            if reglas:
+                st.dataframe(
+                    [{
+                        "descripcion": r["descripcion"] or r["categoria"],
+                        "categoria": r["categoria"],
+                        "valor": r["valor"] if r["tipo"] == "ingreso" else -r["valor"],
+                        "frecuencia": f"Cada {r['intervalo']} {recurrentes.UNIDADES[r['frecuencia']]}",
+                        "proxima": recurrentes.proxima_fecha(r) if r["activa"] else None,
+                        "activa": r["activa"],
+                    } for r in reglas],
+                    column_config={"valor": st.column_config.NumberColumn("Valor", format="$%.2f"),
+                                   "proxima": st.column_config.DateColumn("Próxima")},
+                    use_container_width=True, hide_index=True,
+                )
+                opciones_regla = {f"{r['descripcion'] or r['categoria']} · ${r['valor']:,.2f} (#{r['id']})": r for r in reglas}
+                col_rg1, col_rg2, col_rg3 = st.columns([2, 1, 1])
+                regla_sel = opciones_regla[col_rg1.selectbox("Regla", list(opciones_regla), label_visibility="collapsed")]
+                if col_rg2.button("⏸️ Pausar" if regla_sel["activa"] else "▶️ Reactivar", use_container_width=True):
+                    cambios = {"id": regla_sel["id"], "usuario_id": regla_sel["usuario_id"], "activa": not regla_sel["activa"]}
+                    if not regla_sel["activa"]:
+                        # Al reactivar no se rellenan las ocurrencias del tiempo en pausa
+                        ayer = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
+                        cambios["ultima_fecha"] = max(regla_sel["ultima_fecha"] or "", ayer)
+                    guardar_regla(cambios)
+                    st.rerun()
+                if col_rg3.button("🗑️ Eliminar", use_container_width=True):
+                    almacen.eliminar_regla_recurrente(st.session_state.usuario_id, regla_sel["id"])
+                    st.rerun()
+
+            st.markdown("##### ➕ Nueva regla")
+            col_nr1, col_nr2 = st.columns(2)
+            tipo_regla = col_nr1.radio("Tipo", ["ingreso", "gasto"], horizontal=True, key="tipo_recurrente")
+            categoria_regla = col_nr2.selectbox("Categoría", TIPO_CATEGORIAS[tipo_regla], key="cat_recurrente")
+            with st.form("frm_recurrente", clear_on_submit=True):
+                col_f1, col_f2, col_f3 = st.columns(3)
+                valor_regla = col_f1.number_input("Valor ($)", min_value=0.01, step=10.0)
+                descripcion_regla = col_f2.text_input("Descripción")
+                forma_pago_regla = col_f3.selectbox("Pago", FORMAS_PAGO)
+                col_f4, col_f5, col_f6, col_f7 = st.columns(4)
+                frecuencia_regla = col_f4.selectbox("Frecuencia", recurrentes.FRECUENCIAS, index=recurrentes.FRECUENCIAS.index("mensual"))
+                intervalo_regla = col_f5.number_input("Cada", min_value=1, max_value=36, value=1, step=1,
+                                                      help="Cada cuántos días, semanas, meses o años según la frecuencia.")
+                inicio_regla = col_f6.date_input("Desde", value=datetime.date.today())
+                fin_regla = col_f7.date_input("Hasta (opcional)", value=None)
+                if st.form_submit_button("💾 Guardar regla"):
+                    if fin_regla is not None and fin_regla < inicio_regla:
+                        st.error("La fecha final es anterior a la inicial.")
+                    else:
+                        guardar_regla({
+                            "usuario_id": st.session_state.usuario_id,
+                            "tipo": tipo_regla,
+                            "categoria": categoria_regla,
+                            "valor": valor_regla,
+                            "descripcion": descripcion_regla,
+                            "forma_pago": forma_pago_regla,
+                            "frecuencia": frecuencia_regla,
+                            "intervalo": int(intervalo_regla),
+                            "inicio": inicio_regla.isoformat(),
+                            "fin": fin_regla.isoformat() if fin_regla else None,
+                        })
+                        st.toast("Regla guardada.", icon="🔁")
+                        st.rerun()
+
+    # --- PARTE 5: EXPORTACIÓN DEL HISTORIAL ---
+    with st.expander("📤 Exportar historial completo"):
+        col_exp1, col_exp2 = st.columns([2, 1])
+        formato_exp = col_exp1.selectbox("Formato", exportacion.FORMATOS, label_visibility="collapsed")
+        if col_exp2.button("Preparar archivo", use_container_width=True):
+            with st.spinner("Generando exportación..."):
+                archivo_exp, nombre_exp, mime_exp = exportacion.exportar(almacen, st.session_state.usuario_id, formato_exp)
+            # download_button necesita los bytes finales; la lectura de la base de datos ya fue por lotes
+            st.download_button("⬇️ Descargar", archivo_exp.read(), file_name=nombre_exp, mime=mime_exp, type="primary")
+            archivo_exp.close()
+
 # --------------------------------------------------------------------------------
 # TAB 2: ESTADÍSTICAS (FILTROS, GRAFICOS Y RANKING)
 # --------------------------------------------------------------------------------
-with tab2:
-    response = supabase.table("movimientos").select("*").eq("usuario_id", st.session_state.usuario_id).execute()
-    df = pd.DataFrame(response.data)
-
-    if not df.empty:
-        df["fecha"] = pd.to_datetime(df["fecha"])
-        df["año"] = df["fecha"].dt.year
-        df["mes_num"] = df["fecha"].dt.month
-        
-        meses_es = {1:"Enero", 2:"Febrero", 3:"Marzo", 4:"Abril", 5:"Mayo", 6:"Junio", 7:"Julio", 8:"Agosto", 9:"Septiembre", 10:"Octubre", 11:"Noviembre", 12:"Diciembre"}
-        df["mes"] = df["mes_num"].map(meses_es)
+def vista_estadisticas():
+    meses_es = {1:"Enero", 2:"Febrero", 3:"Marzo", 4:"Abril", 5:"Mayo", 6:"Junio", 7:"Julio", 8:"Agosto", 9:"Septiembre", 10:"Octubre", 11:"Noviembre", 12:"Diciembre"}
+    mes_por_nombre = {v: k for k, v in meses_es.items()}
+
+    resumen = obtener_resumen(st.session_state.usuario_id)
+    años_mov = sorted(resumen["anio"].unique().tolist(), reverse=True)
 
+    if años_mov:
         with st.container():
             col_tools1, col_tools2 = st.columns(2)
-            years_opt = ["Todos"] + sorted(df["año"].unique().tolist(), reverse=True)
+            years_opt = ["Todos"] + años_mov
             sel_year = col_tools1.selectbox("📅 Filtrar Año", years_opt)
             months_opt = ["Todos"] + list(meses_es.values())
             sel_month = col_tools2.selectbox("📅 Filtrar Mes", months_opt)
 
-            df_filtered = df.copy()
-            if sel_year != "Todos":
-                df_filtered = df_filtered[df_filtered["año"] == sel_year]
-            if sel_month != "Todos":
-                month_idx = [k for k, v in meses_es.items() if v == sel_month][0]
-                df_filtered = df_filtered[df_filtered["mes_num"] == month_idx]
+            anio_filtro = None if sel_year == "Todos" else sel_year
+            mes_filtro = mes_por_nombre.get(sel_month)
+
+            # Totales por mes y categoría desde el resumen mensual del periodo
+            df_res = datos.filtrar_resumen(resumen, anio_filtro, mes_filtro)
+            df_res = df_res.assign(periodo=datos.periodos_resumen(df_res))
             
         st.divider()
 
-        if df_filtered.empty:
+        if df_res.empty:
             st.warning("No hay datos para el periodo seleccionado.")
         else:
-            total_ing = df_filtered[df_filtered["tipo"] == "ingreso"]["valor"].sum()
-            total_gas = df_filtered[df_filtered["tipo"] == "gasto"]["valor"].sum()
+            total_ing = df_res[df_res["tipo"] == "ingreso"]["total"].sum()
+            total_gas = df_res[df_res["tipo"] == "gasto"]["total"].sum()
             balance = total_ing - total_gas
 
             kpi1, kpi2, kpi3, kpi4 = st.columns(4)
@@ -234,29 +691,33 @@ with tab2:
             tasa_ahorro = (balance / total_ing * 100) if total_ing > 0 else 0
             kpi4.metric("Tasa de Ahorro", f"{tasa_ahorro:.1f}%", help="% de ingresos retenidos.")
 
+            # Figuras memorizadas por (usuario, versión de datos, pendientes del
+            # usuario en la cola, filtro): solo se reconstruyen tras una escritura
+            # suya o al cambiar de año/mes, no cuando otro usuario encola algo.
+            def agregados_semanales():
+                if MODO_AGREGACION == "servidor":
+                    return datos.agregados_servidor(almacen, st.session_state.usuario_id, anio_filtro, mes_filtro)
+                return datos.agregar_movimientos(datos.filtrar_periodo(movimientos_usuario(), anio_filtro, mes_filtro))
+
+            figuras = cache_movimientos.recordar(
+                st.session_state.usuario_id, ("figuras", MODO_AGREGACION, anio_filtro, mes_filtro,
+                                              tuple(fila["id"] for fila in cola.pendientes(st.session_state.usuario_id))),
+                metricas.medido("figuras")(lambda: graficos.figuras_estadisticas(df_res, agregados_semanales))
+            )
+
             g_col1, g_col2 = st.columns([1, 1])
 
             with g_col1:
                 st.markdown("#### 🍩 Gastos por Categoría")
-                df_gas = df_filtered[df_filtered["tipo"] == "gasto"]
-                if not df_gas.empty:
-                    fig_pie = px.pie(df_gas, values="valor", names="categoria", hole=0.4)
-                    fig_pie.update_layout(showlegend=False, margin=dict(t=30, b=0, l=0, r=0))
-                    st.plotly_chart(fig_pie, use_container_width=True)
+                if figuras["pie"] is not None:
+                    st.plotly_chart(figuras["pie"], use_container_width=True)
                 else:
                     st.info("Sin gastos.")
 
             with g_col2:
                 st.markdown("#### 🏦 Gastos en Bancos (Mensual)")
-                df_bancos = df_filtered[(df_filtered["tipo"] == "gasto") & (df_filtered["categoria"].isin(["Bancos", "bancos"]))]
-                if not df_bancos.empty:
-                    df_bancos["periodo"] = df_bancos["fecha"].dt.strftime('%Y-%m')
-                    df_bancos_agg = df_bancos.groupby("periodo")["valor"].sum().reset_index()
-                    fig_banco = px.bar(df_bancos_agg, x="periodo", y="valor", 
-                                     title="Salidas categoría Bancos",
-                                     color_discrete_sequence=["#3498DB"])
-                    fig_banco.update_layout(margin=dict(t=30, b=0, l=0, r=0))
-                    st.plotly_chart(fig_banco, use_container_width=True)
+                if figuras["bancos"] is not None:
+                    st.plotly_chart(figuras["bancos"], use_container_width=True)
                 else:
                     st.info("No hay gastos registrados en 'Bancos'.")
 
@@ -266,24 +727,16 @@ with tab2:
 
             with g_col3:
                 st.markdown("#### 📆 Tendencia Semanal")
-                df_gastos_all = df_filtered[df_filtered["tipo"] == "gasto"].copy()
-                if not df_gastos_all.empty:
-                    df_gastos_all["inicio_semana"] = df_gastos_all["fecha"].dt.to_period('W').dt.start_time
-                    df_semanal = df_gastos_all.groupby("inicio_semana")["valor"].sum().reset_index()
-                    fig_line = px.line(df_semanal, x="inicio_semana", y="valor", markers=True)
-                    fig_line.update_traces(line_color='#E74C3C', line_width=3)
-                    fig_line.update_layout(xaxis_title="Semana", yaxis_title="Total Gastado", margin=dict(t=10, b=0, l=0, r=0))
-                    st.plotly_chart(fig_line, use_container_width=True)
+                if figuras["semanal"] is not None:
+                    st.plotly_chart(figuras["semanal"], use_container_width=True)
                 else:
                     st.info("No hay datos.")
 
             with g_col4:
                 st.markdown("#### 🏆 Top Gastos")
-                if not df_gastos_all.empty:
-                    df_ranking = df_gastos_all.groupby("categoria")["valor"].sum().reset_index().sort_values("valor", ascending=False)
-                    df_ranking["Total"] = df_ranking["valor"].apply(lambda x: f"${x:,.2f}")
+                if figuras["ranking"] is not None:
                     st.dataframe(
-                        df_ranking[["categoria", "Total"]], 
+                        figuras["ranking"], 
                         column_config={"categoria": "Categoría", "Total": "Monto Acumulado"},
                         use_container_width=True, hide_index=True
                     )
@@ -296,44 +749,32 @@ with tab2:
 
             with g_col5:
                 st.markdown("#### Ingresos (Mensual)")
-                df_bancos = df_filtered[(df_filtered["tipo"] == "ingreso")]
-                if not df_bancos.empty:
-                    df_bancos["periodo"] = df_bancos["fecha"].dt.strftime('%Y-%m')
-                    df_bancos_agg = df_bancos.groupby("periodo")["valor"].sum().reset_index()
-                    fig_banco = px.bar(df_bancos_agg, x="periodo", y="valor", 
-                                     title="Salidas categoría Ingresos",
-                                     color_discrete_sequence=["#3498DB"])
-                    fig_banco.update_layout(margin=dict(t=30, b=0, l=0, r=0))
-                    st.plotly_chart(fig_banco, use_container_width=True)
+                if figuras["ingresos"] is not None:
+                    st.plotly_chart(figuras["ingresos"], use_container_width=True)
                 else:
                     st.info("No hay ingresos registrados.")
 
-            
-
     else:
         st.info("Aún no tienes movimientos registrados.")
 
 # --------------------------------------------------------------------------------
 # TAB 3: PRESUPUESTO
 # --------------------------------------------------------------------------------
-with tab3:
+def vista_presupuesto():
     st.subheader("🏦 Control de Metas")
     
-    resp = supabase.table("movimientos").select("fecha, tipo, categoria, valor").eq("usuario_id", st.session_state.usuario_id).execute()
-    df_mov = pd.DataFrame(resp.data)
+    resumen = obtener_resumen(st.session_state.usuario_id)
     
-    if df_mov.empty:
+    if resumen.empty:
         st.info("Registra movimientos para configurar presupuestos.")
     else:
-        df_mov["fecha"] = pd.to_datetime(df_mov["fecha"])
-        años_db = sorted(df_mov["fecha"].dt.year.unique().tolist(), reverse=True)
+        años_db = sorted(resumen["anio"].unique().tolist(), reverse=True)
         
         col_p1, col_p2 = st.columns(2)
         with col_p1:
             anio_sel = st.selectbox("Configurar Año", años_db)
         
-        meta_resp = supabase.table("presupuestos").select("*").eq("usuario_id", st.session_state.usuario_id).eq("anio", anio_sel).execute()
-        meta_data = meta_resp.data[0] if meta_resp.data else {}
+        meta_data = datos.obtener_presupuesto(almacen, cache_movimientos, st.session_state.usuario_id, anio_sel)
         
         val_ahorro = meta_data.get("ahorro_meta", 0.0)
         val_inversion = meta_data.get("inversion_meta", 0.0)
@@ -343,18 +784,13 @@ with tab3:
                 n_ahorro = st.number_input("Meta Ahorro Anual", value=float(val_ahorro), step=100.0)
                 n_inversion = st.number_input("Meta Inversión Anual", value=float(val_inversion), step=100.0)
                 if st.form_submit_button("Actualizar Metas"):
-                    supabase.table("presupuestos").upsert({
-                        "usuario_id": st.session_state.usuario_id,
-                        "anio": anio_sel,
-                        "ahorro_meta": n_ahorro,
-                        "inversion_meta": n_inversion
-                    }).execute()
+                    guardar_metas(st.session_state.usuario_id, anio_sel, n_ahorro, n_inversion)
                     st.success("Metas actualizadas.")
                     st.rerun()
 
-        df_anio = df_mov[df_mov["fecha"].dt.year == anio_sel]
-        real_ahorro = df_anio[(df_anio["categoria"] == "Ahorro")]["valor"].sum()
-        real_inversion = df_anio[(df_anio["categoria"] == "Inversion")]["valor"].sum()
+        res_anio = datos.filtrar_resumen(resumen, anio_sel)
+        real_ahorro = res_anio[(res_anio["categoria"] == "Ahorro")]["total"].sum()
+        real_inversion = res_anio[(res_anio["categoria"] == "Inversion")]["total"].sum()
         
         def calc_pct(real, meta):
             return min(real/meta, 1.0) if meta > 0 else 0
@@ -367,19 +803,78 @@ with tab3:
             st.metric("Inversión Real vs Meta", f"${real_inversion:,.2f}", f"Meta: ${n_inversion:,.2f}")
             st.progress(calc_pct(real_inversion, n_inversion))
 
+        # --- LÍMITES MENSUALES POR CATEGORÍA ---
+        st.divider()
+        st.subheader("📊 Límites mensuales por categoría")
+        limites = limites_usuario(st.session_state.usuario_id)
+        # Una sola pasada vectorizada para todo el año sobre el resumen mensual
+        tabla_anio = presupuesto.varianza(resumen, limites, anio_sel)
+
+        hoy = datetime.date.today()
+        nombre_mes = st.selectbox("Mes", presupuesto.MESES, index=(hoy.month if anio_sel == hoy.year else 12) - 1, key="mes_limites")
+        mes_sel = presupuesto.MESES.index(nombre_mes) + 1
+        tabla_mes = tabla_anio[tabla_anio["mes"] == mes_sel]
+        for aviso in presupuesto.alertas(tabla_mes).itertuples():
+            texto = f"{aviso.categoria}: ${aviso.real:,.2f} de ${aviso.limite:,.2f} ({aviso.uso:.0%})"
+            if aviso.estado == "excedido":
+                st.error(f"🚨 Límite superado en {texto}")
+            else:
+                st.warning(f"⚠️ Cerca del límite en {texto}")
+
+        if tabla_mes.empty:
+            st.info("Sin gastos ni límites en este mes.")
+        else:
+            st.dataframe(
+                tabla_mes.assign(uso=tabla_mes["uso"] * 100)[["categoria", "real", "limite", "diferencia", "uso", "estado"]],
+                column_config={
+                    "real": st.column_config.NumberColumn("Gastado", format="$%.2f"),
+                    "limite": st.column_config.NumberColumn("Límite", format="$%.2f"),
+                    "diferencia": st.column_config.NumberColumn("Disponible", format="$%.2f"),
+                    "uso": st.column_config.ProgressColumn("Uso", format="%.0f%%", min_value=0, max_value=100),
+                },
+                use_container_width=True, hide_index=True,
+            )
+
+        if not limites[limites["anio"] == anio_sel].empty:
+            with st.expander(f"Uso del límite por mes en {anio_sel}"):
+                def color_uso(uso):
+                    if uso != uso:  # NaN: sin límite
+                        return ""
+                    return "background-color: #E74C3C55" if uso > 1 else "background-color: #F39C1255" if uso >= presupuesto.UMBRAL_AVISO else ""
+                st.dataframe(presupuesto.matriz_uso(tabla_anio, anio_sel).style.format("{:.0%}", na_rep="—").map(color_uso),
+                             use_container_width=True)
+
+        if not almacen.disponible("limites_categoria"):
+            st.info("Para definir límites por categoría, instala sql/limites_categoria.sql en Supabase.")
+            return
+        with st.expander(f"✏️ Editar límites de {anio_sel}"):
+            matriz = presupuesto.matriz_limites(limites, anio_sel)
+            with st.form("frm_limites"):
+                st.caption("Límite de gasto por categoría y mes; 0 significa sin límite.")
+                editada = st.data_editor(matriz, use_container_width=True, key=f"editor_limites_{anio_sel}")
+                if st.form_submit_button("Guardar límites"):
+                    guardar_limites(st.session_state.usuario_id,
+                                    presupuesto.filas_desde_matriz(editada, st.session_state.usuario_id, anio_sel, original=matriz))
+                    st.success("Límites actualizados.")
+                    st.rerun()
+            anteriores = limites[limites["anio"] == anio_sel - 1]
+            if st.button(f"Copiar límites de {anio_sel - 1}", disabled=anteriores.empty):
+                guardar_limites(st.session_state.usuario_id, presupuesto.filas_desde_matriz(
+                    presupuesto.matriz_limites(limites, anio_sel - 1), st.session_state.usuario_id, anio_sel, original=matriz))
+                st.rerun()
+
 # --------------------------------------------------------------------------------
 # TAB 4: PROYECCIÓN (FUTURO)
 # --------------------------------------------------------------------------------
-with tab4:
+def vista_proyeccion():
     st.header("🔮 Proyección de Libertad Financiera")
     st.markdown("Simula el crecimiento de tu patrimonio con interés compuesto.")
 
-    resp_all = supabase.table("movimientos").select("categoria, valor").eq("usuario_id", st.session_state.usuario_id).execute()
-    df_all = pd.DataFrame(resp_all.data)
+    resumen = obtener_resumen(st.session_state.usuario_id)
     
     capital_actual = 0.0
-    if not df_all.empty:
-        capital_actual = df_all[df_all["categoria"].isin(["Ahorro", "Inversion"])]["valor"].sum()
+    if not resumen.empty:
+        capital_actual = resumen[resumen["categoria"].isin(["Ahorro", "Inversion"])]["total"].sum()
     
     col_proj_izq, col_proj_der = st.columns([1, 2])
 
@@ -388,48 +883,143 @@ with tab4:
         st.info(f"💰 Capital Actual (Histórico): **${capital_actual:,.2f}**")
         edad_actual = st.number_input("Tu edad actual", min_value=18, max_value=90, value=30)
         edad_retiro = st.number_input("Edad de retiro", min_value=edad_actual+1, max_value=100, value=60)
-        tasa_interes = 8.0
-        st.caption(f"Tasa de Interés anual: **{tasa_interes}%**")
+        tasa_interes = st.number_input("Tasa de interés anual (%)", min_value=-20.0, max_value=50.0,
+                                       value=proyeccion.TASA_ANUAL_DEFECTO * 100, step=0.5)
         aporte_mensual = st.number_input("Aporte mensual extra (Opcional)", min_value=0.0, step=50.0)
+        crecimiento_aporte = st.number_input("Crecimiento anual del aporte (%)", min_value=0.0, max_value=50.0, value=0.0, step=0.5)
+        inflacion = st.number_input("Inflación anual (%)", min_value=0.0, max_value=50.0, value=0.0, step=0.5,
+                                    help="Si es mayor que 0 también se muestran los saldos en dinero de hoy.")
+        reglas_activas = [r for r in almacen.reglas_recurrentes(st.session_state.usuario_id) if r["activa"]]
+        uso_recurrentes = st.selectbox(
+            "Movimientos recurrentes", OPCIONES_RECURRENTES, index=1 if reglas_activas else 0, disabled=not reglas_activas,
+            help="Suma a los aportes lo que tus reglas recurrentes destinan cada mes a Ahorro e Inversión, "
+                 "o todo lo que sobra de ingresos menos gastos recurrentes.",
+        )
+        modo_proyeccion = st.radio("Modo", ["Tasa fija", "Escenarios", "Monte Carlo"], horizontal=True)
 
     with col_proj_der:
         st.markdown("### 🚀 Resultados Estimados")
         anos = edad_retiro - edad_actual
         meses = anos * 12
-        tasa_mensual = (tasa_interes / 100) / 12
+        tasa = tasa_interes / 100
+        crecimiento = crecimiento_aporte / 100
+        infl = inflacion / 100
         
         if anos > 0:
-            vf_capital = capital_actual * ((1 + tasa_mensual) ** meses)
-            vf_aportes = 0
-            if aporte_mensual > 0:
-                vf_aportes = aporte_mensual * ( ((1 + tasa_mensual) ** meses - 1) / tasa_mensual )
-            
-            valor_futuro = vf_capital + vf_aportes
+            flujo = None
+            if reglas_activas and uso_recurrentes != OPCIONES_RECURRENTES[0]:
+                flujo_rec = recurrentes.flujo_mensual(reglas_activas, meses)
+                flujo = flujo_rec["aporte"].to_numpy()
+                if uso_recurrentes == OPCIONES_RECURRENTES[2]:
+                    flujo = flujo + flujo_rec["neto"].to_numpy()
+
+            df_proj = proyeccion.serie_anual(capital_actual, aporte_mensual, anos, edad_actual, tasa, crecimiento, infl, flujo)
+            valor_futuro = df_proj["Saldo"].iloc[-1]
             
             st.metric(label=f"Capital a los {edad_retiro} años", value=f"${valor_futuro:,.2f}")
+            if infl > 0:
+                st.caption(f"En dinero de hoy: **${df_proj['Saldo real'].iloc[-1]:,.2f}**")
             
-            ganancia_intereses = valor_futuro - (capital_actual + (aporte_mensual * meses))
+            total_aportado = capital_actual + proyeccion.aportes(aporte_mensual, meses, crecimiento, flujo).sum()
+            ganancia_intereses = valor_futuro - total_aportado
             st.success(f"¡Intereses generados: **${ganancia_intereses:,.2f}**!")
 
-            data_points = []
-            saldo = capital_actual
-            for i in range(anos + 1):
-                data_points.append({"Edad": edad_actual + i, "Saldo": saldo})
-                saldo = saldo * (1 + (tasa_interes/100)) + (aporte_mensual * 12)
-            
-            df_proj = pd.DataFrame(data_points)
-            
-            fig_proj = px.line(df_proj, x="Edad", y="Saldo", markers=True, title="Curva de Crecimiento Patrimonial")
-            fig_proj.update_traces(line_color="#FFD700", line_width=4)
-            fig_proj.update_layout(yaxis_tickformat="$,.0f")
-            st.plotly_chart(fig_proj, use_container_width=True)
+            if modo_proyeccion == "Tasa fija":
+                st.plotly_chart(graficos.figura_proyeccion(df_proj, reales=infl > 0), use_container_width=True)
+
+            elif modo_proyeccion == "Escenarios":
+                # Sensibilidad del valor final a la tasa (filas) y al crecimiento del aporte (columnas)
+                tasas = tasa + np.arange(-2, 3) / 100
+                crecimientos = np.unique(np.array([0.0, crecimiento, 0.03, 0.05]))
+                rejilla = proyeccion.rejilla_escenarios(capital_actual, aporte_mensual, meses, tasas, crecimientos, infl, reales=infl > 0,
+                                                        flujo=flujo)
+                rejilla.index = [f"{t:.1%}" for t in rejilla.index]
+                rejilla.columns = [f"Aporte +{c:.1%}/año" for c in rejilla.columns]
+                st.caption("Capital final según tasa anual y crecimiento del aporte" + (" (dinero de hoy)" if infl > 0 else ""))
+                st.dataframe(rejilla.style.format("${:,.0f}"), use_container_width=True)
+
+            else:
+                col_mc1, col_mc2 = st.columns(2)
+                volatilidad = col_mc1.number_input("Volatilidad anual (%)", min_value=0.0, max_value=80.0,
+                                                   value=proyeccion.VOLATILIDAD_ANUAL_DEFECTO * 100, step=1.0)
+                opciones_sim = [n for n in (1000, 5000, 10000) if n * meses <= proyeccion.MAX_SIMULACIONES_MESES] or [1000]
+                simulaciones = col_mc2.selectbox("Simulaciones", opciones_sim, index=min(1, len(opciones_sim) - 1))
+                parametros = (capital_actual, aporte_mensual, meses, tasa, volatilidad / 100, crecimiento, infl, simulaciones)
+                clave_flujo = None if flujo is None else hash(flujo.tobytes())
+                bandas = cache_movimientos.recordar(
+                    st.session_state.usuario_id, ("monte_carlo", clave_flujo) + parametros,
+                    lambda: proyeccion.monte_carlo(*parametros[:-1], simulaciones=simulaciones, reales=infl > 0, flujo=flujo)
+                )
+                final = bandas.iloc[-1]
+                if infl > 0:
+                    st.caption("Percentiles del capital final en dinero de hoy")
+                col_p1, col_p2, col_p3 = st.columns(3)
+                col_p1.metric("Pesimista (p10)", f"${final['p10']:,.0f}")
+                col_p2.metric("Mediana (p50)", f"${final['p50']:,.0f}")
+                col_p3.metric("Optimista (p90)", f"${final['p90']:,.0f}")
+                st.plotly_chart(graficos.figura_monte_carlo(bandas, edad_actual), use_container_width=True)
+
+            if flujo is not None:
+                with st.expander("🔁 Flujo de caja de los movimientos recurrentes (próximos 12 meses)"):
+                    st.plotly_chart(graficos.figura_flujo_recurrente(flujo_rec.head(12)), use_container_width=True)
         else:
             st.warning("Ajusta la edad de retiro.")
 
+# --------------------------------------------------------------------------------
+# VISTA ACTIVA
+# --------------------------------------------------------------------------------
+VISTAS = dict(zip(NOMBRES_VISTAS, [vista_gestion, vista_estadisticas, vista_presupuesto, vista_proyeccion]))
+with metricas.medir("vista", vista=vista_activa):
+    VISTAS[vista_activa]()
+
 # Pie de página
 st.markdown("""
     <hr style="margin-top: 3rem; margin-bottom: 1rem;">
     <div style="text-align: center; color: gray;">
         <small>Personal Finance Developed for Everybody by William Ruiz © 2025</small>
     </div>
-    """, unsafe_allow_html=True)
\ No newline at end of file
+    """, unsafe_allow_html=True)
+
+# --------------------------------------------------------------------------------
+# PANEL DE RENDIMIENTO (OPCIONAL)
+# --------------------------------------------------------------------------------
+# PANEL_METRICAS = true muestra la traza de la ejecución y las métricas del
+# proceso; METRICAS_LOG = true escribe cada traza como una línea JSON en el log;
+# METRICAS_ARCHIVO = "ruta.prom" exporta las métricas en formato Prometheus.
+@st.cache_resource(show_spinner=False)
+def iniciar_exportacion_metricas(ruta):
+    return metricas.exportar_periodicamente(ruta)
+
+if st.secrets.get("METRICAS_ARCHIVO"):
+    iniciar_exportacion_metricas(st.secrets["METRICAS_ARCHIVO"])
+
+duracion_ejecucion = metricas.cerrar_traza(vista=vista_activa)
+if st.secrets.get("METRICAS_LOG", False):
+    metricas.registrar_traza(vista=vista_activa, ms=round(duracion_ejecucion * 1000, 2))
+
+if st.secrets.get("PANEL_METRICAS", False):
+    with st.expander("🛠️ Rendimiento"):
+        st.caption(f"Última ejecución: {duracion_ejecucion * 1000:,.1f} ms")
+        st.dataframe([
+            {"Sección": "  " * nivel + nombre, "Detalle": ", ".join(f"{k}={v}" for k, v in etiquetas.items()), "ms": round(segundos * 1000, 2)}
+            for nombre, etiquetas, segundos, nivel in metricas.traza()
+        ], use_container_width=True, hide_index=True)
+
+        st.markdown("##### Cachés")
+        st.dataframe([
+            {"Caché": cache, "Aciertos": int(aciertos), "Consultas": int(consultas), "Tasa": f"{aciertos / consultas:.0%}"}
+            for cache, (aciertos, consultas) in sorted(metricas.tasas_acierto().items())
+        ], use_container_width=True, hide_index=True)
+
+        st.markdown("##### Medidas acumuladas del proceso")
+        st.dataframe([
+            {"Métrica": nombre, "Etiquetas": ", ".join(f"{k}={v}" for k, v in etiquetas), "Cuenta": int(cuenta),
+             "Media": suma / cuenta, "Máximo": maximo}
+            for (nombre, etiquetas), (cuenta, suma, maximo) in sorted(metricas.observaciones().items())
+        ], use_container_width=True, hide_index=True)
+
+        col_exp1, col_exp2 = st.columns(2)
+        col_exp1.download_button("Descargar JSON", json.dumps(metricas.exportar_json(), default=str),
+                                 file_name="metricas.json", mime="application/json")
+        col_exp2.download_button("Descargar Prometheus", metricas.exportar_prometheus(),
+                                 file_name="metricas.prom", mime="text/plain")
@@ -0,0 +1,116 @@
+import math
+
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+# --- GRÁFICOS DE ESTADÍSTICAS ---
+# Construir las figuras de Plotly es lo más caro del panel. Las funciones de este
+# módulo son puras (solo dependen de los agregados recibidos), así que la app
+# guarda el resultado de `figuras_estadisticas` en la caché por usuario, con la
+# versión de los datos y el filtro como clave, y lo reutiliza mientras no cambien.
+
+# Máximo de puntos de la tendencia semanal; por encima se agrupan varias semanas por punto
+MAX_PUNTOS_SEMANALES = 104
+
+
+def reducir_semanas(df_semanal, max_puntos=MAX_PUNTOS_SEMANALES):
+    """Agrupa la serie semanal en bloques de k semanas si tiene más de `max_puntos` puntos.
+
+    Devuelve (serie, k). Cada bloque se etiqueta con su primera semana y suma sus gastos.
+    """
+    if len(df_semanal) <= max_puntos:
+        return df_semanal, 1
+    inicio = df_semanal["inicio_semana"].min()
+    k = math.ceil(((df_semanal["inicio_semana"].max() - inicio).days // 7 + 1) / max_puntos)
+    bloque = (df_semanal["inicio_semana"] - inicio).dt.days // (7 * k)
+    reducida = df_semanal.groupby(bloque).agg(inicio_semana=("inicio_semana", "min"), valor=("valor", "sum"))
+    return reducida.reset_index(drop=True), k
+
+
+def figura_gastos_categoria(df_gas):
+    df_gas_cat = df_gas.groupby("categoria", observed=True)["total"].sum().reset_index()
+    fig_pie = px.pie(df_gas_cat, values="total", names="categoria", hole=0.4)
+    fig_pie.update_layout(showlegend=False, margin=dict(t=30, b=0, l=0, r=0))
+    return fig_pie
+
+
+def figura_mensual(df, titulo):
+    df_mensual = df.groupby("periodo")["total"].sum().reset_index().rename(columns={"total": "valor"})
+    fig = px.bar(df_mensual, x="periodo", y="valor", title=titulo, color_discrete_sequence=["#3498DB"])
+    fig.update_layout(margin=dict(t=30, b=0, l=0, r=0))
+    return fig
+
+
+def figura_tendencia_semanal(df_agg_gas):
+    df_semanal = df_agg_gas.groupby("semana")["total"].sum().reset_index().rename(columns={"semana": "inicio_semana", "total": "valor"})
+    df_semanal["inicio_semana"] = pd.to_datetime(df_semanal["inicio_semana"])
+    df_semanal, semanas_por_punto = reducir_semanas(df_semanal)
+    fig_line = px.line(df_semanal, x="inicio_semana", y="valor", markers=semanas_por_punto == 1)
+    fig_line.update_traces(line_color='#E74C3C', line_width=3)
+    titulo_x = "Semana" if semanas_por_punto == 1 else f"Bloques de {semanas_por_punto} semanas"
+    fig_line.update_layout(xaxis_title=titulo_x, yaxis_title="Total Gastado", margin=dict(t=10, b=0, l=0, r=0))
+    return fig_line
+
+
+def ranking_gastos(df_gas):
+    df_ranking = df_gas.groupby("categoria", observed=True)["total"].sum().reset_index().sort_values("total", ascending=False)
+    df_ranking["Total"] = df_ranking["total"].apply(lambda x: f"${x:,.2f}")
+    return df_ranking[["categoria", "Total"]]
+
+
+def figuras_estadisticas(df_res, agregados_semanales):
+    """Figuras y tablas del panel para el resumen mensual `df_res` de un periodo.
+
+    `agregados_semanales()` devuelve los agregados por semana del mismo periodo;
+    solo se llama si hay gastos. Los elementos sin datos quedan en None.
+    """
+    df_gas = df_res[df_res["tipo"] == "gasto"]
+    df_bancos = df_gas[df_gas["categoria"].isin(["Bancos", "bancos"])]
+    df_ing = df_res[df_res["tipo"] == "ingreso"]
+    figuras = {"pie": None, "bancos": None, "semanal": None, "ranking": None, "ingresos": None}
+    if not df_gas.empty:
+        df_agg = agregados_semanales()
+        figuras["pie"] = figura_gastos_categoria(df_gas)
+        figuras["semanal"] = figura_tendencia_semanal(df_agg[df_agg["tipo"] == "gasto"])
+        figuras["ranking"] = ranking_gastos(df_gas)
+    if not df_bancos.empty:
+        figuras["bancos"] = figura_mensual(df_bancos, "Salidas categoría Bancos")
+    if not df_ing.empty:
+        figuras["ingresos"] = figura_mensual(df_ing, "Salidas categoría Ingresos")
+    return figuras
+
+
+# --- GRÁFICOS DE PROYECCIÓN ---
+def figura_proyeccion(df_proj, reales):
+    columnas = ["Saldo", "Saldo real"] if reales else ["Saldo"]
+    fig_proj = px.line(df_proj, x="Edad", y=columnas, markers=True, title="Curva de Crecimiento Patrimonial",
+                       color_discrete_sequence=["#FFD700", "#95A5A6"])
+    fig_proj.update_traces(line_width=4)
+    fig_proj.update_layout(yaxis_tickformat="$,.0f", yaxis_title="Saldo", legend_title_text="")
+    return fig_proj
+
+
+def figura_monte_carlo(bandas, edad_actual):
+    """Banda entre el primer y el último percentil y línea de la mediana; `bandas` trae el mes como índice."""
+    edades = edad_actual + bandas.index // 12
+    bajo, medio, alto = bandas.columns[0], bandas.columns[len(bandas.columns) // 2], bandas.columns[-1]
+    fig = go.Figure([
+        go.Scatter(x=edades, y=bandas[alto], line=dict(width=0), name=alto, showlegend=False),
+        go.Scatter(x=edades, y=bandas[bajo], line=dict(width=0), fill="tonexty", fillcolor="rgba(255, 215, 0, 0.25)",
+                   name=f"{bajo}–{alto}"),
+        go.Scatter(x=edades, y=bandas[medio], line=dict(color="#FFD700", width=4), name=f"Mediana ({medio})"),
+    ])
+    fig.update_layout(title="Simulación Monte Carlo", xaxis_title="Edad", yaxis_title="Saldo", yaxis_tickformat="$,.0f")
+    return fig
+
+
+def figura_flujo_recurrente(flujo):
+    """Ingresos y gastos de los movimientos recurrentes por mes, con el neto como línea."""
+    fig = go.Figure([
+        go.Bar(x=flujo.index, y=flujo["ingresos"], name="Ingresos", marker_color="#2ECC71"),
+        go.Bar(x=flujo.index, y=-flujo["gastos"], name="Gastos", marker_color="#E74C3C"),
+        go.Scatter(x=flujo.index, y=flujo["neto"], name="Neto", line=dict(color="#FFD700", width=3)),
+    ])
+    fig.update_layout(title="Flujo de caja recurrente", barmode="relative", yaxis_tickformat="$,.0f", legend_title_text="")
+    return fig
@@ -0,0 +1,231 @@
+import re
+
+import pandas as pd
+
+from datos import FORMAS_PAGO, TIPO_CATEGORIAS
+
+# --- IMPORTACIÓN DE EXTRACTOS BANCARIOS (CSV / OFX) ---
+# Los archivos se leen por bloques, se normalizan al formato de `movimientos`,
+# se descartan los que ya existen y se insertan en lotes grandes.
+
+TAMANO_BLOQUE = 5000
+TAMANO_LOTE_INSERCION = 500
+FILAS_VISTA_PREVIA = 20
+
+CATEGORIA_POR_DEFECTO = {"ingreso": "Otros Ingresos", "gasto": "Imprevistos"}
+
+# Nombres de columna aceptados en los CSV (en minúsculas y sin espacios extremos)
+ALIAS_COLUMNAS = {
+    "fecha": ["fecha", "date", "fecha operacion", "fecha operación", "fecha valor"],
+    "descripcion": ["descripcion", "descripción", "concepto", "detalle", "description", "memo"],
+    "valor": ["valor", "monto", "importe", "amount", "cantidad"],
+    "tipo": ["tipo", "type"],
+    "categoria": ["categoria", "categoría", "category"],
+    "forma_pago": ["forma_pago", "forma de pago", "pago"],
+}
+
+_CATEGORIAS_NORMALIZADAS = {
+    tipo: {c.lower(): c for c in categorias} for tipo, categorias in TIPO_CATEGORIAS.items()
+}
+_FORMAS_PAGO_NORMALIZADAS = {f.lower(): f for f in FORMAS_PAGO}
+
+
+def _renombrar_columnas(df):
+    nombres = {}
+    for col in df.columns:
+        clave = str(col).strip().lower()
+        for destino, alias in ALIAS_COLUMNAS.items():
+            if clave in alias and destino not in nombres.values():
+                nombres[col] = destino
+    return df.rename(columns=nombres)
+
+
+def _a_numero(serie):
+    # Acepta "1234.56", "-1,234.56", "1.234,56" y símbolos de moneda
+    texto = serie.astype(str).str.replace(r"[^\d,.\-]", "", regex=True)
+    europeo = texto.str.contains(r",\d{1,2}$", regex=True)
+    texto = texto.where(~europeo, texto.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+    texto = texto.where(europeo, texto.str.replace(",", "", regex=False))
+    return pd.to_numeric(texto, errors="coerce")
+
+
+def normalizar(df, forma_pago_defecto="Transferencia", modelo=None):
+    """Lleva un bloque leído del archivo a las columnas de `movimientos`.
+
+    Si no hay columna `tipo`, el signo del importe decide ingreso/gasto. Las
+    categorías y formas de pago se asignan a las de TIPO_CATEGORIAS y FORMAS_PAGO
+    (sin distinguir mayúsculas). Las filas sin categoría o con una desconocida
+    las clasifica `modelo` (un `categorizacion.ModeloCategorias`), si se pasa;
+    las que siguen sin categoría, y las formas de pago desconocidas, van a los
+    valores por defecto. Devuelve (bloque normalizado, número de filas inválidas
+    descartadas, número de filas categorizadas por el modelo).
+    """
+    df = _renombrar_columnas(df)
+    valor = _a_numero(df["valor"]) if "valor" in df else pd.Series(float("nan"), index=df.index)
+    fecha = pd.to_datetime(df["fecha"], dayfirst=True, format="mixed", errors="coerce") if "fecha" in df else pd.Series(pd.NaT, index=df.index)
+
+    if "tipo" in df:
+        tipo = df["tipo"].astype(str).str.strip().str.lower()
+        tipo = tipo.where(tipo.isin(["ingreso", "gasto"]), valor.lt(0).map({True: "gasto", False: "ingreso"}))
+    else:
+        tipo = valor.lt(0).map({True: "gasto", False: "ingreso"})
+
+    if "categoria" in df:
+        categoria_txt = df["categoria"].fillna("").astype(str).str.strip().str.lower()
+    else:
+        categoria_txt = pd.Series("", index=df.index)
+    categoria = pd.Series(None, index=df.index, dtype=object)
+    for nombre_tipo, validas in _CATEGORIAS_NORMALIZADAS.items():
+        es_tipo = tipo == nombre_tipo
+        categoria[es_tipo] = categoria_txt[es_tipo].map(validas)
+
+    if "forma_pago" in df:
+        forma_pago = df["forma_pago"].fillna("").astype(str).str.strip().str.lower().map(_FORMAS_PAGO_NORMALIZADAS).fillna(forma_pago_defecto)
+    else:
+        forma_pago = pd.Series(forma_pago_defecto, index=df.index)
+    descripcion = df["descripcion"].fillna("").astype(str).str.strip() if "descripcion" in df else pd.Series("", index=df.index)
+
+    automatica = pd.Series(False, index=df.index)
+    sin_categoria = categoria.isna()
+    if modelo is not None and sin_categoria.any():
+        sugeridas = modelo.clasificar(tipo[sin_categoria], descripcion[sin_categoria], forma_pago[sin_categoria], valor[sin_categoria].abs())
+        categoria[sin_categoria] = sugeridas["categoria"].to_numpy()
+        automatica[sin_categoria] = sugeridas["categoria"].notna().to_numpy()
+    for nombre_tipo, defecto in CATEGORIA_POR_DEFECTO.items():
+        categoria[(tipo == nombre_tipo) & categoria.isna()] = defecto
+
+    salida = pd.DataFrame({
+        "fecha": fecha.dt.normalize(),
+        "tipo": tipo,
+        "categoria": categoria,
+        "valor": valor.abs().round(2),
+        "descripcion": descripcion,
+        "forma_pago": forma_pago,
+    }, index=df.index)
+    validas = salida["fecha"].notna() & salida["valor"].gt(0)
+    return salida[validas].reset_index(drop=True), int((~validas).sum()), int((automatica & validas).sum())
+
+
+# --- LECTORES ---
+def leer_csv(archivo, tamano_bloque=TAMANO_BLOQUE):
+    """Genera bloques de DataFrame de un CSV; detecta el separador automáticamente."""
+    yield from pd.read_csv(archivo, sep=None, engine="python", dtype=str, chunksize=tamano_bloque, encoding_errors="replace")
+
+
+_RE_TRANSACCION = re.compile(r"<STMTTRN>(.*?)(?:</STMTTRN>|(?=<STMTTRN>)|(?=</BANKTRANLIST>))", re.S | re.I)
+_RE_CAMPO = re.compile(r"<(\w+)>([^<\r\n]*)")
+
+
+def leer_ofx(archivo, tamano_bloque=TAMANO_BLOQUE):
+    """Genera bloques de DataFrame con las transacciones (STMTTRN) de un archivo OFX/QFX.
+
+    Sirve tanto para OFX 1.x (SGML, sin etiquetas de cierre) como para OFX 2.x (XML).
+    """
+    contenido = archivo.read()
+    if isinstance(contenido, bytes):
+        contenido = contenido.decode("latin-1")
+    filas = []
+    for bloque in _RE_TRANSACCION.finditer(contenido):
+        campos = {k.upper(): v.strip() for k, v in _RE_CAMPO.findall(bloque.group(1))}
+        descripcion = " ".join(x for x in [campos.get("NAME", ""), campos.get("MEMO", "")] if x)
+        filas.append({
+            "fecha": campos.get("DTPOSTED", "")[:8],
+            "valor": campos.get("TRNAMT"),
+            "descripcion": descripcion,
+        })
+        if len(filas) >= tamano_bloque:
+            yield _bloque_ofx(filas)
+            filas = []
+    if filas:
+        yield _bloque_ofx(filas)
+
+
+def _bloque_ofx(filas):
+    df = pd.DataFrame(filas)
+    df["fecha"] = pd.to_datetime(df["fecha"], format="%Y%m%d", errors="coerce")
+    return df
+
+
+def leer_archivo(archivo, nombre):
+    if nombre.lower().endswith((".ofx", ".qfx")):
+        return leer_ofx(archivo)
+    return leer_csv(archivo)
+
+
+# --- DUPLICADOS ---
+def _claves(df):
+    # Fecha + tipo + valor + descripción, numeradas por ocurrencia: dos cafés
+    # idénticos el mismo día son dos movimientos, no un duplicado.
+    return (
+        df["fecha"].dt.strftime("%Y-%m-%d") + "|" + df["tipo"].astype(str) + "|"
+        + df["valor"].round(2).map("{:.2f}".format) + "|" + df["descripcion"].fillna("").astype(str).str.strip().str.lower()
+    )
+
+
+def claves_existentes(df_movimientos):
+    if df_movimientos.empty:
+        return set()
+    claves = _claves(df_movimientos)
+    return set(claves + "#" + claves.groupby(claves).cumcount().astype(str))
+
+
+# --- PROCESO COMPLETO ---
+def importar(almacen, usuario_id, bloques, existentes, forma_pago_defecto="Transferencia",
+             tamano_lote=TAMANO_LOTE_INSERCION, progreso=None, simular=False, modelo=None):
+    """Importa los bloques leídos de un extracto.
+
+    `existentes` son las claves de `claves_existentes()` de los movimientos ya
+    guardados. `modelo` categoriza las filas que no traen una categoría válida.
+    Con `simular=True` no escribe nada y solo cuenta y prepara una vista previa.
+    `progreso(leidas, insertadas)` se llama después de cada bloque.
+    Devuelve un dict con los contadores, la vista previa y las filas insertadas
+    (tal como las devuelve el almacenamiento, para actualizar la caché).
+    """
+    resultado = {"leidas": 0, "invalidas": 0, "duplicadas": 0, "insertadas": 0, "categorizadas": 0, "filas": [], "vista_previa": None}
+    vistas = {}
+    pendientes = []
+    vista_previa = []
+
+    for bruto in bloques:
+        bloque, invalidas, categorizadas = normalizar(bruto, forma_pago_defecto, modelo)
+        resultado["leidas"] += len(bruto)
+        resultado["invalidas"] += invalidas
+        resultado["categorizadas"] += categorizadas
+        if bloque.empty:
+            continue
+
+        claves = _claves(bloque)
+        ocurrencia = claves.groupby(claves).cumcount() + claves.map(vistas).fillna(0).astype(int)
+        for clave, n in claves.value_counts().items():
+            vistas[clave] = vistas.get(clave, 0) + n
+        duplicada = (claves + "#" + ocurrencia.astype(str)).isin(existentes)
+        resultado["duplicadas"] += int(duplicada.sum())
+        nuevas = bloque[~duplicada]
+
+        if simular:
+            resultado["insertadas"] += len(nuevas)
+            if len(vista_previa) < FILAS_VISTA_PREVIA:
+                vista_previa.append(nuevas.head(FILAS_VISTA_PREVIA))
+        else:
+            registros = nuevas.assign(fecha=nuevas["fecha"].dt.strftime("%Y-%m-%d"), usuario_id=usuario_id).to_dict("records")
+            pendientes.extend(registros)
+            while len(pendientes) >= tamano_lote:
+                _insertar_lote(almacen, pendientes[:tamano_lote], resultado)
+                pendientes = pendientes[tamano_lote:]
+        if progreso:
+            progreso(resultado["leidas"], resultado["insertadas"])
+
+    if pendientes:
+        _insertar_lote(almacen, pendientes, resultado)
+        if progreso:
+            progreso(resultado["leidas"], resultado["insertadas"])
+    if vista_previa:
+        resultado["vista_previa"] = pd.concat(vista_previa, ignore_index=True).head(FILAS_VISTA_PREVIA)
+    return resultado
+
+
+def _insertar_lote(almacen, registros, resultado):
+    filas = almacen.insertar_movimientos(registros)
+    resultado["insertadas"] += len(registros)
+    resultado["filas"].extend(filas)
+
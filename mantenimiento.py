@@ -0,0 +1,64 @@
+"""Tareas de mantenimiento fuera de la app.
+
+Uso:
+    python mantenimiento.py reconstruir-resumen [--usuario ID] [--secrets RUTA]
+    python mantenimiento.py materializar-recurrentes [--usuario ID] [--hasta AAAA-MM-DD] [--secrets RUTA]
+
+Lee la configuración (BACKEND, SUPABASE_URL, ...) del mismo secrets.toml que la app.
+"""
+import argparse
+import datetime
+import logging
+
+import toml
+
+import almacenamiento
+import recurrentes
+
+logger = logging.getLogger("mantenimiento")
+
+SECRETS_POR_DEFECTO = ".streamlit/secrets.toml"
+
+
+def reconstruir_resumen(almacen, args):
+    """Recalcula la tabla `resumen_mensual` desde `movimientos`, para repararla."""
+    almacen.reconstruir_resumen_mensual(args.usuario)
+    logger.info("Resumen mensual reconstruido (%s)", f"usuario {args.usuario}" if args.usuario else "todos los usuarios")
+
+
+def materializar_recurrentes(almacen, args):
+    """Genera los movimientos vencidos de las reglas recurrentes (para cron)."""
+    if not almacen.disponible("clave_idempotencia"):
+        logger.error("Falta sql/idempotencia.sql: sin ella se duplicarían ocurrencias; no se genera nada")
+        return
+    generados = recurrentes.materializar(almacen, hasta=args.hasta, usuario_id=args.usuario)
+    logger.info("%d movimientos recurrentes enviados hasta %s", generados, args.hasta or datetime.date.today())
+
+
+def main(argv=None):
+    # --secrets vale antes o después del comando; el valor por defecto lo pone
+    # solo el parser principal para que el de un comando no lo pise
+    comun = argparse.ArgumentParser(add_help=False)
+    comun.add_argument("--secrets", default=argparse.SUPPRESS, help="archivo de configuración (secrets.toml)")
+
+    parser = argparse.ArgumentParser(description="Mantenimiento de Finanzas Personales")
+    parser.add_argument("--secrets", default=SECRETS_POR_DEFECTO, help="archivo de configuración (secrets.toml)")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    p_resumen = comandos.add_parser("reconstruir-resumen", parents=[comun], help="recalcular el resumen mensual")
+    p_resumen.add_argument("--usuario", type=int, default=None, help="solo este usuario (por defecto, todos)")
+    p_resumen.set_defaults(funcion=reconstruir_resumen)
+
+    p_recurrentes = comandos.add_parser("materializar-recurrentes", parents=[comun], help="generar los movimientos recurrentes vencidos")
+    p_recurrentes.add_argument("--usuario", type=int, default=None, help="solo este usuario (por defecto, todos)")
+    p_recurrentes.add_argument("--hasta", type=datetime.date.fromisoformat, default=None, help="fecha límite (por defecto, hoy)")
+    p_recurrentes.set_defaults(funcion=materializar_recurrentes)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    almacen = almacenamiento.crear_almacenamiento(toml.load(args.secrets))
+    args.funcion(almacen, args)
+
+
+if __name__ == "__main__":
+    main()
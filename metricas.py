@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+# --- MÉTRICAS DEL PROCESO ---
+# Contadores compartidos por todas las sesiones del servidor. Cada métrica se
+# identifica por su nombre y un conjunto de etiquetas (operación, tipo de error...).
+
+_lock = threading.Lock()
+_contadores = defaultdict(float)
+# Observaciones (duraciones, filas, bytes): [cuenta, suma, máximo]
+_observaciones = {}
+
+
+def _clave(nombre, etiquetas):
+    return nombre, tuple(sorted(etiquetas.items()))
+
+
+def incrementar(nombre, cantidad=1, **etiquetas):
+    with _lock:
+        _contadores[_clave(nombre, etiquetas)] += cantidad
+
+
+def valor(nombre, **etiquetas):
+    with _lock:
+        return _contadores.get(_clave(nombre, etiquetas), 0)
+
+
+def contadores():
+    """Copia de todos los contadores como {(nombre, etiquetas): valor}."""
+    with _lock:
+        return dict(_contadores)
+
+
+def observar(nombre, cantidad, **etiquetas):
+    """Registra una medida (segundos, filas, bytes...); se guardan cuenta, suma y máximo."""
+    clave = _clave(nombre, etiquetas)
+    with _lock:
+        obs = _observaciones.get(clave)
+        if obs is None:
+            _observaciones[clave] = [1, cantidad, cantidad]
+        else:
+            obs[0] += 1
+            obs[1] += cantidad
+            obs[2] = max(obs[2], cantidad)
+
+
+def observaciones():
+    """Copia de las observaciones como {(nombre, etiquetas): (cuenta, suma, máximo)}."""
+    with _lock:
+        return {clave: tuple(obs) for clave, obs in _observaciones.items()}
+
+
+def acierto(cache, resultado):
+    """Cuenta una consulta a una caché; `resultado` es "acierto" o el motivo del fallo."""
+    incrementar("cache_consultas", cache=cache, resultado=resultado)
+
+
+def tasas_acierto():
+    """{cache: (aciertos, consultas)} a partir de los contadores `cache_consultas`."""
+    tasas = defaultdict(lambda: [0, 0])
+    for (nombre, etiquetas), cantidad in contadores().items():
+        if nombre == "cache_consultas":
+            etiquetas = dict(etiquetas)
+            tasas[etiquetas["cache"]][1] += cantidad
+            if etiquetas["resultado"] == "acierto":
+                tasas[etiquetas["cache"]][0] += cantidad
+    return {cache: tuple(valores) for cache, valores in tasas.items()}
+
+
+# --- TRAZA POR EJECUCIÓN ---
+# Streamlit ejecuta cada rerun del script en su propio hilo, así que la traza es
+# local al hilo: `medir` añade cada sección a la traza en curso (si la hay)
+# además de acumularla en `<nombre>_segundos`.
+_traza = threading.local()
+
+
+def iniciar_traza():
+    _traza.secciones = []
+    _traza.profundidad = 0
+    _traza.inicio = time.perf_counter()
+
+
+def traza():
+    """Secciones medidas en la ejecución actual: [(nombre, etiquetas, segundos, profundidad)]."""
+    # Las secciones aún abiertas tienen su hueco reservado en None
+    return [s for s in getattr(_traza, "secciones", []) if s is not None]
+
+
+def cerrar_traza(**etiquetas):
+    """Termina la traza del hilo, registra `rerun_segundos` y devuelve la duración total."""
+    inicio = getattr(_traza, "inicio", None)
+    if inicio is None:
+        return None
+    total = time.perf_counter() - inicio
+    observar("rerun_segundos", total, **etiquetas)
+    _traza.inicio = None
+    return total
+
+
+@contextmanager
+def medir(nombre, **etiquetas):
+    secciones = getattr(_traza, "secciones", None)
+    if secciones is not None:
+        # Se reserva el hueco al entrar para que las secciones queden en orden de inicio
+        posicion = len(secciones)
+        secciones.append(None)
+        profundidad = _traza.profundidad
+        _traza.profundidad += 1
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        segundos = time.perf_counter() - inicio
+        observar(f"{nombre}_segundos", segundos, **etiquetas)
+        if secciones is not None:
+            _traza.profundidad -= 1
+            secciones[posicion] = (nombre, etiquetas, segundos, profundidad)
+
+
+def medido(nombre, **etiquetas):
+    """Decorador: mide cada llamada a la función con `medir(nombre, **etiquetas)`."""
+    def decorador(funcion):
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with medir(nombre, **etiquetas):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
+
+
+# --- EXPORTACIÓN ---
+def exportar_json():
+    """Todas las métricas como lista de dicts, apta para logs estructurados."""
+    filas = [{"nombre": nombre, "etiquetas": dict(etiquetas), "tipo": "contador", "valor": cantidad}
+             for (nombre, etiquetas), cantidad in contadores().items()]
+    filas += [{"nombre": nombre, "etiquetas": dict(etiquetas), "tipo": "resumen", "cuenta": cuenta, "suma": suma, "maximo": maximo}
+              for (nombre, etiquetas), (cuenta, suma, maximo) in observaciones().items()]
+    return filas
+
+
+def _nombre_prometheus(nombre):
+    return "finanzas_" + re.sub(r"[^a-zA-Z0-9_]", "_", nombre)
+
+
+def _etiquetas_prometheus(etiquetas):
+    if not etiquetas:
+        return ""
+    pares = []
+    for clave, valor in etiquetas:
+        texto = str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pares.append(f'{clave}="{texto}"')
+    return "{" + ",".join(pares) + "}"
+
+
+def exportar_prometheus():
+    """Métricas en el formato de texto de Prometheus (contadores y resúmenes)."""
+    lineas = []
+    por_nombre = defaultdict(list)
+    for (nombre, etiquetas), cantidad in sorted(contadores().items()):
+        por_nombre[nombre].append((etiquetas, cantidad))
+    for nombre, series in por_nombre.items():
+        metrica = _nombre_prometheus(nombre)
+        lineas.append(f"# TYPE {metrica} counter")
+        lineas += [f"{metrica}{_etiquetas_prometheus(etiquetas)} {cantidad:g}" for etiquetas, cantidad in series]
+    por_nombre = defaultdict(list)
+    for (nombre, etiquetas), obs in sorted(observaciones().items()):
+        por_nombre[nombre].append((etiquetas, obs))
+    for nombre, series in por_nombre.items():
+        metrica = _nombre_prometheus(nombre)
+        lineas.append(f"# TYPE {metrica} summary")
+        for etiquetas, (cuenta, suma, _) in series:
+            lineas.append(f"{metrica}_count{_etiquetas_prometheus(etiquetas)} {cuenta:g}")
+            lineas.append(f"{metrica}_sum{_etiquetas_prometheus(etiquetas)} {suma:g}")
+    return "\n".join(lineas) + "\n"
+
+
+def exportar_periodicamente(ruta, intervalo=15):
+    """Escribe `exportar_prometheus()` en `ruta` cada `intervalo` segundos desde un hilo.
+
+    Pensado para el textfile collector de node_exporter: Streamlit no permite
+    añadir un endpoint /metrics propio.
+    """
+    def escribir():
+        while True:
+            try:
+                temporal = f"{ruta}.tmp"
+                with open(temporal, "w") as f:
+                    f.write(exportar_prometheus())
+                # Renombrar es atómico: el colector nunca lee un archivo a medias
+                os.replace(temporal, ruta)
+            except OSError as e:
+                logger.warning("No se pudieron exportar las métricas a %s: %s", ruta, e)
+            time.sleep(intervalo)
+
+    hilo = threading.Thread(target=escribir, name="metricas-export", daemon=True)
+    hilo.start()
+    return hilo
+
+
+def registrar_traza(**contexto):
+    """Escribe la traza de la ejecución actual como una línea JSON en el log."""
+    secciones = [{"seccion": nombre, "etiquetas": etiquetas, "ms": round(segundos * 1000, 2), "nivel": profundidad}
+                 for nombre, etiquetas, segundos, profundidad in traza()]
+    logger.info(json.dumps(dict(contexto, evento="rerun", secciones=secciones), default=str))
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+import datos
+
+# --- LÍMITES MENSUALES POR CATEGORÍA ---
+# Cada usuario puede fijar un límite de gasto por (año, mes, categoría). La
+# comparación con lo gastado se hace en una sola pasada sobre el resumen
+# mensual (unos cientos de filas por año, no el historial completo): se unen
+# gastos y límites por (año, mes, categoría) y todas las columnas derivadas se
+# calculan con operaciones vectorizadas, así que no hay un bucle por mes ni
+# por categoría aunque el usuario tenga muchos años de presupuestos.
+
+COLUMNAS_LIMITES = ["anio", "mes", "categoria", "limite"]
+MESES = ["Ene", "Feb", "Mar", "Abr", "May", "Jun", "Jul", "Ago", "Sep", "Oct", "Nov", "Dic"]
+CATEGORIAS_GASTO = datos.TIPO_CATEGORIAS["gasto"]
+
+# Fracción del límite a partir de la cual se avisa antes de superarlo
+UMBRAL_AVISO = 0.9
+ESTADOS = ["sin límite", "ok", "cerca", "excedido"]
+
+
+def limites_df(filas):
+    """Filas de `limites_categoria` como DataFrame (anio, mes, categoria, limite)."""
+    df = pd.DataFrame(filas, columns=COLUMNAS_LIMITES)
+    return df.astype({"anio": "int16", "mes": "int8", "categoria": "object", "limite": "float64"})
+
+
+def matriz_limites(limites, anio):
+    """Límites del año como tabla categoría x mes (Ene..Dic), con 0 donde no hay límite."""
+    del_anio = limites[limites["anio"] == anio]
+    matriz = del_anio.pivot_table(index="categoria", columns="mes", values="limite", aggfunc="sum")
+    matriz = matriz.reindex(index=CATEGORIAS_GASTO, columns=range(1, 13)).fillna(0.0)
+    matriz.columns = MESES
+    matriz.index.name = "categoria"
+    return matriz
+
+
+def filas_desde_matriz(matriz, usuario_id, anio, original=None):
+    """Convierte la tabla categoría x mes editada en filas para `guardar_limites_categoria`.
+
+    Con `original` (la tabla antes de editar) solo devuelve las celdas que cambiaron.
+    """
+    matriz = matriz.fillna(0).clip(lower=0).round(2)
+    if original is not None:
+        matriz = matriz.where(matriz.ne(original.reindex_like(matriz)))
+    largo = matriz.rename(columns=dict(zip(MESES, range(1, 13)))).stack(future_stack=True).dropna().rename("limite").reset_index()
+    largo.columns = ["categoria", "mes", "limite"]
+    return [
+        {"usuario_id": usuario_id, "anio": int(anio), "mes": int(mes), "categoria": categoria, "limite": float(limite)}
+        for categoria, mes, limite in largo.itertuples(index=False)
+    ]
+
+
+def varianza(resumen, limites, anio=None, mes=None):
+    """Gasto real frente al límite para cada (año, mes, categoría) con gasto o límite.
+
+    Devuelve anio, mes, categoria, real, limite, diferencia (límite - real),
+    uso (real / límite; NaN sin límite) y estado ("sin límite", "ok", "cerca",
+    "excedido"). `anio` y `mes` filtran el resultado.
+    """
+    gastos = datos.filtrar_resumen(resumen, anio, mes)
+    gastos = gastos[gastos["tipo"] == "gasto"]
+    real = gastos.groupby(["anio", "mes", "categoria"], observed=True)["total"].sum().rename("real").reset_index()
+    real = real.astype({"anio": "int16", "mes": "int8", "categoria": "object"})
+
+    lim = limites
+    if anio is not None:
+        lim = lim[lim["anio"] == anio]
+    if mes is not None:
+        lim = lim[lim["mes"] == mes]
+    lim = lim[lim["limite"] > 0]
+
+    tabla = real.merge(lim, on=["anio", "mes", "categoria"], how="outer")
+    tabla["real"] = tabla["real"].fillna(0.0).round(2)
+    tabla["limite"] = tabla["limite"].fillna(0.0)
+    tabla["diferencia"] = (tabla["limite"] - tabla["real"]).round(2)
+    con_limite = tabla["limite"] > 0
+    tabla["uso"] = np.where(con_limite, tabla["real"] / tabla["limite"].where(con_limite, 1.0), np.nan)
+    tabla["estado"] = pd.Categorical(
+        np.select(
+            [~con_limite, tabla["uso"] > 1, tabla["uso"] >= UMBRAL_AVISO],
+            ["sin límite", "excedido", "cerca"],
+            default="ok",
+        ),
+        categories=ESTADOS,
+    )
+    return tabla.sort_values(["anio", "mes", "categoria"], ignore_index=True)
+
+
+def alertas(tabla_varianza):
+    """Filas excedidas o cerca del límite, de la más excedida a la menos."""
+    avisos = tabla_varianza[tabla_varianza["estado"].isin(["excedido", "cerca"])]
+    return avisos.sort_values("uso", ascending=False, ignore_index=True)
+
+
+def matriz_uso(tabla_varianza, anio):
+    """Uso del límite (real / límite) del año como tabla categoría x mes; NaN sin límite."""
+    del_anio = tabla_varianza[tabla_varianza["anio"] == anio]
+    matriz = del_anio.pivot_table(index="categoria", columns="mes", values="uso", aggfunc="sum", dropna=False)
+    matriz = matriz.reindex(index=CATEGORIAS_GASTO, columns=range(1, 13))
+    matriz.columns = MESES
+    return matriz
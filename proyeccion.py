@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+
+# --- MOTOR DE PROYECCIÓN ---
+# Un único modelo para todo: capitalización mensual a la tasa nominal anual / 12 y
+# aportes al final de cada mes. El aporte crece una vez al año y la inflación se
+# usa para expresar los saldos en dinero de hoy. Todo se calcula con arrays de
+# NumPy, de modo que los parámetros pueden ser escalares o arrays (escenarios) y
+# el resultado trae una dimensión extra para los meses. `flujo` (un valor por
+# mes, p. ej. los movimientos recurrentes) se suma a los aportes sin crecimiento.
+
+TASA_ANUAL_DEFECTO = 0.08
+VOLATILIDAD_ANUAL_DEFECTO = 0.15
+SIMULACIONES_DEFECTO = 5000
+PERCENTILES = (10, 50, 90)
+# Monte Carlo: trayectorias simuladas a la vez (memoria ~ bloque x meses x 8 B)
+SIMULACIONES_POR_BLOQUE = 1000
+# Tope de simulaciones x meses por ejecución (tiempo de CPU del worker compartido)
+MAX_SIMULACIONES_MESES = 5_000_000
+
+
+def _col(x):
+    # Añade un eje al final para combinar parámetros con el eje de meses
+    return np.asarray(x, dtype="float64")[..., None]
+
+
+def aportes(aporte_mensual, meses, crecimiento_anual=0.0, flujo=None):
+    """Aporte de cada mes 1..meses; crece `crecimiento_anual` al empezar cada año."""
+    anio = np.arange(meses) // 12
+    resultado = _col(aporte_mensual) * (1 + _col(crecimiento_anual)) ** anio
+    if flujo is not None:
+        resultado = resultado + np.asarray(flujo, dtype="float64")[:meses]
+    return resultado
+
+
+def deflactor(meses, inflacion_anual=0.0):
+    """Factor para pasar los saldos de los meses 0..meses a dinero de hoy."""
+    return (1 + _col(inflacion_anual)) ** (-np.arange(meses + 1) / 12)
+
+
+def _acumular(capital, crecimiento, aporte):
+    # Saldo B_t = B_{t-1}·(1 + r_t) + c_t para todos los meses a la vez:
+    # con G_t = Π(1 + r), B_t = G_t · (capital + Σ c_k / G_k).
+    G = np.cumprod(crecimiento, axis=-1)
+    saldos = G * (_col(capital) + np.cumsum(aporte / G, axis=-1))
+    inicio = np.broadcast_to(_col(capital), saldos.shape[:-1] + (1,))
+    return np.concatenate([inicio, saldos], axis=-1)
+
+
+def saldos(capital, aporte_mensual, meses, tasa_anual=TASA_ANUAL_DEFECTO, crecimiento_aporte=0.0, inflacion=0.0, reales=False,
+           flujo=None):
+    """Saldo al final de cada mes 0..meses con rendimiento fijo.
+
+    Los parámetros pueden ser arrays que se combinan entre sí (broadcasting de
+    NumPy); el último eje del resultado son los meses.
+    """
+    r = _col(tasa_anual) / 12
+    crecimiento = np.broadcast_to(1 + r, np.broadcast(r, np.empty(meses)).shape)
+    resultado = _acumular(capital, crecimiento, aportes(aporte_mensual, meses, crecimiento_aporte, flujo))
+    if reales:
+        resultado = resultado * deflactor(meses, inflacion)
+    return resultado
+
+
+def valor_futuro(capital, aporte_mensual, meses, tasa_anual=TASA_ANUAL_DEFECTO, crecimiento_aporte=0.0, inflacion=0.0, reales=False,
+                 flujo=None):
+    return saldos(capital, aporte_mensual, meses, tasa_anual, crecimiento_aporte, inflacion, reales, flujo)[..., -1]
+
+
+def serie_anual(capital, aporte_mensual, anos, edad_actual, tasa_anual=TASA_ANUAL_DEFECTO, crecimiento_aporte=0.0, inflacion=0.0,
+                flujo=None):
+    """Saldo nominal y real al cumplir cada año, como DataFrame (Edad, Saldo, Saldo real)."""
+    meses = anos * 12
+    nominal = saldos(capital, aporte_mensual, meses, tasa_anual, crecimiento_aporte, flujo=flujo)
+    real = nominal * deflactor(meses, inflacion)
+    return pd.DataFrame({
+        "Edad": edad_actual + np.arange(anos + 1),
+        "Saldo": nominal[::12],
+        "Saldo real": real[::12],
+    })
+
+
+def rejilla_escenarios(capital, aporte_mensual, meses, tasas, crecimientos, inflacion=0.0, reales=False, flujo=None):
+    """Valor final para cada combinación de tasa (filas) y crecimiento del aporte (columnas)."""
+    tasas = np.asarray(tasas, dtype="float64")
+    crecimientos = np.asarray(crecimientos, dtype="float64")
+    finales = valor_futuro(capital, aporte_mensual, meses, tasas[:, None], crecimientos[None, :], inflacion, reales, flujo)
+    return pd.DataFrame(
+        finales,
+        index=pd.Index(tasas, name="tasa_anual"),
+        columns=pd.Index(crecimientos, name="crecimiento_aporte"),
+    )
+
+
+def monte_carlo(capital, aporte_mensual, meses, tasa_anual=TASA_ANUAL_DEFECTO, volatilidad_anual=VOLATILIDAD_ANUAL_DEFECTO,
+                crecimiento_aporte=0.0, inflacion=0.0, simulaciones=SIMULACIONES_DEFECTO, percentiles=PERCENTILES,
+                reales=False, semilla=0, flujo=None):
+    """Percentiles del saldo al cierre de cada año con rendimientos mensuales aleatorios.
+
+    Cada trayectoria usa rendimientos lognormales cuya media es la misma tasa
+    mensual del modelo fijo; la mediana queda por debajo de `saldos` por el
+    efecto de la volatilidad. Las trayectorias se simulan en bloques de
+    SIMULACIONES_POR_BLOQUE (matrices bloque x meses) y de cada una solo se
+    guardan los meses 0, 12, 24... y el último. Devuelve un DataFrame con una
+    columna por percentil (p10, p50, ...) y esos meses como índice (`mes`).
+    """
+    rng = np.random.default_rng(semilla)
+    sigma = volatilidad_anual / np.sqrt(12)
+    mu = np.log1p(tasa_anual / 12) - sigma ** 2 / 2
+    controles = np.unique(np.append(np.arange(0, meses + 1, 12), meses))
+    aporte = aportes(aporte_mensual, meses, crecimiento_aporte, flujo)
+    bloques = []
+    for inicio in range(0, simulaciones, SIMULACIONES_POR_BLOQUE):
+        n = min(SIMULACIONES_POR_BLOQUE, simulaciones - inicio)
+        crecimiento = np.exp(rng.normal(mu, sigma, size=(n, meses)))
+        bloques.append(_acumular(np.full(n, capital), crecimiento, aporte)[:, controles])
+    trayectorias = np.concatenate(bloques)
+    if reales:
+        trayectorias = trayectorias * deflactor(meses, inflacion)[..., controles]
+    bandas = np.percentile(trayectorias, percentiles, axis=0)
+    return pd.DataFrame(bandas.T, columns=[f"p{p}" for p in percentiles], index=pd.Index(controles, name="mes"))
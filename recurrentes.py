@@ -0,0 +1,204 @@
+import datetime
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+import metricas
+
+logger = logging.getLogger(__name__)
+
+# --- MOVIMIENTOS RECURRENTES ---
+# Una regla (sueldo, suscripción, cuota del préstamo...) genera un movimiento
+# cada `intervalo` días, semanas, meses o años desde `inicio`. Las ocurrencias
+# vencidas se materializan fuera del render de la página: un hilo del servidor
+# (`Programador`) o `python mantenimiento.py materializar-recurrentes` desde
+# cron. Cada ocurrencia lleva la clave de idempotencia `regla-<id>-<fecha>`, así
+# que si dos procesos generan la misma, o uno se cae antes de marcar la regla,
+# la base de datos no la duplica. `ultima_fecha` solo evita volver a pedirlas.
+
+FRECUENCIAS = ["diaria", "semanal", "mensual", "anual"]
+UNIDADES = {"diaria": "día(s)", "semanal": "semana(s)", "mensual": "mes(es)", "anual": "año(s)"}
+TAMANO_LOTE = 500
+INTERVALO_SEGUNDOS = 3600
+# Gastos que no se consumen sino que pasan al patrimonio (ver Proyección)
+CATEGORIAS_APORTE = ["Ahorro", "Inversion"]
+
+
+def _fecha(valor):
+    return valor if isinstance(valor, datetime.date) else datetime.date.fromisoformat(str(valor)[:10])
+
+
+def ocurrencias(regla, desde, hasta):
+    """Fechas de la regla entre `desde` y `hasta` (incluidos) como array datetime64[D].
+
+    Las reglas mensuales y anuales conservan el día de `inicio`; en meses más
+    cortos caen el último día (un 31 pasa a 28/29/30 y vuelve a 31 después).
+    """
+    inicio = _fecha(regla["inicio"])
+    if regla.get("fin"):
+        hasta = min(hasta, _fecha(regla["fin"]))
+    desde = max(desde, inicio)
+    if desde > hasta:
+        return np.array([], dtype="datetime64[D]")
+    paso = int(regla.get("intervalo") or 1)
+    base = np.datetime64(inicio, "D")
+
+    if regla["frecuencia"] in ("diaria", "semanal"):
+        dias = paso * (7 if regla["frecuencia"] == "semanal" else 1)
+        primera = -(-(desde - inicio).days // dias)
+        ultima = (hasta - inicio).days // dias
+        return base + np.arange(primera, ultima + 1) * np.timedelta64(dias, "D")
+
+    meses = paso * (12 if regla["frecuencia"] == "anual" else 1)
+    mes_inicio = base.astype("datetime64[M]")
+    # Pasos cuyo mes cae entre `desde` y `hasta`; el día exacto se filtra al final
+    primero = (np.datetime64(desde, "M") - mes_inicio).astype(int) // meses
+    ultimo = (np.datetime64(hasta, "M") - mes_inicio).astype(int) // meses
+    pasos = np.arange(primero, ultimo + 1)
+    primer_dia = mes_inicio + pasos * meses
+    dias_mes = ((primer_dia + 1).astype("datetime64[D]") - primer_dia.astype("datetime64[D]")).astype(int)
+    fechas = primer_dia.astype("datetime64[D]") + (np.minimum(inicio.day, dias_mes) - 1)
+    return fechas[(fechas >= np.datetime64(desde, "D")) & (fechas <= np.datetime64(hasta, "D"))]
+
+
+def proxima_fecha(regla, hoy=None):
+    """Siguiente ocurrencia aún no generada, o None si la regla ya terminó."""
+    hoy = hoy or datetime.date.today()
+    desde = _fecha(regla["ultima_fecha"]) + datetime.timedelta(days=1) if regla.get("ultima_fecha") else _fecha(regla["inicio"])
+    # Basta con mirar un intervalo completo hacia delante
+    fechas = ocurrencias(regla, desde, max(desde, hoy) + datetime.timedelta(days=366 * int(regla.get("intervalo") or 1)))
+    return fechas[0].item() if len(fechas) else None
+
+
+def movimientos_pendientes(regla, hasta):
+    """Movimientos de la regla vencidos hasta `hasta` que aún no se generaron."""
+    desde = _fecha(regla["ultima_fecha"]) + datetime.timedelta(days=1) if regla.get("ultima_fecha") else _fecha(regla["inicio"])
+    return [
+        {
+            "usuario_id": regla["usuario_id"],
+            "fecha": fecha,
+            "tipo": regla["tipo"],
+            "categoria": regla["categoria"],
+            "valor": regla["valor"],
+            "descripcion": regla.get("descripcion") or "",
+            "forma_pago": regla.get("forma_pago"),
+            "clave_idempotencia": f"regla-{regla['id']}-{fecha}",
+        }
+        for fecha in ocurrencias(regla, desde, hasta).astype(str)
+    ]
+
+
+def materializar(almacen, hasta=None, usuario_id=None, al_confirmar=None, tamano_lote=TAMANO_LOTE):
+    """Genera los movimientos vencidos hasta `hasta` (hoy) de las reglas activas.
+
+    Las filas de todas las reglas se insertan juntas en lotes de `tamano_lote`;
+    después de cada lote se avanza `ultima_fecha` de las reglas incluidas.
+    `al_confirmar(usuario_id, filas)` recibe las filas guardadas, como en la
+    cola de escritura. Devuelve el número de ocurrencias enviadas (las que ya
+    estaban guardadas se envían otra vez pero no se duplican).
+    """
+    hasta = hasta or datetime.date.today()
+    lote = []
+    total = 0
+
+    def enviar():
+        guardadas = almacen.insertar_movimientos([{k: v for k, v in fila.items() if k != "regla_id"} for fila in lote])
+        ultimas = {}
+        for fila in lote:
+            ultimas[fila["regla_id"]] = max(ultimas.get(fila["regla_id"], ""), fila["fecha"])
+        for regla_id, fecha in ultimas.items():
+            almacen.marcar_regla_recurrente(regla_id, fecha)
+        if al_confirmar is not None:
+            por_usuario = {}
+            for fila in guardadas:
+                por_usuario.setdefault(fila["usuario_id"], []).append(fila)
+            for uid, filas_usuario in por_usuario.items():
+                al_confirmar(uid, filas_usuario)
+        lote.clear()
+
+    with metricas.medir("recurrentes"):
+        for regla in almacen.reglas_recurrentes(usuario_id):
+            if not regla["activa"]:
+                continue
+            for fila in movimientos_pendientes(regla, hasta):
+                # `regla_id` solo sirve para marcar la regla; no se guarda
+                lote.append(dict(fila, regla_id=regla["id"]))
+                if len(lote) >= tamano_lote:
+                    total += len(lote)
+                    enviar()
+        if lote:
+            total += len(lote)
+            enviar()
+    metricas.incrementar("recurrentes_generados", total)
+    return total
+
+
+class Programador:
+    """Hilo que llama a `materializar` cada `intervalo` segundos (y al `despertar`)."""
+
+    def __init__(self, almacen, al_confirmar=None, intervalo=INTERVALO_SEGUNDOS, iniciar=True):
+        self.almacen = almacen
+        self.al_confirmar = al_confirmar
+        self.intervalo = intervalo
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._hilo = None
+        if iniciar:
+            self.iniciar()
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="recurrentes", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+
+    def despertar(self):
+        """Adelanta la siguiente pasada, p. ej. tras crear una regla."""
+        self._despertar.set()
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            self._despertar.clear()
+            try:
+                generados = materializar(self.almacen, al_confirmar=self.al_confirmar)
+                if generados:
+                    logger.info("%d movimientos recurrentes generados", generados)
+            except Exception:
+                logger.exception("No se pudieron generar los movimientos recurrentes")
+            self._despertar.wait(self.intervalo)
+
+
+# --- FLUJO DE CAJA PROYECTADO ---
+def flujo_mensual(reglas, meses, desde=None):
+    """Totales por mes de las ocurrencias futuras de las reglas activas.
+
+    El mes 1 es el mes calendario siguiente a `desde` (hoy). Devuelve un
+    DataFrame con una fila por mes y las columnas ingresos, gastos, aporte
+    (gastos de Ahorro e Inversión, incluidos en gastos) y neto (ingresos - gastos).
+    """
+    desde = desde or datetime.date.today()
+    primer_mes = np.datetime64(desde, "M") + 1
+    ultimo_dia = (primer_mes + meses).astype("datetime64[D]") - 1
+    totales = {"ingresos": np.zeros(meses), "gastos": np.zeros(meses), "aporte": np.zeros(meses)}
+    for regla in reglas:
+        if not regla["activa"]:
+            continue
+        fechas = ocurrencias(regla, primer_mes.astype("datetime64[D]").item(), ultimo_dia.item())
+        por_mes = np.bincount((fechas.astype("datetime64[M]") - primer_mes).astype(int), minlength=meses) * float(regla["valor"])
+        if regla["tipo"] == "ingreso":
+            totales["ingresos"] += por_mes
+        else:
+            totales["gastos"] += por_mes
+            if regla["categoria"] in CATEGORIAS_APORTE:
+                totales["aporte"] += por_mes
+    flujo = pd.DataFrame(totales, index=pd.period_range(primer_mes.item(), periods=meses, freq="M").astype(str))
+    flujo["neto"] = flujo["ingresos"] - flujo["gastos"]
+    return flujo
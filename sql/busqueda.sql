@@ -0,0 +1,64 @@
+-- Búsqueda de movimientos con facetas (Gestión, modo servidor).
+--
+-- El texto se busca con un índice GIN sobre el tsvector de la descripción:
+-- p_consulta llega ya armada desde la app ('merc:* & pago:*', cada palabra como
+-- prefijo), igual que el índice en memoria del modo local. La configuración
+-- 'simple' no quita palabras vacías ni reduce a la raíz: solo pasa a minúsculas.
+create index if not exists movimientos_descripcion_tsv_idx
+    on movimientos using gin (to_tsvector('simple', coalesce(descripcion, '')));
+
+-- Devuelve en una sola llamada:
+--   grupos: cantidad por (categoria, forma_pago, tipo) con los filtros de texto,
+--           valor y fecha; la app calcula con ellos el total y cada faceta.
+--   filas:  la página pedida con todos los filtros, en orden (fecha desc, id desc).
+create or replace function buscar_movimientos(
+    p_usuario_id bigint,
+    p_consulta text default null,
+    p_categorias text[] default null,
+    p_formas_pago text[] default null,
+    p_tipo text default null,
+    p_valor_min numeric default null,
+    p_valor_max numeric default null,
+    p_desde date default null,
+    p_hasta date default null,
+    p_limite int default 25,
+    p_desplazamiento int default 0
+)
+returns json
+language sql
+stable
+as $$
+    with base as (
+        select id, fecha, tipo, categoria, valor, descripcion, forma_pago
+        from movimientos
+        where usuario_id = p_usuario_id
+          and (p_consulta is null
+               or to_tsvector('simple', coalesce(descripcion, '')) @@ to_tsquery('simple', p_consulta))
+          and (p_valor_min is null or valor >= p_valor_min)
+          and (p_valor_max is null or valor <= p_valor_max)
+          and (p_desde is null or fecha >= p_desde)
+          and (p_hasta is null or fecha <= p_hasta)
+    )
+    select json_build_object(
+        'grupos', (
+            select coalesce(json_agg(g), '[]'::json)
+            from (
+                select categoria, forma_pago, tipo, count(*) as cantidad
+                from base
+                group by categoria, forma_pago, tipo
+            ) g
+        ),
+        'filas', (
+            select coalesce(json_agg(f), '[]'::json)
+            from (
+                select id, fecha, tipo, categoria, valor, descripcion, forma_pago
+                from base
+                where (p_categorias is null or categoria = any(p_categorias))
+                  and (p_formas_pago is null or forma_pago = any(p_formas_pago))
+                  and (p_tipo is null or tipo = p_tipo)
+                order by fecha desc, id desc
+                limit p_limite offset p_desplazamiento
+            ) f
+        )
+    );
+$$;
@@ -0,0 +1,28 @@
+-- Agregados de la pestaña Estadísticas calculados en Postgres.
+-- Devuelve una fila por (mes, semana, tipo, categoría) del periodo pedido, de modo
+-- que la app recibe O(categorías x periodos) filas en lugar del historial completo.
+-- Todos los filtros son opcionales (null = sin filtro); p_hasta es exclusivo y
+-- p_mes permite filtrar un mes de todos los años.
+create or replace function estadisticas_movimientos(
+    p_usuario_id bigint,
+    p_desde date default null,
+    p_hasta date default null,
+    p_mes int default null
+)
+returns table (periodo text, semana date, tipo text, categoria text, total numeric, cantidad bigint)
+language sql
+stable
+as $$
+    select to_char(fecha, 'YYYY-MM') as periodo,
+           date_trunc('week', fecha)::date as semana,
+           tipo,
+           categoria,
+           sum(valor) as total,
+           count(*) as cantidad
+    from movimientos
+    where usuario_id = p_usuario_id
+      and (p_desde is null or fecha >= p_desde)
+      and (p_hasta is null or fecha < p_hasta)
+      and (p_mes is null or extract(month from fecha) = p_mes)
+    group by 1, 2, 3, 4;
+$$;
@@ -0,0 +1,7 @@
+-- Clave de idempotencia de los movimientos: la cola de escritura de la app la
+-- asigna a cada movimiento y reenvía los lotes con upsert sobre esta columna,
+-- así que un reintento después de un timeout no duplica filas.
+alter table movimientos add column if not exists clave_idempotencia text;
+
+create unique index if not exists movimientos_clave_idempotencia_idx
+    on movimientos (clave_idempotencia);
@@ -0,0 +1,7 @@
+-- Índices para los accesos de la app: todas las consultas filtran por usuario
+-- y la mayoría además por rango de fecha (Estadísticas) u ordenan por fecha.
+create index if not exists movimientos_usuario_fecha_idx
+    on movimientos (usuario_id, fecha);
+
+create index if not exists presupuestos_usuario_anio_idx
+    on presupuestos (usuario_id, anio);
@@ -0,0 +1,10 @@
+-- Límites de gasto mensuales por categoría (pestaña Presupuesto). Una fila por
+-- (usuario, año, mes, categoría); un límite 0 equivale a no tener límite.
+create table if not exists limites_categoria (
+    usuario_id bigint not null references usuarios(id),
+    anio int not null,
+    mes int not null check (mes between 1 and 12),
+    categoria text not null,
+    limite numeric not null default 0 check (limite >= 0),
+    primary key (usuario_id, anio, mes, categoria)
+);
@@ -0,0 +1,23 @@
+-- Movimientos recurrentes (sueldo, suscripciones, cuotas...). Cada regla genera
+-- un movimiento cada `intervalo` días, semanas, meses o años desde `inicio`
+-- hasta `fin` (opcional). `ultima_fecha` es la última ocurrencia ya generada;
+-- las ocurrencias se insertan con clave_idempotencia = 'regla-<id>-<fecha>'
+-- (requiere idempotencia.sql), así que volver a generarlas no duplica nada.
+create table if not exists recurrentes (
+    id bigint generated by default as identity primary key,
+    usuario_id bigint not null references usuarios(id),
+    tipo text not null check (tipo in ('ingreso', 'gasto')),
+    categoria text not null,
+    valor numeric not null check (valor > 0),
+    descripcion text,
+    forma_pago text,
+    frecuencia text not null check (frecuencia in ('diaria', 'semanal', 'mensual', 'anual')),
+    intervalo int not null default 1 check (intervalo >= 1),
+    inicio date not null,
+    fin date,
+    ultima_fecha date,
+    activa boolean not null default true
+);
+
+create index if not exists recurrentes_usuario_idx on recurrentes (usuario_id);
+create index if not exists recurrentes_activas_idx on recurrentes (id) where activa;
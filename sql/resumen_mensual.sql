@@ -0,0 +1,71 @@
+-- Resumen mensual por usuario: (año, mes, tipo, categoría, forma de pago) -> suma y conteo.
+-- Se mantiene con un trigger en cada insert/update/delete de `movimientos`, así que
+-- los paneles leen unos cientos de filas en lugar del historial completo.
+-- Después de instalarlo, rellénalo con: select reconstruir_resumen_mensual();
+create table if not exists resumen_mensual (
+    usuario_id bigint not null,
+    anio int not null,
+    mes int not null,
+    tipo text not null,
+    categoria text not null,
+    forma_pago text not null default '',
+    total numeric not null default 0,
+    cantidad bigint not null default 0,
+    primary key (usuario_id, anio, mes, tipo, categoria, forma_pago)
+);
+
+create or replace function actualizar_resumen_mensual()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        update resumen_mensual
+           set total = total - old.valor, cantidad = cantidad - 1
+         where usuario_id = old.usuario_id
+           and anio = extract(year from old.fecha)::int
+           and mes = extract(month from old.fecha)::int
+           and tipo = old.tipo
+           and categoria = old.categoria
+           and forma_pago = coalesce(old.forma_pago, '');
+        delete from resumen_mensual where usuario_id = old.usuario_id and cantidad <= 0;
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        insert into resumen_mensual (usuario_id, anio, mes, tipo, categoria, forma_pago, total, cantidad)
+        values (new.usuario_id, extract(year from new.fecha)::int, extract(month from new.fecha)::int,
+                new.tipo, new.categoria, coalesce(new.forma_pago, ''), new.valor, 1)
+        on conflict (usuario_id, anio, mes, tipo, categoria, forma_pago)
+        do update set total = resumen_mensual.total + excluded.total,
+                      cantidad = resumen_mensual.cantidad + 1;
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists movimientos_resumen_mensual on movimientos;
+create trigger movimientos_resumen_mensual
+    after insert or update or delete on movimientos
+    for each row execute function actualizar_resumen_mensual();
+
+-- Recalcula el resumen desde cero (de un usuario o de todos, con null) para
+-- repararlo; lo usa `python mantenimiento.py reconstruir-resumen`.
+create or replace function reconstruir_resumen_mensual(p_usuario_id bigint default null)
+returns void
+language sql
+as $$
+    delete from resumen_mensual
+    where p_usuario_id is null or usuario_id = p_usuario_id;
+
+    insert into resumen_mensual (usuario_id, anio, mes, tipo, categoria, forma_pago, total, cantidad)
+    select usuario_id,
+           extract(year from fecha)::int,
+           extract(month from fecha)::int,
+           tipo,
+           categoria,
+           coalesce(forma_pago, ''),
+           sum(valor),
+           count(*)
+    from movimientos
+    where p_usuario_id is null or usuario_id = p_usuario_id
+    group by 1, 2, 3, 4, 5, 6;
+$$;
@@ -0,0 +1,9 @@
+-- Tokens de sesión revocados ("Cerrar Sesión"). Una fila por nonce hasta que el
+-- token expira (`expira` en segundos desde epoch); la app borra las vencidas al
+-- revocar. Sin esta tabla la revocación solo dura mientras viva el proceso.
+create table if not exists sesiones_revocadas (
+    nonce text primary key,
+    expira bigint not null
+);
+
+create index if not exists sesiones_revocadas_expira_idx on sesiones_revocadas (expira);
@@ -0,0 +1,12 @@
+-- Resumen barato de los movimientos de un usuario.
+-- datos.sincronizar() lo compara con la copia local para detectar borrados
+-- sin descargar el historial: si conteo y suma de ids coinciden, no hay nada que hacer.
+create or replace function resumen_movimientos(p_usuario_id bigint)
+returns table (total bigint, suma_ids numeric)
+language sql
+stable
+as $$
+    select count(*), coalesce(sum(id), 0)
+    from movimientos
+    where usuario_id = p_usuario_id;
+$$;